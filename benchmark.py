@@ -0,0 +1,274 @@
+"""
+This file contains the benchmarks of the genetic algorithm. It times rendering (Painting.getImage), scoring
+(Darwin.fitness, both from scratch and after a single point moved), crossover (the children of a whole generation),
+mutation, saving and loading checkpoints and a full generation on synthetic targets of a few sizes and point counts.
+
+The targets and the populations are generated from fixed seeds, so every run benchmarks exactly the same paintings. Next to
+the timings each case records a hash of the rendered image and its fitness, so a new renderer or fitness engine can be
+checked for giving the same output as well as for speed.
+
+The results are written as JSON. Passing --baseline compares the results to an earlier results file, prints the speedup
+of every benchmark and exits with an error if a benchmark got slower than the tolerance allows or if the output changed.
+The comparison uses the median of the --repeat measurements, since a single lucky measurement in the baseline makes the
+best times look like a slowdown. Timings of the same code still move by 20 to 30 percent between runs on a busy machine,
+so the default tolerance of 1.5 only flags real slowdowns; lower it on a quiet machine or raise --repeat to catch smaller
+ones.
+
+Example command lines:
+    python3 benchmark.py --sizes small sample --points 100 500 --output baseline.json
+    python3 benchmark.py --sizes small sample --points 100 500 --baseline baseline.json
+"""
+
+from darwin import Darwin
+from painting import Painting
+from time import perf_counter
+from PIL import Image
+import numpy as np
+import statistics
+import tempfile
+import platform
+import argparse
+import itertools
+import hashlib
+import json
+import sys
+import os
+
+# the synthetic targets, 'sample' is the size of the image in 'Testing Images'
+SIZES = {
+    'small': (256, 256),
+    'sample': (800, 940),
+    'large': (2048, 2048),
+}
+POINT_COUNTS = (100, 500, 1000, 5000)
+BENCHMARKS = ('render', 'fitness', 'incremental_fitness', 'crossover', 'mutate', 'checkpoint', 'generation')
+# every measurement calls the benchmark often enough to take at least this many seconds, so fast benchmarks are not
+# lost in the timer resolution and the noise of the machine
+MEASUREMENT_TIME = 0.05
+SEED = 0
+
+
+def syntheticTarget(width, height, seed=SEED):
+    """
+    Returns an RGB image with smooth gradients, a few hard edged discs and some noise, similar enough to a photo that
+    the paintings have to work for their fitness.
+
+    width, height: the size of the image
+    seed: optional, the seed of the image
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width] / max(width, height)
+    image = np.stack([x, y, (x + y) / 2], axis=-1) * 255
+    for _ in range(12):
+        cx, cy, radius = rng.random(3) * [1, 1, 0.3]
+        image[(x - cx) ** 2 + (y - cy) ** 2 < radius ** 2] = rng.integers(0, 256, 3)
+    image += rng.normal(0, 8, image.shape)
+    return Image.fromarray(np.clip(image, 0, 255).astype(np.uint8), 'RGB')
+
+
+def measure(function, repeat, setup=None):
+    """
+    Times a function and returns the best and the median time of a single call in seconds. The number of calls per
+    measurement is calibrated first, like timeit does, so every measurement takes at least MEASUREMENT_TIME.
+
+    function: the function to time, it is called with the return value of setup if there is one
+    repeat: the number of measurements
+    setup: optional, a function called before every call that is not timed
+    """
+    def timeCalls(calls):
+        # the total time of some calls, without the time spent in setup
+        if setup is None:
+            start = perf_counter()
+            for _ in range(calls):
+                function()
+            return perf_counter() - start
+        elapsed = 0.0
+        for _ in range(calls):
+            argument = setup()
+            start = perf_counter()
+            function(argument)
+            elapsed += perf_counter() - start
+        return elapsed
+
+    # 1, 2, 5, 10, 20, 50, ... calls until they take long enough, which also warms up the caches
+    calls = 1
+    for factor in itertools.cycle((2, 2.5, 2)):
+        if timeCalls(calls) >= MEASUREMENT_TIME:
+            break
+        calls = round(calls * factor)
+    times = [timeCalls(calls) / calls for _ in range(repeat)]
+    return min(times), statistics.median(times)
+
+
+def benchmarkCase(width, height, num_points, repeat, population_size, benchmarks=BENCHMARKS):
+    """
+    Runs the benchmarks for one size and point count and returns a dictionary with the timings and the output checks.
+
+    width, height: the size of the synthetic target
+    num_points: the number of points of each painting
+    repeat: the number of measurements of each benchmark
+    population_size: the size of the population used for the generation benchmark
+    benchmarks: optional, the names of the benchmarks to run
+    """
+    darwin = Darwin(syntheticTarget(width, height), population_size, num_points, seed=SEED)
+    darwin.stats_format = None
+    painting = darwin.population[0]
+    genome = painting.toArray().copy()
+    timings = {}
+
+    # a new painting has no render cache, so these are full renders
+    def freshPainting():
+        return Painting(genome, width, height)
+
+    if 'render' in benchmarks:
+        timings['render'] = measure(lambda p: p.getImage(), repeat, freshPainting)
+    if 'fitness' in benchmarks:
+        timings['fitness'] = measure(darwin.fitness, repeat, freshPainting)
+    if 'incremental_fitness' in benchmarks:
+        darwin.fitness(painting)
+
+        # a child that only differs from the painting by one moved point, like most children of a generation
+        def movedPoint():
+            child = Painting(genome, width, height)
+            child.inherit(painting)
+            child.genome[0, :2] += 3
+            return child
+        timings['incremental_fitness'] = measure(darwin.fitness, repeat, movedPoint)
+    if 'crossover' in benchmarks:
+        # the crossover of a whole generation
+        pairs = darwin.selectParents(darwin.population, len(darwin.population) // 2)
+        timings['crossover'] = measure(lambda: darwin.crossover(darwin.population, pairs), repeat)
+    if 'mutate' in benchmarks:
+        mutant = freshPainting()
+        timings['mutate'] = measure(lambda: mutant.mutate(darwin.mutation_prob), repeat)
+    if 'checkpoint' in benchmarks:
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'checkpoint.npz')
+
+            def saveAndLoad():
+                darwin.savePopulation(0, filename)
+                darwin.loadPopulation(filename)
+            timings['checkpoint'] = measure(saveAndLoad, repeat)
+    if 'generation' in benchmarks:
+        # the first generation renders everything from scratch, so it is run once before timing
+        def generation(population):
+            darwin.population = population
+            sorted_population, _ = darwin.sortByFitness()
+            darwin.createNewPopulation(sorted_population, 1)
+        generation(darwin.population)
+        # every call starts from the same children, random state and fitness cache, so every call does the same work
+        # however many calls a measurement makes
+        children, state, cache = darwin.population, darwin.rng.bit_generator.state, darwin.fitness_cache.toArrays()
+
+        def sameChildren():
+            darwin.rng.bit_generator.state = state
+            darwin.fitness_cache.fromArrays(*cache)
+            population = []
+            for child in children:
+                copy = Painting(child.genome.copy(), width, height)
+                copy.inherit(child)
+                population.append(copy)
+            return population
+        timings['generation'] = measure(generation, repeat, sameChildren)
+
+    # the output of the renderer and of the fitness engine for the same genome, to compare against a baseline
+    reference = freshPainting()
+    checks = {
+        'image_sha256': hashlib.sha256(reference.getImage().tobytes()).hexdigest(),
+        'fitness': darwin.fitness(reference),
+    }
+    darwin.close()
+    return {
+        'size': [width, height],
+        'num_points': num_points,
+        'timings': {name: {'best': best, 'median': median} for name, (best, median) in timings.items()},
+        'checks': checks,
+    }
+
+
+def caseName(case):
+    # the key used to match cases between results files
+    width, height = case['size']
+    return f'{width}x{height}-{case["num_points"]}'
+
+
+def compareResults(results, baseline, tolerance):
+    """
+    Prints the speedup of every benchmark compared to a baseline and returns a list of problems: benchmarks that are
+    slower than the baseline by more than the tolerance, and cases whose output is different from the baseline.
+
+    results, baseline: results dictionaries as written by main
+    tolerance: the largest allowed ratio of the new median time to the baseline median time
+    """
+    problems = []
+    baseline_cases = {caseName(case): case for case in baseline['cases']}
+    for case in results['cases']:
+        name = caseName(case)
+        old = baseline_cases.get(name)
+        if old is None:
+            print(f'{name}: not in the baseline')
+            continue
+        if case['checks']['image_sha256'] != old['checks']['image_sha256']:
+            problems.append(f'{name}: the rendered image is different')
+        if abs(case['checks']['fitness'] - old['checks']['fitness']) > 1e-9:
+            problems.append(f'{name}: the fitness is {case["checks"]["fitness"]}, was {old["checks"]["fitness"]}')
+        for benchmark, timing in case['timings'].items():
+            if benchmark not in old['timings']:
+                continue
+            # the median of the repeats, the best time of a noisy run is an outlier in either direction
+            ratio = timing['median'] / old['timings'][benchmark]['median']
+            print(f'{name} {benchmark}: {old["timings"][benchmark]["median"] * 1000:.3f} ms -> '
+                  f'{timing["median"] * 1000:.3f} ms ({1 / ratio:.2f}x)')
+            if ratio > tolerance:
+                problems.append(f'{name} {benchmark}: {ratio:.2f} times slower than the baseline')
+    return problems
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the renderer, the fitness function and the genetic operators.')
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES),
+                        help='the sizes of the synthetic targets')
+    parser.add_argument('--points', nargs='+', type=int, default=list(POINT_COUNTS), help='the numbers of points')
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=5, help='the number of measurements of each benchmark')
+    parser.add_argument('--population-size', type=int, default=10, help='the population size of the generation benchmark')
+    parser.add_argument('--output', default='benchmark.json', help='the JSON file the results are written to')
+    parser.add_argument('--baseline', help='a results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='how many times slower than the baseline the median time of a benchmark may be')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    results = {
+        'machine': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'repeat': args.repeat,
+        'cases': [],
+    }
+    for size in args.sizes:
+        width, height = SIZES[size]
+        for num_points in args.points:
+            case = benchmarkCase(width, height, num_points, args.repeat, args.population_size, args.benchmarks)
+            results['cases'].append(case)
+            timings = ', '.join(f'{name} {timing["best"] * 1000:.3f} ms' for name, timing in case['timings'].items())
+            print(f'{caseName(case)}: {timings}')
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            problems = compareResults(results, json.load(file), args.tolerance)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
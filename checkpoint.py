@@ -0,0 +1,91 @@
+"""
+This file contains the functions that save and load checkpoints of the Darwin class.
+
+A checkpoint is a compressed .npz file holding everything needed to continue a run exactly where it stopped:
+    - version: the version of the checkpoint layout
+    - generation: the last generation that was finished
+    - img_size: the width and height of the paintings
+    - genomes: the genomes of the whole population concatenated into one (sum of N, 5) int16 array
+    - lengths: the number of points in each genome, used to split genomes back up
+    - state: a JSON string with the state of the random module and of the NumPy generator, and the mutation schedule
+    - cache_keys, cache_values: the genome hashes and fitness values of the FitnessCache of the run (since version 2)
+
+Checkpoints are written to a temporary file in the same directory which is then renamed over the old checkpoint, so a run
+that is killed while saving leaves the previous checkpoint intact. Text checkpoints written by older versions
+('Generation: N' followed by one 'x,y,r,g,b;' line per painting) can still be loaded.
+"""
+
+from genome import DTYPE, genomeFromString
+import numpy as np
+import json
+import os
+
+VERSION = 2
+
+
+def saveCheckpoint(filename, genomes, generation, img_size, state, cache=None):
+    """
+    Atomically writes a checkpoint.
+
+    filename: the path of the checkpoint, should end in .npz
+    genomes: a list of (N, 5) genomes, one for each painting
+    generation: the last generation that was finished
+    img_size: the (width, height) of the paintings
+    state: a dictionary that can be stored as JSON, see Darwin.getState
+    cache: optional, the (keys, values) arrays of a FitnessCache, see FitnessCache.toArrays
+    """
+    cache_keys, cache_values = cache if cache is not None else (np.empty((0, 0), np.uint8), np.empty(0))
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, f'.{os.path.basename(filename)}.tmp')
+    with open(temporary, 'wb') as file:
+        np.savez_compressed(file,
+                            version=VERSION,
+                            generation=generation,
+                            img_size=np.array(img_size),
+                            genomes=np.concatenate(genomes).astype(DTYPE) if genomes else np.empty((0, 5), DTYPE),
+                            lengths=np.array([len(genome) for genome in genomes], dtype=np.int64),
+                            state=json.dumps(state),
+                            cache_keys=cache_keys,
+                            cache_values=cache_values)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, filename)
+
+
+def loadCheckpoint(filename):
+    """
+    Reads a checkpoint and returns a dictionary with the keys generation, genomes, img_size, state and cache.
+    For old text checkpoints img_size, state and cache are None, cache is also None for version 1 checkpoints.
+
+    filename: the path of a .npz or an old .txt checkpoint
+    """
+    if not filename.endswith('.npz'):
+        return loadTextCheckpoint(filename)
+    with np.load(filename) as data:
+        version = int(data['version'])
+        if version > VERSION:
+            raise ValueError(f'{filename} is a version {version} checkpoint, this version can read up to {VERSION}')
+        lengths = data['lengths']
+        genomes = np.split(data['genomes'], np.cumsum(lengths)[:-1]) if len(lengths) else []
+        return {
+            'generation': int(data['generation']),
+            'genomes': genomes,
+            'img_size': tuple(int(n) for n in data['img_size']),
+            'state': json.loads(str(data['state'])),
+            'cache': (data['cache_keys'], data['cache_values']) if 'cache_keys' in data else None,
+        }
+
+
+def loadTextCheckpoint(filename):
+    # reads a checkpoint in the old text format
+    genomes = []
+    generation = 0
+    with open(filename, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line.startswith('G'):
+                generation = int(line.split(' ')[1])
+            elif line:
+                genomes.append(genomeFromString(line))
+    return {'generation': generation, 'genomes': genomes, 'img_size': None, 'state': None, 'cache': None}
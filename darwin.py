@@ -6,81 +6,346 @@ to replicate a supplied image using a Voronoi diagram.
 This class takes in 3 required parameters: target_image which is the image you want to replicate, population_size
 which is how large you want the population to be (larger populations will have more potential diversity but will take more time)
 and num_points which represents the number of points each painting should have.
-
-If this file is run this will create a new Darwin object with a population size of 200 and 500 points per image that
-will try to replicate the image at 'Testing Images/original_image.png'.
+Every generation the time spent in each phase (rendering, fitness, selection, crossover, mutation, checkpoint and output
+file I/O) and counters like the number of pixels rendered are written to GAStats.jsonl (or GAStats.csv) in the run
+directory, see instrumentation.py. Setting profile_generations runs cProfile over that many generations and saves
+the result to profile.prof in the run directory.
+
+Runs can evolve coarse to fine: resolution_levels is a list of downscale factors like [8, 4, 2, 1], and the population is
+evolved against the target shrunk by each factor in turn, which makes early generations cheaper by about the square of the
+factor. The level changes at the generations in resolution_generations, or when the best fitness has not improved by
+resolution_min_improvement for resolution_patience generations. The points are scaled up at every level change, like
+doubleGenes and removePoints change the genomes between phases. Fitness values are those of the current level, but
+the run log always holds points scaled to the full size of the target.
+
+The elitism best paintings of every generation are carried over to the next one unchanged. Fitness values are kept in a
+FitnessCache keyed by a hash of the genome, so elites and children that came out identical to a painting that was already
+scored cost a hash lookup instead of a render. The cache is saved in checkpoints.
+
+It also takes in 4 optional parameters: workers which is the number of processes used to score the population, run_dir
+which is the directory the checkpoint and output files are written to, seed which seeds the random number generator of
+the run (self.rng, passed to every random step) so a run can be reproduced, and initializer which makes the first
+population (see initialization.py). With more than one worker, paintings that have to be rendered from scratch are
+scored by a process pool (see evaluation.py) while the ones that can be updated incrementally are scored in this
+process. The fitness values are the same for any number of workers.
+
+When refine_rounds is above 0, the best painting is refined directly against the target once the run is over (see
+refine.py) and saved to refined.png and refined.txt in the run directory.
+
+If this file is run it runs the command line in experiments.py, which by default creates a new Darwin object with a
+population size of 200 and 500 points per image that will try to replicate the image at 'Testing Images/original_image.png'.
+Run 'python3 darwin.py --help' to see the options.
 """
 
-from painting import Painting
+from painting import Painting, FULL_RENDER_FRACTION
+from checkpoint import saveCheckpoint, loadCheckpoint
+from genome import crossoverPopulation, mutateGenome, randomGenome, scaleGenome
+from fitness import FitnessEngine, FitnessCache
+from evaluation import initWorker, scoreGenome
+from instrumentation import Instrumentation
+from runlog import RunLog, fitnessStats
+from scheduler import Scheduler, DOUBLE, REMOVE, STOP
+from refine import refinePainting, savePainting
+from multiprocessing import Pool
 from PIL import Image
-from imgcompare import image_diff_percent
+import numpy as np
+import cProfile
 import random
-import sys
 import os
 
+# the files written to the run directory
+CHECKPOINT_FILE = 'checkpoint.npz'
+# the run log, GALog.stats and GALog.genomes, see runlog.py
+LOG_NAME = 'GALog'
+# the image of the refined best painting, its points are saved next to it in refined.txt, see refineBest
+REFINED_FILE = 'refined.png'
+# the text checkpoint written by older versions, it is still loaded if there is no binary checkpoint
+LEGACY_CHECKPOINT = 'checkpoint.txt'
+
 
 class Darwin:
-    def __init__(self, target_image, population_size, num_points):
+    def __init__(self, target_image, population_size, num_points, workers=1, run_dir='.', seed=None, initializer=None):
         """
         Sets the image width and height to the width and height of the target image.
-        Creates a random new population of paintings.
+        Creates a random new population of paintings, or the population returned by initializer(target_image,
+        population_size, num_points, rng=self.rng) if an initializer is given (see initialization.py).
         numGenerations represents how many generations the population should evolve for.
         This process takes a long time, usually greater than 5000 generations.   
         """
+        if seed is not None:
+            random.seed(seed)
+        # every random step of the run draws from this generator, so runs in the same process do not share one
+        self.rng = np.random.default_rng(seed)
         self.img_width, self.img_height = target_image.size
-        self.population = [Painting(num_points, self.img_width, self.img_height) for _ in range(population_size)]
+        if initializer is None:
+            self.population = [Painting(randomGenome(num_points, self.img_width, self.img_height, self.rng),
+                                        self.img_width, self.img_height) for _ in range(population_size)]
+        else:
+            genomes = initializer(target_image, population_size, num_points, rng=self.rng)
+            self.population = [Painting(g, self.img_width, self.img_height) for g in genomes]
+        # the target at full size, target_image is the target at the current resolution level
+        self.full_target = target_image
         self.target_image = target_image
+        # the target is decoded once, paintings are scored against its array
+        self.fitness_engine = FitnessEngine(target_image)
+        # timers and counters for every phase of a generation, stats_format is 'jsonl', 'csv' or None
+        self.instrumentation = Instrumentation()
+        self.stats_format = 'jsonl'
+        self.profile_generations = 0
+        # the error function is timed on its own, it is created once so the render cache of paintings can recognize it
+        self.window_error = self.instrumentation.timed('fitness', self.fitness_engine.window_error)
+        # the fitness of recently scored genomes, see evaluate
+        self.fitness_cache = FitnessCache()
+        # the number of the best paintings that are carried over to the next generation unchanged
+        self.elitism = 0
         self.numGenerations = 12000
+        # the mutation schedule: mutation_prob until late_mutation_generation, then late_mutation_prob
+        # set late_mutation_generation to None to keep the same mutation probability for the whole run
+        self.mutation_prob = 0.005
+        self.late_mutation_prob = 0.001
+        self.late_mutation_generation = 4500
+        # the probability that a point of a child is recoloured toward the target under its cell, see Painting.recolor
+        self.recolor_prob = 0
+        # the points are doubled at double_generation and num_removed points are removed at remove_generation
+        # these steps are skipped when they are None
+        self.double_generation = None
+        self.remove_generation = None
+        self.num_removed = 100
+        # the scheduler decides the mutation settings of every generation and when to double, remove or stop, the
+        # default Scheduler follows the attributes above, see scheduler.py
+        self.scheduler = Scheduler()
+        # set when the scheduler stops the run
+        self.stopped = False
+        # the coarse to fine schedule, see setLevel. A single level of 1 evolves at full resolution the whole run
+        self.resolution_levels = [1]
+        self.resolution_generations = None
+        self.resolution_patience = None
+        self.resolution_min_improvement = 0.01
+        self.level = 0
+        # the best fitness of the current level and the generation it was reached, used to detect a plateau
+        self.plateau_fitness = None
+        self.plateau_generation = 0
+        # the largest number of rounds of refinement of the best painting at the end of the run, 0 turns it off
+        self.refine_rounds = 0
+        self.run_dir = run_dir
+        self.checkpoint_file = os.path.join(run_dir, CHECKPOINT_FILE)
+        self.run_log = RunLog(os.path.join(run_dir, LOG_NAME))
+        self.legacy_checkpoint = os.path.join(run_dir, LEGACY_CHECKPOINT)
+        self.workers = workers
+        # the process pool is only started the first time it is needed
+        self.pool = None
 
     def evolve(self):
         # Main Logic for the Evolution Process
         # takes the population, selectively breeds, and mutates the children
-        if os.path.exists('checkpoint.txt'):
+        os.makedirs(self.run_dir, exist_ok=True)
+        if os.path.exists(self.checkpoint_file) or os.path.exists(self.legacy_checkpoint):
             gen = self.loadPopulation()
         else:
             gen = 0
+        try:
+            self.runGenerations(gen)
+            if self.refine_rounds > 0:
+                self.refineBest()
+        finally:
+            self.close()
+
+    def runGenerations(self, gen):
+        # runs the generations after gen, see evolve
+        if self.stats_format is not None:
+            self.instrumentation.filename = os.path.join(self.run_dir, f'GAStats.{self.stats_format}')
+            self.instrumentation.file_format = self.stats_format
+        self.instrumentation.reset()
+        self.run_log.open(self.full_target.size, gen)
+        self.startLevel(gen)
+        profiler = None
+        if self.profile_generations > 0:
+            profiler = cProfile.Profile()
+            profiler.enable()
         for generation in range(gen + 1, self.numGenerations + 1):
-            # sort the population by fitness
-            sorted_population, sorted_fitness = self.sortByFitness()
-            # this creates a new population
-            self.createNewPopulation(sorted_population, generation)
+            sorted_population, sorted_fitness = self.runGeneration(generation)
             # in order to view the progress
             print(generation)
+            # every generation is added to the run log
+            self.writeOutputFile(sorted_fitness, sorted_population, generation)
             if generation % 10 == 0:
-                # every 10 generations it should save the population and update the output file
-                self.savePopulation(generation, 'checkpoint.txt')
-                self.writeOutputFile(sorted_fitness, sorted_population, generation)
-
-            # this section is for if you want to include steps where the points are doubled or removed
-            # change False to True if you want to include these steps.
-            if False:
-                if generation == 2001:
-                    # save the current population
-                    self.savePopulation(generation, f'saved_checkpoints/checkpoint_{generation}.txt')
-                    # double the genes at generation provided
-                    self.doubleGenes()
-                    print(len(self.population[0].points))
-                if generation == 4001:
-                    # remove 100 points from each painting
-                    self.removePoints(100)
-                    print(len(self.population[0].points))
+                # every 10 generations it should save the population
+                self.savePopulation(generation, self.checkpoint_file)
+
+            self.instrumentation.endGeneration(generation)
+            if profiler is not None and generation - gen >= self.profile_generations:
+                self.saveProfile(profiler)
+                profiler = None
+            if self.stopped:
+                # the scheduler ended the run, it is saved so it can be continued
+                if generation % 10 != 0:
+                    self.savePopulation(generation, self.checkpoint_file)
+                print(f'stopped at generation {generation}')
+                break
+        if profiler is not None:
+            self.saveProfile(profiler)
         pass
 
+    def refineBest(self):
+        """
+        Refines the best painting of the population against the full size target, see refine.py, and saves it to
+        refined.png and refined.txt in the run directory. Returns the refined painting.
+        """
+        sorted_population, _ = self.sortByFitness()
+        best = sorted_population[-1]
+        size = self.full_target.size
+        fitness_engine = self.fitness_engine
+        if (best.img_width, best.img_height) != size:
+            fitness_engine = FitnessEngine(self.full_target, **self.fitness_options)
+        painting = Painting(scaleGenome(best.genome, (best.img_width, best.img_height), size), *size)
+        refined = refinePainting(painting, fitness_engine, self.refine_rounds)
+        before = fitness_engine.to_percent(painting.getError(fitness_engine.window_error))
+        after = fitness_engine.to_percent(refined.getError(fitness_engine.window_error))
+        print(f'refined the best painting from {before} to {after}')
+        savePainting(refined, os.path.join(self.run_dir, REFINED_FILE))
+        return refined
+
+    def runGeneration(self, generation):
+        """
+        Evolves the population by one generation. Returns the population before this generation sorted by fitness
+        and its sorted fitness values, see sortByFitness.
+
+        generation: the number of the generation
+        """
+        # sort the population by fitness
+        sorted_population, sorted_fitness = self.sortByFitness()
+        actions = self.scheduler.update(self, generation, sorted_fitness)
+        # this creates a new population
+        self.createNewPopulation(sorted_population, generation)
+        # this step moves the new population to the next resolution level, set resolution_levels to include it
+        if self.levelFinished(generation, sorted_fitness[-1]):
+            self.setLevel(self.level + 1, generation)
+            print(f'resolution {self.img_width}x{self.img_height}')
+
+        # these steps double or remove the points, set double_generation or remove_generation to include them
+        if DOUBLE in actions:
+            # save the current population
+            self.savePopulation(generation, os.path.join(self.run_dir, 'saved_checkpoints', f'checkpoint_{generation}.npz'))
+            # double the genes at generation provided
+            self.doubleGenes()
+            print(len(self.population[0].genome))
+        if REMOVE in actions:
+            # remove num_removed points from each painting
+            self.removePoints(self.num_removed)
+            print(len(self.population[0].genome))
+        if actions & {DOUBLE, REMOVE}:
+            self.resetScheduler(generation)
+        self.stopped = STOP in actions
+        return sorted_population, sorted_fitness
+
+    def startLevel(self, generation):
+        # checks the coarse to fine schedule and moves a new population to the resolution level it starts at
+        self.checkResolutionSchedule()
+        if (self.img_width, self.img_height) != self.levelSize(self.level):
+            self.setLevel(self.level, generation)
+
+    def checkResolutionSchedule(self):
+        # makes sure the coarse to fine schedule can reach full resolution
+        levels = self.resolution_levels
+        if not levels or levels[-1] != 1 or any(scale < 1 for scale in levels):
+            raise ValueError(f'resolution_levels must be downscale factors ending with 1, got {levels}')
+        if len(levels) > 1 and self.resolution_generations is None and self.resolution_patience is None:
+            raise ValueError('set resolution_generations or resolution_patience to leave the first resolution level')
+        if self.resolution_generations is not None and len(self.resolution_generations) < len(levels) - 1:
+            raise ValueError(f'resolution_generations needs a generation for each of the {len(levels) - 1} level changes')
+
+    def levelSize(self, level):
+        # the size of the paintings at a level of resolution_levels
+        scale = self.resolution_levels[level]
+        width, height = self.full_target.size
+        return max(1, round(width / scale)), max(1, round(height / scale))
+
+    def levelFinished(self, generation, best_fitness):
+        """
+        Returns True if the population should move on to the next resolution level.
+
+        generation: the generation that just finished
+        best_fitness: the best fitness of that generation
+        """
+        if self.level + 1 >= len(self.resolution_levels):
+            return False
+        if self.resolution_generations is not None:
+            return generation >= self.resolution_generations[self.level]
+        if self.plateau_fitness is None or best_fitness >= self.plateau_fitness + self.resolution_min_improvement:
+            self.plateau_fitness, self.plateau_generation = best_fitness, generation
+        return generation - self.plateau_generation >= self.resolution_patience
+
+    def setLevel(self, level, generation=0):
+        """
+        Moves the population to a level of resolution_levels. The points of every painting are scaled to the new size.
+
+        level: the index of the level in resolution_levels
+        generation: optional, the generation the level starts at
+        """
+        old_size = (self.img_width, self.img_height)
+        self.useLevel(level)
+        new_size = (self.img_width, self.img_height)
+        self.population = [Painting(scaleGenome(painting.genome, old_size, new_size), *new_size)
+                           for painting in self.population]
+        self.plateau_fitness, self.plateau_generation = None, generation
+        self.resetScheduler(generation)
+
+    def resetScheduler(self, generation):
+        """
+        Tells the scheduler that the population changed in a way that lowers its fitness, see Scheduler.reset. The
+        population is scored here, the fitness cache keeps the values for the next generation.
+
+        generation: the generation the change happened after
+        """
+        self.scheduler.reset(self, generation, max(self.evaluate(self.population)))
+
+    def useLevel(self, level):
+        # switches the target, the fitness engine and the painting size to a level without changing the population
+        self.level = level
+        self.img_width, self.img_height = self.levelSize(level)
+        if (self.img_width, self.img_height) == self.full_target.size:
+            self.target_image = self.full_target
+        else:
+            self.target_image = self.full_target.resize((self.img_width, self.img_height), Image.BOX)
+        self.useFitnessEngine(FitnessEngine(self.target_image, **self.fitness_options))
+
+    @property
+    def fitness_options(self):
+        # the metric, weights and structure of the fitness engine, see FitnessEngine
+        return self.fitness_engine.options
+
+    @fitness_options.setter
+    def fitness_options(self, options):
+        self.useFitnessEngine(FitnessEngine(self.target_image, **options))
+
+    def useFitnessEngine(self, fitness_engine):
+        # scores the population with another fitness engine from now on
+        self.fitness_engine = fitness_engine
+        self.window_error = self.instrumentation.timed('fitness', self.fitness_engine.window_error)
+        # the cached fitness values belong to the old engine
+        self.fitness_cache.clear()
+        # the worker processes hold the old engine, they are started again when they are needed
+        self.close()
+
+    def saveProfile(self, profiler):
+        # stops the profiler and saves the results, view them with python3 -m pstats profile.prof
+        profiler.disable()
+        profiler.dump_stats(os.path.join(self.run_dir, 'profile.prof'))
+
     def createNewPopulation(self, sorted_population, generation):
         """
         This method takes in the sorted population and uses it to create a new population.
 
+        The best elitism paintings are carried over unchanged and the rest of the population are new children.
+
         sorted_population: a list of Painting objects sorted in ascending order by their fitness value
         """
-        new_pop = []
-        for _ in range(len(self.population) // 2):
-            children = self.createChildren(sorted_population, generation)
-            new_pop.append(children[0])
-            new_pop.append(children[1])
+        new_pop = sorted_population[len(sorted_population) - self.elitism:] if self.elitism > 0 else []
+        num_children = len(self.population) - len(new_pop)
+        if num_children > 0:
+            new_pop += self.createChildren(sorted_population, generation, num_children)
         # once the length of the new population is the same as the old population
         # set the population to the new population
-        if len(new_pop) != len(self.population):
-            sys.exit()
         self.population = new_pop
         pass
 
@@ -93,148 +358,298 @@ class Darwin:
         """
         # removes points from each painting
         for painting in self.population:
-            painting.removePoints(num_points)
+            painting.removePoints(num_points, self.rng)
         pass
 
     def doubleGenes(self):
         # this function takes each chromosome and doubles the number of genes
         # this is used when including point doubling steps in the evolution process.
         for painting in self.population:
-            painting.doublePoints()
+            painting.doublePoints(self.rng)
         pass
 
-    def createChildren(self, sorted_population, generation):
+    def createChildren(self, sorted_population, generation, num_children):
         """
-        This method creates two new children given the sorted population.
+        This method creates the children of a generation given the sorted population. The parents of every child are
+        drawn at once, and crossover and mutation work on all the genomes at once.
 
         sorted_population: a list of Painting objects sorted in ascending order based on fitness
+        num_children: the number of children to create
         """
-        parents = self.selectParents(sorted_population)
-        children = self.crossover(*parents)
-        for child in children:
-            # this decreases the probability of mutation
-            # if you want to remove this feature change the True to False
-            if generation >= 4500 and True:
-                child.mutate(prob=0.001)
-            else:
-                child.mutate()
-        return children
+        with self.instrumentation.phase('selection'):
+            pairs = self.selectParents(sorted_population, (num_children + 1) // 2)
+        with self.instrumentation.phase('crossover'):
+            children = self.crossover(sorted_population, pairs)
+        with self.instrumentation.phase('mutation'):
+            # the children own their genomes, so mutating the stacked (P * N, 5) view mutates every child
+            genomes = np.stack([child.genome for child in children])
+            prob, movement_bound, color_bound = self.scheduler.mutation(self, generation)
+            mutated = mutateGenome(genomes.reshape(-1, 5), prob, rng=self.rng, movement_bound=movement_bound,
+                                   color_bound=color_bound)
+            for child, genome in zip(children, genomes):
+                child.genome = genome
+            self.instrumentation.count('points_mutated', len(mutated))
+            if self.recolor_prob > 0:
+                self.recolorChildren(children)
+        return children[:num_children]
+
+    def recolorChildren(self, children):
+        """
+        Recolours every point of every child with probability recolor_prob toward the average colour of the target over
+        its cell.
+
+        children: a list of Painting objects
+        """
+        chosen = self.rng.random((len(children), len(children[0].genome))) < self.recolor_prob
+        for child, points in zip(children, chosen):
+            if points.any():
+                recolored = child.recolor(self.fitness_engine.target, np.nonzero(points)[0])
+                self.instrumentation.count('points_mutated', recolored)
 
-    def selectParents(self, sorted_population):
+    def selectParents(self, sorted_population, num_pairs):
         """
-        This function selects two parents (paintings) from the osrted population. Selects paintings with better
-        fitness with a higher probability than those with a lower fitness.
+        This function selects pairs of parents from the sorted population and returns their indices as a (num_pairs, 2)
+        array. Selects paintings with better fitness with a higher probability than those with a lower fitness.
 
         sorted_population: a list of Painting objects sorted in ascending order based on fitness
+        num_pairs: the number of pairs of parents
         """
-        # select two parents with a higher likelihood of selecting more fit parents
-        weight = [n for n in range(len(self.population))]
-        parents = random.choices(sorted_population, weight, k=2)
-        return parents
+        # select the parents with a higher likelihood of selecting more fit parents, the weight of a painting is its rank
+        weight = np.arange(len(sorted_population), dtype=np.float64)
+        probabilities = weight / weight.sum() if weight.sum() > 0 else None
+        return self.rng.choice(len(sorted_population), (num_pairs, 2), p=probabilities)
 
     def fitness(self, painting):
         """
-        Returns the similarity in percent which is a value between 0 and 100 with 100 meaning identical images
+        Returns the similarity in percent which is a value between 0 and 100 with 100 meaning identical images.
+        This gives the same numbers as imgcompare.image_diff_percent but only rescores the parts of the painting
+        that changed since it was last scored.
 
         painting: a Painting object
         """
-        return 100 - image_diff_percent(self.target_image, painting.getImage())
+        return self.fitness_engine.to_percent(painting.getError(self.window_error))
     
+    def evaluate(self, population):
+        """
+        Returns the fitness of every painting in the population, in the same order.
+        Genomes that are in the fitness cache are not scored again, and genomes that appear more than once are only
+        scored once.
+
+        population: a list of Painting objects
+        """
+        keys = [self.fitness_cache.key(painting.genome) for painting in population]
+        fitness_values = [self.fitness_cache.get(key) for key in keys]
+        # the first painting with each genome that is not in the cache
+        unique = {}
+        for i, key in enumerate(keys):
+            if fitness_values[i] is None:
+                unique.setdefault(key, i)
+        self.instrumentation.count('cache_hits', len(population) - len(unique))
+        scored = dict(zip(unique, self.scorePaintings([population[i] for i in unique.values()])))
+        for key, fitness in scored.items():
+            self.fitness_cache.put(key, fitness)
+        return [scored[key] if fitness is None else fitness for key, fitness in zip(keys, fitness_values)]
+
+    def scorePaintings(self, population):
+        """
+        Renders and scores every painting in the population, returning the fitness values in the same order.
+        With more than one worker, paintings without a usable render cache are sent to the process pool as compact point
+        arrays, and the rest are updated incrementally in this process while the pool is busy. The pool sends back the
+        render cache of every painting it scored, so their children can be updated incrementally in turn.
+
+        population: a list of Painting objects
+        """
+        if self.workers <= 1:
+            return [self.fitness(p) for p in population]
+
+        remote = []
+        for i, painting in enumerate(population):
+            changes = painting.pendingChanges()
+            if changes is None or changes > len(painting.genome) * FULL_RENDER_FRACTION:
+                remote.append(i)
+        genomes = [population[i].toArray().astype(np.int32) for i in remote]
+        self.instrumentation.count('pixels_rendered', len(genomes) * self.img_width * self.img_height)
+        self.instrumentation.count('full_renders', len(genomes))
+        chunksize = max(1, len(genomes) // (self.workers * 4))
+        result = self.getPool().map_async(scoreGenome, genomes, chunksize)
+
+        fitness_values = [None] * len(population)
+        remote_set = set(remote)
+        for i, painting in enumerate(population):
+            if i not in remote_set:
+                fitness_values[i] = self.fitness(painting)
+        for i, (error, cache) in zip(remote, result.get()):
+            population[i].adoptRender(error, self.window_error, **cache)
+            fitness_values[i] = self.fitness_engine.to_percent(error)
+        return fitness_values
+
+    def getPool(self):
+        # starts the worker processes, each one keeps its own copy of the target and renderer
+        if self.pool is None:
+            self.pool = Pool(self.workers, initializer=initWorker,
+                             initargs=(self.target_image.convert('RGB'), self.fitness_options))
+        return self.pool
+
+    def close(self):
+        # stops the worker processes if there are any
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
     def sortByFitness(self):
         # sorting the paintings based on their fitness
-        tuples = [(self.fitness(p), p) for p in self.population]
+        fitness_time = self.instrumentation.timers['fitness']
+        with self.instrumentation.phase('render'):
+            fitness_values = self.evaluate(self.population)
+        # the error function is timed on its own, so take it out of the render time
+        self.instrumentation.timers['render'] -= self.instrumentation.timers['fitness'] - fitness_time
+        for painting in self.population:
+            self.instrumentation.count('pixels_rendered', painting.rendered_pixels)
+            self.instrumentation.count('full_renders', painting.full_renders)
+            painting.rendered_pixels = painting.full_renders = 0
+        tuples = list(zip(fitness_values, self.population))
         tuples = sorted(tuples, key=lambda x: x[0])
         sortedFitnessValues = [fitness for (fitness, painting) in tuples]
         sortedPaintings = [painting for (fitness, painting) in tuples]
         return sortedPaintings, sortedFitnessValues
     
-    def crossover(self, parent1, parent2):
-        """
-        Takes in two parents (Painting objects) and combines points from each.
-        Swaps points from the two parents with a probability that is randomly generated.
-
-        parent1: Painting object
-        parent2: Painting object
-        """
-        # generating the probability that any given point is swapped 
-        prob = random.random()
-        child_one_points = []
-        child_two_points = []
-        for i in range(len(parent1.points)):
-            if random.random() < prob:
-                child_one_points.append(parent2.points[i].copy())
-                child_two_points.append(parent1.points[i].copy())
-            else:
-                child_one_points.append(parent1.points[i].copy())
-                child_two_points.append(parent2.points[i].copy())
-        # set num_points on child to 0 initially, to avoid making 250 random points (saves a little time I think)
-        # then set the points to the created list
-        child_one = Painting(0, self.img_width, self.img_height)
-        child_one.points = child_one_points
-        child_two = Painting(0, self.img_width, self.img_height)
-        child_two.points = child_two_points
-
-        return child_one, child_two
+    def crossover(self, sorted_population, pairs):
+        """
+        Combines the points of every pair of parents into two children and returns the list of children, the two
+        children of each pair next to each other.
+        Swaps points between the two parents of a pair with a probability that is randomly generated for each pair.
+
+        sorted_population: a list of Painting objects
+        pairs: a (K, 2) array of indices of the parents in sorted_population, see selectParents
+        """
+        # generating the probability that any given point is swapped, one for each pair
+        probs = self.rng.random(len(pairs))
+        # one boolean mask over the stacked genomes decides which points are swapped
+        genomes = np.stack([painting.genome for painting in sorted_population])
+        child_genomes = crossoverPopulation(genomes, pairs, probs, self.rng)
+        children = []
+        for (first, second), prob, child_one, child_two in zip(pairs, probs, child_genomes[0::2], child_genomes[1::2]):
+            parent1, parent2 = sorted_population[first], sorted_population[second]
+            children.append(Painting(child_one, self.img_width, self.img_height))
+            children.append(Painting(child_two, self.img_width, self.img_height))
+            # each child takes over the render cache of the parent it got most of its points from
+            # so only the swapped points have to be re-rendered
+            children[-2].inherit(parent1 if prob < 0.5 else parent2)
+            children[-1].inherit(parent2 if prob < 0.5 else parent1)
+
+        return children
 
     def savePopulation(self, generation, filename):
         """
-        This function saves the current population and generation to a txt file to allow pausing the process.
+        This function saves the current population and generation to a checkpoint to allow pausing the process.
+        The checkpoint also holds the random number generator states and the mutation schedule so a restored run
+        continues exactly where it stopped (see checkpoint.py).
 
         generation: int representing the current generation
-        filename: a string representing the name of the txt file you want to save the population to.
+        filename: a string representing the name of the .npz file you want to save the population to.
         """
-        # saves the population as well as the generation to a file
-        with open(filename, "w") as file:
-            file.write(f'Generation: {generation}\n')
-            for painting in self.population:
-                file.write(f'{painting.toString()}\n')
+        with self.instrumentation.phase('checkpoint'):
+            saveCheckpoint(filename, [painting.genome for painting in self.population], generation,
+                           (self.img_width, self.img_height), self.getState(), self.fitness_cache.toArrays())
+        self.instrumentation.count('bytes_written', os.path.getsize(filename))
         pass
 
-    def loadPopulation(self):
-        # Read population data from the file and set it to self.population
-        population = []
-        with open('checkpoint.txt', "r") as file:
-            for line in file:
-                # Parse the data from the file and append it to the population list
-                painting_string = line.strip()
-                if not painting_string.startswith('G'):
-                    painting = Painting(painting_string, self.img_width, self.img_height)
-                    population.append(painting)
-                else:
-                    generation = int(line.strip().split(' ')[1])
-        
-        self.population = population
+    def loadPopulation(self, filename=None):
+        """
+        Reads the population from a checkpoint and sets it to self.population. Returns the generation of the checkpoint.
+        If no filename is given, checkpoint_file is used, or the old 'checkpoint.txt' in run_dir if that does not exist.
+
+        filename: optional, a string representing the name of a .npz or old .txt checkpoint
+        """
+        if filename is None:
+            filename = self.checkpoint_file if os.path.exists(self.checkpoint_file) else self.legacy_checkpoint
+        checkpoint = loadCheckpoint(filename)
+        state = checkpoint['state']
+        if state is not None and 'islands' in state:
+            raise ValueError(f'{filename} was written by an island run (see islands.py), continue it with islands')
+        # the checkpoint holds paintings of the resolution level it was saved at
+        size = self.levelSize(state.get('resolution_level', 0)) if state is not None else (self.img_width, self.img_height)
+        if checkpoint['img_size'] is not None and checkpoint['img_size'] != size:
+            raise ValueError(f'{filename} has paintings of size {checkpoint["img_size"]} '
+                             f'but the target image is {size}')
+        self.restorePopulation(checkpoint['genomes'], state, checkpoint['cache'])
         # return the generation
-        return generation
+        return checkpoint['generation']
+
+    def restorePopulation(self, genomes, state=None, cache=None):
+        """
+        Sets the population to paintings made from genomes and restores the state saved with them.
+
+        genomes: a list of (N, 5) genomes at the size of the resolution level of the state
+        state: optional, a dictionary returned by getState
+        cache: optional, the (keys, values) arrays of a FitnessCache
+        """
+        if state is not None and state.get('resolution_level', 0) != self.level:
+            self.useLevel(state['resolution_level'])
+        self.population = [Painting(genome, self.img_width, self.img_height) for genome in genomes]
+        if state is not None:
+            self.setState(state)
+        if cache is not None:
+            self.fitness_cache.fromArrays(*cache)
+
+    def getState(self):
+        # everything besides the population that is needed to continue a run exactly, stored in checkpoints
+        version, internal_state, gauss_next = random.getstate()
+        return {
+            'random': [version, list(internal_state), gauss_next],
+            'numpy': self.rng.bit_generator.state,
+            'mutation_prob': self.mutation_prob,
+            'late_mutation_prob': self.late_mutation_prob,
+            'late_mutation_generation': self.late_mutation_generation,
+            'resolution_level': self.level,
+            'plateau_fitness': self.plateau_fitness,
+            'plateau_generation': self.plateau_generation,
+            'scheduler': self.scheduler.getState(),
+        }
+
+    def setState(self, state):
+        # restores the state saved by getState
+        version, internal_state, gauss_next = state['random']
+        random.setstate((version, tuple(internal_state), gauss_next))
+        self.rng.bit_generator.state = state['numpy']
+        self.mutation_prob = state['mutation_prob']
+        self.late_mutation_prob = state['late_mutation_prob']
+        self.late_mutation_generation = state['late_mutation_generation']
+        self.plateau_fitness = state.get('plateau_fitness')
+        self.plateau_generation = state.get('plateau_generation', 0)
+        self.scheduler.setState(state.get('scheduler', {}))
     
     def writeOutputFile(self, sorted_fitness, sorted_population, generation):
         """
-        This function saves the progress of the population. This will append the generation, average fitness, best fitness,
-        and the string representation of the best painting to a txt file. This allows the user to track the progress of the
-        evolution.
+        This function saves the progress of the population. This will append the generation, the average, best, median
+        and standard deviation of the fitness, the diversity of the population and the best painting to the run log (see
+        runlog.py). This allows the user to track the progress of the evolution. The points of the best painting are
+        scaled to the full size of the target.
 
         sorted_fitness: a list of floats which represent the fitness of the population. Sorted in ascending order.
         sorted_population: a list of Painting objects sorted in ascending order by fitness.
         generation: an integer representing the generation the algorithm is currently on.
         """
-        # write the generation, average fitness, best fitness, and best strategy
-        average_fitness = sum(sorted_fitness) / len(sorted_fitness)
-        best_fitness = sorted_fitness[-1]
-        best_painting = sorted_population[-1].toString()
-        with open('GAOutput.txt', 'a') as file:
-            file.write(f'{generation } {average_fitness} {best_fitness} {best_painting}\n')
+        stats = fitnessStats(sorted_fitness, self.diversity(sorted_population))
+        best = sorted_population[-1]
+        best_genome = scaleGenome(best.genome, (best.img_width, best.img_height), self.full_target.size)
+        with self.instrumentation.phase('output'):
+            self.instrumentation.count('bytes_written', self.run_log.append(generation, stats, best_genome))
         pass
 
+    def diversity(self, population):
+        # the standard deviation of every value of every point over the population, averaged over the points
+        # 0 means every painting is the same
+        if len({len(painting.genome) for painting in population}) != 1:
+            return float('nan')
+        return float(np.stack([painting.genome for painting in population]).std(axis=0).mean())
 
 
 
 
-if __name__ == '__main__':
-    # creates a new darwin object with 200 paintings with 500 points each trying to replicate the image at 
-    # Update the filename to match your target image
-    original_image_filename = 'original_image.png'
 
-    original = Image.open(f'Testing Images/{original_image_filename}')
-
-    darwin = Darwin(original, 200, 500)
-    darwin.evolve()
+if __name__ == '__main__':
+    # the command line is in experiments.py, run with --help to see the options
+    from experiments import main
+    main()
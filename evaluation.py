@@ -0,0 +1,48 @@
+"""
+This file contains the functions run by the worker processes that score paintings in parallel for the Darwin class.
+
+Every worker is started with initWorker, which decodes the target image into a FitnessEngine and sets up the Renderer once,
+so both stay resident for the whole run. Paintings are sent to the workers as compact (N, 5) int32 arrays of x, y, r, g, b
+instead of pickled Painting and Point objects. The summed error comes back with the render cache the worker made on the
+way, the label map and cell windows or the error of every tile, so the main process can keep updating the painting and
+its children incrementally (see Painting.adoptRender). Scoring is exact integer arithmetic (fixed point for the weighted
+and structural metrics), so the results do not depend on how many workers there are or how the population was split
+between them.
+"""
+
+from fitness import FitnessEngine
+from renderer import getRenderer
+import numpy as np
+
+# the fitness engine of this worker process, set by initWorker
+engine = None
+
+
+def initWorker(target_image, options):
+    """
+    Runs once in every worker process.
+
+    target_image: the PIL image being replicated
+    options: the options of the FitnessEngine in the main process, see FitnessEngine.options
+    """
+    global engine
+    engine = FitnessEngine(target_image, **options)
+    getRenderer(engine.img_width, engine.img_height)
+
+
+def scoreGenome(genome):
+    """
+    Renders a painting from scratch and returns its summed error against the target and its render cache, a dictionary
+    with the labels and label_windows of the painting, or its tile_errors if the renderer is tiled.
+
+    genome: an (N, 5) integer array of x, y, r, g, b
+    """
+    renderer = getRenderer(engine.img_width, engine.img_height)
+    if renderer.tile_size is not None:
+        tile_errors = renderer.tileErrors(genome[:, :2], genome[:, 2:], engine.window_error, renderer.tiles())
+        return int(tile_errors.sum()), {'tile_errors': tile_errors}
+    # the same label type as Painting.render, half the size of int32 to send back for most paintings
+    dtype = np.uint16 if len(genome) <= 65536 else np.int32
+    labels, label_windows = renderer.labelMap(genome[:, :2], dtype)
+    error = engine.window_error(labels, genome[:, 2:], (0, engine.img_height, 0, engine.img_width))
+    return error, {'labels': labels, 'label_windows': label_windows}
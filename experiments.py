@@ -0,0 +1,344 @@
+"""
+This file contains the command line for running the genetic algorithm. Everything that used to be edited in darwin.py
+(the target image, population size, number of points, the first population, number of generations, the mutation
+schedule, the point doubling and removal steps, the adaptive scheduler, the fitness metric, elitism and the fitness cache, the coarse to fine
+resolution schedule, the island model, the output directory and the random seed) can be set with command line options
+or a JSON config file. Options given on the command line override the config file, which overrides DEFAULTS.
+
+A single run writes its checkpoint and run log to output_dir. A batch runs every combination of the targets and the
+values in sweep, each in its own directory inside output_dir, up to 'parallel' runs at a time. Every run directory gets a
+config.json with the exact settings of that run, and batch runs write their progress to progress.txt instead of the
+terminal. The time spent in each phase of every generation is written to GAStats.jsonl (or GAStats.csv), and
+--profile N saves a cProfile of the first N generations to profile.prof.
+
+Example config file:
+    {
+        "targets": ["Testing Images/original_image.png", "Testing Images/other_image.png"],
+        "generations": 6000,
+        "sweep": {"num_points": [250, 500], "seed": [1, 2]},
+        "output_dir": "runs",
+        "parallel": 8
+    }
+
+Example command line:
+    python3 experiments.py --target 'Testing Images/original_image.png' --generations 6000 --sweep num_points=250,500
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from functools import partial
+from darwin import Darwin
+from fitness import FitnessCache, METRICS
+from initialization import INITIALIZERS, targetGenomes
+from islands import Archipelago, TOPOLOGIES
+from scheduler import Scheduler, AdaptiveScheduler
+from PIL import Image
+import itertools
+import argparse
+import json
+import os
+
+DEFAULTS = {
+    'target': 'Testing Images/original_image.png',
+    'population_size': 200,
+    'num_points': 500,
+    # 'random' points or points drawn from the edges of the 'target', see initialization.py
+    'initializer': 'random',
+    'init_edge_weight': 0.8,
+    'init_lloyd_iterations': 0,
+    'generations': 12000,
+    'mutation_prob': 0.005,
+    'late_mutation_prob': 0.001,
+    'late_mutation_generation': 4500,
+    # the probability that a point of a child is recoloured toward the target under its cell
+    'recolor_prob': 0,
+    # the largest number of rounds of refinement of the best painting at the end of a run, 0 turns it off
+    'refine_rounds': 0,
+    'double_generation': None,
+    'remove_generation': None,
+    'num_removed': 100,
+    # 'fixed' follows the settings above, 'adaptive' follows the fitness, see scheduler.py
+    'scheduler': 'fixed',
+    'plateau_patience': 500,
+    'plateau_min_improvement': 0.01,
+    'plateau_actions': ['double'],
+    'min_rate': 0.01,
+    'rate_window': 200,
+    # the fitness metric, the weights of the pixels ('edges' or a mask image) and the structural term, see fitness.py
+    'metric': 'sad',
+    'fitness_weights': None,
+    'structure_weight': 0,
+    # the number of the best paintings kept unchanged every generation and the number of fitness values cached
+    'elitism': 0,
+    'cache_size': 4096,
+    # the coarse to fine schedule, see Darwin.setLevel
+    'resolution_levels': [1],
+    'resolution_generations': None,
+    'resolution_patience': None,
+    'resolution_min_improvement': 0.01,
+    # None shares the cores of the machine between the runs
+    'workers': None,
+    # the island model, see islands.py, more than 1 island runs every island in its own process instead of using workers
+    'islands': 1,
+    'migration_interval': 50,
+    'migration_size': 2,
+    'topology': 'ring',
+    'seed': None,
+    'output_dir': '.',
+    # the per generation stats file, 'jsonl', 'csv' or None, and the number of generations to run cProfile over
+    'stats_format': 'jsonl',
+    'profile': 0,
+}
+# settings that only describe a batch and are not passed on to a run
+BATCH_SETTINGS = {
+    'targets': [],
+    'sweep': {},
+    'parallel': 1,
+}
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Replicate an image with an evolving Voronoi diagram.')
+    parser.add_argument('--config', help='a JSON file with any of the settings below')
+    parser.add_argument('--target', action='append', dest='targets',
+                        help='the image to replicate, repeat to run a batch of targets')
+    parser.add_argument('--population-size', type=int)
+    parser.add_argument('--num-points', type=int)
+    parser.add_argument('--initializer', choices=list(INITIALIZERS),
+                        help='target draws the first points from the edges of the target and colours them like it')
+    parser.add_argument('--init-edge-weight', type=float,
+                        help='the part of the first points that follow the edges of the target')
+    parser.add_argument('--init-lloyd-iterations', type=int,
+                        help='the number of rounds of Lloyd relaxation of the first points of every painting')
+    parser.add_argument('--generations', type=int)
+    parser.add_argument('--mutation-prob', type=float)
+    parser.add_argument('--late-mutation-prob', type=float)
+    parser.add_argument('--late-mutation-generation', type=int)
+    parser.add_argument('--recolor-prob', type=float,
+                        help='the probability that a point of a child is recoloured toward the target under its cell')
+    parser.add_argument('--refine-rounds', type=int,
+                        help='refine the best painting directly against the target for up to this many rounds at the end')
+    parser.add_argument('--metric', choices=list(METRICS),
+                        help='sad and sse compare rgb, lab compares colours the way people see them')
+    parser.add_argument('--fitness-weights',
+                        help='edges to weigh the edges of the target more, or a greyscale mask image, brighter counts more')
+    parser.add_argument('--structure-weight', type=float,
+                        help='also score how well the differences between neighbouring pixels follow the target')
+    parser.add_argument('--double-generation', type=int, help='the generation the points are doubled at')
+    parser.add_argument('--remove-generation', type=int, help='the generation num_removed points are removed at')
+    parser.add_argument('--num-removed', type=int)
+    parser.add_argument('--scheduler', choices=['fixed', 'adaptive'],
+                        help='adaptive scales the mutations and doubles, removes or stops when the fitness stalls')
+    parser.add_argument('--plateau-patience', type=int,
+                        help='the number of generations without an improvement that make a plateau')
+    parser.add_argument('--plateau-min-improvement', type=float, help='the smallest improvement of the best fitness')
+    parser.add_argument('--plateau-actions', nargs='*', choices=['double', 'remove'], metavar='ACTION',
+                        help='what the adaptive scheduler does at the first plateaus, in order: double or remove')
+    parser.add_argument('--min-rate', type=float,
+                        help='stop once the best fitness improves by less than this many percent per minute, '
+                             'a negative rate never stops')
+    parser.add_argument('--rate-window', type=int, help='the number of generations the improvement rate is measured over')
+    parser.add_argument('--elitism', type=int, help='the number of the best paintings kept unchanged every generation')
+    parser.add_argument('--cache-size', type=int, help='the number of genomes whose fitness is remembered, 0 turns it off')
+    parser.add_argument('--resolution-levels', type=int, nargs='+', metavar='SCALE',
+                        help='evolve against the target shrunk by each factor in turn, for example 8 4 2 1')
+    parser.add_argument('--resolution-generations', type=int, nargs='+', metavar='GENERATION',
+                        help='the generations the resolution levels change at')
+    parser.add_argument('--resolution-patience', type=int,
+                        help='change the resolution level after this many generations without improvement')
+    parser.add_argument('--resolution-min-improvement', type=float,
+                        help='the smallest change of the best fitness that counts as an improvement')
+    parser.add_argument('--workers', type=int, help='the number of processes scoring the population of each run')
+    parser.add_argument('--islands', type=int, help='the number of populations that evolve in their own processes')
+    parser.add_argument('--migration-interval', type=int, help='the number of generations between migrations')
+    parser.add_argument('--migration-size', type=int, help='the number of paintings that leave each island at a migration')
+    parser.add_argument('--topology', choices=list(TOPOLOGIES), help='where the migrants of an island go')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output-dir', help='the run directory, or the directory holding the run directories of a batch')
+    parser.add_argument('--stats-format', choices=['jsonl', 'csv', 'none'],
+                        help='the format of GAStats, the time spent in each phase of every generation')
+    parser.add_argument('--profile', type=int, metavar='N', help='run cProfile over the first N generations')
+    parser.add_argument('--parallel', type=int, help='the number of runs of a batch that run at the same time')
+    parser.add_argument('--sweep', action='append', default=[], metavar='SETTING=V1,V2,...',
+                        help='run every value of a setting, can be repeated to sweep a grid')
+    return parser.parse_args(argv)
+
+
+def parseValue(text):
+    # sweep values are read as JSON when possible so numbers and null work, and as strings otherwise
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def loadSettings(args):
+    """
+    Combines DEFAULTS, the config file and the command line arguments into one dictionary.
+
+    args: the parsed command line arguments
+    """
+    settings = {**DEFAULTS, **BATCH_SETTINGS}
+    if args.config:
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+        unknown = set(config) - set(settings)
+        if unknown:
+            raise ValueError(f'unknown settings in {args.config}: {", ".join(sorted(unknown))}')
+        settings.update(config)
+    for key, value in vars(args).items():
+        if key in settings and value is not None and key != 'sweep':
+            settings[key] = value
+    if settings['stats_format'] == 'none':
+        settings['stats_format'] = None
+    settings['sweep'] = dict(settings['sweep'])
+    for sweep in args.sweep:
+        key, values = sweep.split('=', 1)
+        settings['sweep'][key] = [parseValue(value) for value in values.split(',')]
+    unknown = set(settings['sweep']) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f'cannot sweep {", ".join(sorted(unknown))}')
+    return settings
+
+
+def expandExperiments(settings):
+    """
+    Returns a list of (name, settings) for every run, one for each combination of target and swept values.
+    The name is empty for a single run so it is written straight to output_dir.
+
+    settings: the dictionary returned by loadSettings
+    """
+    targets = settings['targets'] or [settings['target']]
+    keys = sorted(settings['sweep'])
+    combinations = list(itertools.product(*(settings['sweep'][key] for key in keys)))
+    batch = len(targets) > 1 or len(combinations) > 1
+    experiments = []
+    names = set()
+    for target in targets:
+        for values in combinations:
+            run = {key: settings[key] for key in DEFAULTS}
+            run['target'] = target
+            run.update(zip(keys, values))
+            name = ''
+            if batch:
+                parts = [os.path.splitext(os.path.basename(target))[0]] + [f'{k}={v}' for k, v in zip(keys, values)]
+                name = '-'.join(parts).replace(' ', '_')
+                # targets with the same file name in different folders still get their own directories
+                unique, count = name, 1
+                while unique in names:
+                    count += 1
+                    unique = f'{name}-{count}'
+                name = unique
+                names.add(name)
+            experiments.append((name, run))
+    return experiments
+
+
+def makeScheduler(settings):
+    """
+    Returns the scheduler of a run, see scheduler.py.
+
+    settings: the settings of the run
+    """
+    if settings['scheduler'] == 'adaptive':
+        return AdaptiveScheduler(settings['plateau_patience'], settings['plateau_min_improvement'],
+                                 settings['plateau_actions'], settings['min_rate'], settings['rate_window'])
+    return Scheduler()
+
+
+def makeInitializer(settings):
+    """
+    Returns the initializer of the first population of a run, None for random points, see initialization.py.
+
+    settings: the settings of the run
+    """
+    if settings['initializer'] == 'target':
+        return partial(targetGenomes, edge_weight=settings['init_edge_weight'],
+                       lloyd_iterations=settings['init_lloyd_iterations'])
+    return None
+
+
+def darwinAttributes(settings):
+    """
+    Returns a dictionary of the Darwin attributes set by the settings of a run.
+
+    settings: the settings of the run
+    """
+    return {
+        'numGenerations': settings['generations'],
+        'mutation_prob': settings['mutation_prob'],
+        'late_mutation_prob': settings['late_mutation_prob'],
+        'late_mutation_generation': settings['late_mutation_generation'],
+        'recolor_prob': settings['recolor_prob'],
+        'refine_rounds': settings['refine_rounds'],
+        'double_generation': settings['double_generation'],
+        'remove_generation': settings['remove_generation'],
+        'num_removed': settings['num_removed'],
+        'scheduler': makeScheduler(settings),
+        'elitism': settings['elitism'],
+        'fitness_options': {'metric': settings['metric'], 'weights': settings['fitness_weights'],
+                            'structure': settings['structure_weight']},
+        'fitness_cache': FitnessCache(settings['cache_size']),
+        'resolution_levels': settings['resolution_levels'],
+        'resolution_generations': settings['resolution_generations'],
+        'resolution_patience': settings['resolution_patience'],
+        'resolution_min_improvement': settings['resolution_min_improvement'],
+        'stats_format': settings['stats_format'],
+        'profile_generations': settings['profile'],
+    }
+
+
+def runExperiment(name, settings, quiet=False):
+    """
+    Runs one experiment in its own run directory.
+
+    name: the name of the run directory inside output_dir, or an empty string to use output_dir itself
+    settings: the settings of this run
+    quiet: if True the progress is written to progress.txt in the run directory instead of the terminal
+    """
+    run_dir = os.path.join(settings['output_dir'], name) if name else settings['output_dir']
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, 'config.json'), 'w') as file:
+        json.dump(settings, file, indent=4)
+
+    target_image = Image.open(settings['target'])
+    if settings['islands'] > 1:
+        darwin = Archipelago(target_image, settings['islands'], settings['population_size'], settings['num_points'],
+                             run_dir=run_dir, seed=settings['seed'], attributes=darwinAttributes(settings),
+                             initializer=makeInitializer(settings))
+        darwin.migration_interval = settings['migration_interval']
+        darwin.migration_size = settings['migration_size']
+        darwin.topology = settings['topology']
+    else:
+        darwin = Darwin(target_image, settings['population_size'], settings['num_points'],
+                        workers=settings['workers'], run_dir=run_dir, seed=settings['seed'],
+                        initializer=makeInitializer(settings))
+        for key, value in darwinAttributes(settings).items():
+            setattr(darwin, key, value)
+    if quiet:
+        with open(os.path.join(run_dir, 'progress.txt'), 'a') as progress, redirect_stdout(progress):
+            darwin.evolve()
+    else:
+        darwin.evolve()
+    return run_dir
+
+
+def main(argv=None):
+    settings = loadSettings(parseArguments(argv))
+    experiments = expandExperiments(settings)
+    if settings['workers'] is None:
+        parallel = 1 if len(experiments) == 1 else max(1, settings['parallel'])
+        for _, run in experiments:
+            run['workers'] = max(1, (os.cpu_count() or 1) // parallel)
+    if len(experiments) == 1:
+        runExperiment(*experiments[0])
+        return
+    # every run gets its own process and its own run directory so they never share files
+    with ProcessPoolExecutor(max(1, settings['parallel'])) as executor:
+        futures = [executor.submit(runExperiment, name, run, True) for name, run in experiments]
+        for future in futures:
+            print(f'finished {future.result()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+This file contains the FitnessEngine class. A FitnessEngine decodes the target image once into a contiguous
+(img_height, img_width, 3) int16 array laid out like the output of the Renderer, and scores paintings against it.
+
+Scores are a similarity in percent, between 0 and 100 with 100 meaning identical images. The default 'sad' metric gives
+exactly the same numbers as imgcompare.image_diff_percent, which is what older runs logged to GAOutput.txt: the per channel
+absolute differences are converted to greyscale with pillow's integer weights, summed, and divided by the difference between
+a white and a black image. The 'sse' metric sums squared channel differences instead and is divided by its own worst case,
+so it is also a percentage. The 'lab' metric sums the distance between colours in CIE Lab (delta E 1976), which follows
+what people see as different more closely than rgb does.
+
+Two options change what counts as an error, for any metric:
+    - weights gives every pixel a weight, so some regions count more than others. It is 'edges' for a map made from the
+      edges of the target (the importance map of initialization.py), or a greyscale mask image of any size, as a path,
+      a PIL image or an array (brighter is more important). The weights are scaled to a mean of 1.
+    - structure adds a structural term in the spirit of SSIM: every pixel is also scored on how far its brightness
+      differences to its right and lower neighbour are from the target's, times structure. A painting then has to
+      keep the edges and texture of the target where they are, not just its average colours. The term is local to
+      pairs of pixels, unlike the windowed statistics of SSIM, so a change can still be scored by its window alone.
+Plain 'sad' and 'sse' are scored with exact integer arithmetic. Everything else is scored by fusedError in one pass over
+target arrays made by the constructor, with the error of every pixel rounded to 1 / FIXED_POINT, so the errors of
+windows still add up exactly to the error of the image.
+
+The constructor takes in 1 required parameter: target_image which is the PIL image being replicated.
+The constructor also takes in 4 optional parameters: metric which is 'sad', 'sse' or 'lab', preview_scale which
+downscales both images by that factor before comparing them in score and score_many (a cheap, rough preview of the full
+score), and weights and structure as above.
+
+This file also contains the FitnessCache class, a bounded least recently used map from a hash of a genome to its fitness,
+so a genome that was already scored is never rendered again.
+"""
+
+from initialization import importanceMap
+from collections import OrderedDict
+from PIL import Image
+import numpy as np
+import hashlib
+
+METRICS = ('sad', 'sse', 'lab')
+# pillow's weights for converting rgb to greyscale, scaled by 2 ** 16. A weighted sum is at most 255 * 2 ** 16 < 2 ** 24
+GREY_WEIGHTS = (19595, 38470, 7471)
+# score_many compares at most this many pixels at a time to keep memory flat
+CHUNK_PIXELS = 1 << 22
+# the size in bytes of the genome hashes used by FitnessCache
+KEY_SIZE = 16
+# the weighted and structural metrics round the error of every pixel to 1 / FIXED_POINT, so the errors of windows still
+# add up exactly
+FIXED_POINT = 256
+# the largest error of one pixel for each metric, delta E is largest between pure blue and pure green
+PIXEL_RANGE = {'sad': 255.0, 'sse': 3 * 255.0 ** 2, 'lab': 258.7}
+# the largest error of a pair of neighbouring pixels in the structural term, brightness goes up to 255 or 100 in Lab
+PAIR_RANGE = {'sad': 255.0, 'sse': 255.0 ** 2, 'lab': 100.0}
+# the part of the 'edges' weights that follows the edges of the target, the rest is spread evenly
+EDGE_WEIGHT = 0.5
+# the linear srgb to xyz matrix divided by the d65 white point, used by rgbToLab
+SRGB_TO_XYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                        [0.2126729, 0.7151522, 0.0721750],
+                        [0.0193339, 0.1191920, 0.9503041]]) / np.array([[0.95047], [1.0], [1.08883]])
+# srgb values from 0 to 255 with the gamma removed
+LINEAR_SRGB = np.where(np.arange(256) / 255 > 0.04045, ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4,
+                       np.arange(256) / 255 / 12.92)
+
+
+def rgbToLab(rgb):
+    """
+    Converts an (..., 3) integer array of srgb values from 0 to 255 to CIE Lab. Every step works on one element at a
+    time, so a colour always converts to exactly the same numbers however many colours are converted with it.
+
+    rgb: an (..., 3) integer array
+    """
+    linear = LINEAR_SRGB[np.clip(rgb, 0, 255)]
+    r, g, b = linear[..., 0], linear[..., 1], linear[..., 2]
+    x, y, z = (m[0] * r + m[1] * g + m[2] * b for m in SRGB_TO_XYZ)
+    fx, fy, fz = (np.where(t > 216 / 24389, np.cbrt(t), (24389 / 27 * t + 16) / 116) for t in (x, y, z))
+    return np.stack([116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz)], axis=-1)
+
+
+class FitnessEngine:
+    def __init__(self, target_image, metric='sad', preview_scale=1, weights=None, structure=0):
+        if metric not in METRICS:
+            raise ValueError(f'unknown metric {metric}, expected one of {METRICS}')
+        if structure < 0:
+            raise ValueError(f'structure must not be negative, got {structure}')
+        self.metric = metric
+        self.preview_scale = preview_scale
+        self.structure = structure
+        # the arguments that make the same kind of engine for another target, like a resolution level
+        self.options = {'metric': metric, 'weights': weights, 'structure': structure}
+        self.img_width, self.img_height = target_image.size
+        self.target = np.ascontiguousarray(np.asarray(target_image.convert('RGB'), dtype=np.int16))
+        self.preview = self.downscale(self.target[None])[0] if preview_scale > 1 else self.target
+        # plain 'sad' and 'sse' compare rgba bytes like the Renderer draws them, one 32 bit word per pixel
+        self.target_bytes = self.toBytes(self.target[None])[0]
+        self.preview_bytes = self.toBytes(self.preview[None])[0]
+        # plain 'sad' and 'sse' keep their exact integer arithmetic, everything else is scored by fusedError
+        self.fused = metric == 'lab' or weights is not None or structure > 0
+        if self.fused:
+            weight_map = self.weightMap(weights, target_image)
+            self.arrays = self.prepare(self.target, weight_map)
+            self.preview_arrays = self.arrays
+            if preview_scale > 1:
+                if weight_map is not None:
+                    weight_map = self.downscale(weight_map[None, ..., None], rounded=False)[0, ..., 0]
+                self.preview_arrays = self.prepare(self.preview, weight_map)
+
+    def weightMap(self, weights, target_image):
+        """
+        Returns the weight of every pixel as an (img_height, img_width) array with a mean of 1, or None if every pixel
+        counts the same.
+
+        weights: None, 'edges' to weigh the edges of the target more (see initialization.importanceMap), the path of
+                 a greyscale mask image, a PIL image, or an array. Masks of another size are resized to the target
+        target_image: the PIL image being replicated
+        """
+        if weights is None:
+            return None
+        if isinstance(weights, str) and weights == 'edges':
+            density, _, factor = importanceMap(target_image, EDGE_WEIGHT)
+            weights = np.repeat(np.repeat(density * density.size, factor, axis=0), factor, axis=1)
+            weights = weights[:self.img_height, :self.img_width]
+            height, width = weights.shape
+            weights = np.pad(weights, ((0, self.img_height - height), (0, self.img_width - width)), mode='edge')
+        else:
+            if isinstance(weights, str):
+                weights = Image.open(weights)
+            if isinstance(weights, Image.Image):
+                weights = weights.convert('F')
+            weights = np.asarray(weights, dtype=np.float32)
+            if weights.shape != (self.img_height, self.img_width):
+                weights = Image.fromarray(weights, 'F').resize((self.img_width, self.img_height), Image.BOX)
+        weights = np.asarray(weights, dtype=np.float64)
+        if (weights < 0).any() or weights.mean() <= 0:
+            raise ValueError('the weights must not be negative or all 0')
+        return weights / weights.mean()
+
+    def prepare(self, target, weights):
+        """
+        Returns the arrays fusedError compares against: the target in the colour space of the metric and the weights,
+        both float32. The gradients of the structural term are taken from the window of the target being scored, so
+        a very large target costs at most 16 bytes a pixel. The target is converted CHUNK_PIXELS at a time to keep the
+        float64 steps of rgbToLab small.
+
+        target: an (H, W, 3) int16 array
+        weights: an (H, W) array or None
+        """
+        height, width = target.shape[:2]
+        space = np.empty((height, width, 3), dtype=np.float32)
+        rows = max(1, CHUNK_PIXELS // width)
+        for y in range(0, height, rows):
+            space[y:y + rows] = self.toSpace(target[y:y + rows])
+        return {'space': space, 'weights': None if weights is None else weights.astype(np.float32)}
+
+    def toSpace(self, rgb):
+        # converts integer rgb values to the colour space of the metric, as float32
+        return (rgbToLab(rgb) if self.metric == 'lab' else rgb).astype(np.float32)
+
+    def luma(self, values):
+        # the brightness of values in the colour space of the metric, compared by the structural term
+        if self.metric == 'lab':
+            return values[..., 0]
+        return 0.299 * values[..., 0] + 0.587 * values[..., 1] + 0.114 * values[..., 2]
+
+    def worst_error(self, num_pixels):
+        # the error of a white image compared to a black one, or the largest error the metric can give
+        if self.fused:
+            # every pixel is compared to its right and lower neighbour by the structural term
+            per_pixel = PIXEL_RANGE[self.metric] + 2 * self.structure * PAIR_RANGE[self.metric]
+            return per_pixel * num_pixels * FIXED_POINT
+        if self.metric == 'sad':
+            return 255 * num_pixels
+        return 255 * 255 * 3 * num_pixels
+
+    def to_percent(self, error, num_pixels=None):
+        """
+        Turns a summed error into a similarity in percent.
+
+        error: the summed error of an image
+        num_pixels: optional, the number of pixels the error was summed over, defaults to the whole target
+        """
+        if num_pixels is None:
+            num_pixels = self.img_width * self.img_height
+        return 100 - (error / float(self.worst_error(num_pixels))) * 100
+
+    def toBytes(self, images):
+        """
+        Returns a stack of images as a contiguous (P, H, W, 4) uint8 array, the layout error compares. Rgba images from
+        the Renderer are used as they are, the fourth byte of every pixel is never compared.
+
+        images: a (P, H, W, 3 or 4) array of values from 0 to 255
+        """
+        if images.dtype == np.uint8 and images.shape[-1] == 4:
+            return np.ascontiguousarray(images)
+        stack = np.full(images.shape[:-1] + (4,), 255, dtype=np.uint8)
+        stack[..., :3] = images[..., :3]
+        return stack
+
+    def error(self, images, target):
+        """
+        Returns the summed error of every image in a stack compared to the target, in integer arithmetic on the bytes of
+        the images. The absolute differences of the bytes are read as one little endian 32 bit word per pixel, and
+        the three colour channels are taken out of it with shifts and masks.
+
+        images: a (P, H, W, 4) uint8 array, see toBytes
+        target: an (H, W, 4) uint8 array
+        """
+        diff = np.maximum(images, target)
+        diff -= np.minimum(images, target)
+        words = diff.view('<u4')[..., 0]
+        total = np.zeros(words.shape, dtype=np.uint32)
+        channel = np.empty_like(total)
+        for shift, weight in zip((0, 8, 16), GREY_WEIGHTS):
+            np.right_shift(words, shift, out=channel)
+            channel &= 0xFF
+            # a pixel adds up to 255 * 2 ** 16 for 'sad' and 3 * 255 ** 2 for 'sse', both fit in 32 bits
+            channel *= weight if self.metric == 'sad' else channel
+            total += channel
+        if self.metric == 'sad':
+            total += 0x8000
+            total >>= 16
+        return total.reshape(len(images), -1).sum(axis=1, dtype=np.int64)
+
+    def fusedError(self, values, arrays, window):
+        """
+        Returns the summed error of every image in a stack for the weighted, 'lab' and structural metrics, all in one
+        pass over the pixels: the colour distance of every pixel, plus structure times how much its differences to
+        its right and lower neighbour (when they are inside the window) differ from the target's, times its weight.
+        Every pixel is rounded to 1 / FIXED_POINT before summing, so the error of a window does not depend on the
+        pixels around it.
+
+        values: a (P, h, w, 3) float32 array of images in the colour space of the metric, see toSpace
+        arrays: the arrays of the target returned by prepare
+        window: the (y0, y1, x0, x1) window of the target the images cover
+        """
+        y0, y1, x0, x1 = window
+        space = arrays['space'][y0:y1, x0:x1]
+        diff = values - space
+        # the channels are added one at a time so every pixel gets the same result whatever the size of the window
+        if self.metric == 'sad':
+            diff = np.abs(diff)
+            pixels = 0.299 * diff[..., 0] + 0.587 * diff[..., 1] + 0.114 * diff[..., 2]
+        else:
+            diff *= diff
+            pixels = diff[..., 0] + diff[..., 1] + diff[..., 2]
+            if self.metric == 'lab':
+                pixels = np.sqrt(pixels)
+        if self.structure > 0:
+            luma, target_luma = self.luma(values), self.luma(space)
+            gradient_x = np.diff(luma, axis=2) - np.diff(target_luma, axis=1)
+            gradient_y = np.diff(luma, axis=1) - np.diff(target_luma, axis=0)
+            if self.metric == 'sse':
+                gradient_x, gradient_y = gradient_x * gradient_x, gradient_y * gradient_y
+            else:
+                gradient_x, gradient_y = np.abs(gradient_x), np.abs(gradient_y)
+            pixels[:, :, :-1] += self.structure * gradient_x
+            pixels[:, :-1, :] += self.structure * gradient_y
+        if arrays['weights'] is not None:
+            pixels *= arrays['weights'][y0:y1, x0:x1]
+        pixels = np.rint(pixels * FIXED_POINT).astype(np.int64)
+        return pixels.reshape(len(values), -1).sum(axis=1)
+
+    def window_error(self, labels, colors, window):
+        """
+        Returns the summed error of a window of a painting, used by Painting.getError to rescore only what changed.
+        Always compares at full resolution.
+
+        labels: the label map of the window
+        colors: an (N, 3) array of r, g, b values for the points
+        window: the (y0, y1, x0, x1) window of the image the labels cover
+        """
+        y0, y1, x0, x1 = window
+        palette = np.clip(colors, 0, 255).astype(np.int16)
+        if self.fused:
+            # only the colours of the points are converted, not every pixel
+            return int(self.fusedError(self.toSpace(palette)[labels][None], self.arrays, window)[0])
+        # every pixel is gathered as one 32 bit word, like Renderer.colorize
+        pixels = np.take(self.toBytes(palette[None])[0].view(np.uint32)[:, 0], labels)
+        return int(self.error(pixels.view(np.uint8).reshape(1, *labels.shape, 4), self.target_bytes[y0:y1, x0:x1])[0])
+
+    def score(self, image):
+        """
+        Returns the similarity in percent between one rendered image and the target.
+
+        image: an (img_height, img_width, 3 or 4) array, the alpha channel is ignored
+        """
+        return self.score_many([image])[0]
+
+    def score_many(self, images):
+        """
+        Scores a whole population of rendered images in one call. Returns a list of similarities in percent, in the
+        same order as the images.
+
+        images: a (P, img_height, img_width, 3 or 4) array or a list of (img_height, img_width, 3 or 4) arrays
+        """
+        if len(images) == 0:
+            return []
+        target = self.preview
+        num_pixels = target.shape[0] * target.shape[1]
+        chunk = max(1, CHUNK_PIXELS // num_pixels)
+        errors = []
+        for start in range(0, len(images), chunk):
+            chunk_images = [np.asarray(image) for image in images[start:start + chunk]]
+            if not self.fused and self.preview_scale == 1:
+                # rgba images are compared where they are, stacking them would only copy them
+                errors.extend(int(self.error(self.toBytes(image[None]), self.preview_bytes)[0]) for image in chunk_images)
+                continue
+            stack = np.stack(chunk_images)
+            if self.preview_scale > 1:
+                stack = self.downscale(stack[..., :3].astype(np.int16))
+            if self.fused:
+                window = (0, target.shape[0], 0, target.shape[1])
+                errors.extend(self.fusedError(self.toSpace(stack[..., :3].astype(np.int16)), self.preview_arrays,
+                                              window).tolist())
+            else:
+                errors.extend(self.error(self.toBytes(stack), self.preview_bytes).tolist())
+        return [self.to_percent(error, num_pixels) for error in errors]
+
+    def downscale(self, stack, rounded=True):
+        """
+        Downscales a stack of images by preview_scale by averaging blocks of pixels, edges that do not fill a whole
+        block are cropped.
+
+        stack: a (P, H, W, C) array
+        rounded: optional, round the averages to int16, otherwise they are returned as floats
+        """
+        s = self.preview_scale
+        p, h, w, c = stack.shape
+        stack = stack[:, :h - h % s, :w - w % s]
+        blocks = stack.reshape(p, h // s, s, w // s, s, c).mean(axis=(2, 4))
+        if not rounded:
+            return blocks
+        return np.rint(blocks).astype(np.int16)
+
+
+class FitnessCache:
+    def __init__(self, max_size=4096):
+        """
+        A map from genomes to fitness values that holds at most max_size genomes, dropping the least recently used one
+        when it is full. A max_size of 0 turns the cache off.
+
+        max_size: optional, the largest number of genomes kept
+        """
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(genome):
+        # a hash of the points of a genome, genomes with the same points in the same order have the same key
+        return hashlib.blake2b(np.ascontiguousarray(genome).tobytes(), digest_size=KEY_SIZE).digest()
+
+    def get(self, key):
+        # returns the fitness stored for a key or None, and marks the key as recently used
+        fitness = self.entries.get(key)
+        if fitness is not None:
+            self.entries.move_to_end(key)
+        return fitness
+
+    def put(self, key, fitness):
+        # stores the fitness of a key, dropping the least recently used keys if the cache is full
+        if self.max_size <= 0:
+            return
+        self.entries[key] = fitness
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def toArrays(self):
+        # returns the keys as a (M, KEY_SIZE) uint8 array and the fitness values, least recently used first
+        keys = np.frombuffer(b''.join(self.entries), dtype=np.uint8).reshape(-1, KEY_SIZE)
+        return keys, np.array(list(self.entries.values()), dtype=np.float64)
+
+    def fromArrays(self, keys, values):
+        """
+        Replaces the contents of the cache with arrays returned by toArrays.
+
+        keys: a (M, KEY_SIZE) uint8 array of keys
+        values: the M fitness values of the keys
+        """
+        self.clear()
+        for key, fitness in zip(keys, values.tolist()):
+            self.put(key.tobytes(), fitness)
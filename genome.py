@@ -0,0 +1,153 @@
+"""
+This file contains the functions that work on genomes. A genome is the compact representation of a Painting: one (N, 5)
+int16 array with a row of x, y, r, g, b for every point. Keeping the points in one array instead of a list of Point objects
+means mutation, crossover, doubling and removal are a handful of vectorized operations (crossover and mutation work on
+the whole population at once), and the renderer and the serializers can use the same memory without copying it.
+
+Every function that needs randomness takes an optional NumPy Generator, and uses the module level generator otherwise.
+"""
+
+import numpy as np
+
+# the columns of a genome
+X, Y, R, G, B = range(5)
+DTYPE = np.int16
+# the largest change of a single mutation, see mutateGenome
+MOVEMENT_BOUND = 10
+COLOR_BOUND = 25
+
+# the generator used when none is passed in
+generator = np.random.default_rng()
+
+
+def randomGenome(num_points, img_width, img_height, rng=None):
+    """
+    Creates a genome with points at random locations (including the right and bottom edge) with random colors from 0 to
+    255.
+
+    num_points: the number of points
+    img_width, img_height: the size of the painting
+    rng: optional, a NumPy Generator
+    """
+    rng = rng or generator
+    genome = np.empty((num_points, 5), dtype=DTYPE)
+    genome[:, X] = rng.integers(0, img_width, num_points, endpoint=True)
+    genome[:, Y] = rng.integers(0, img_height, num_points, endpoint=True)
+    genome[:, R:] = rng.integers(0, 256, (num_points, 3))
+    return genome
+
+
+def mutateGenome(genome, prob=0.005, rng=None, movement_bound=MOVEMENT_BOUND, color_bound=COLOR_BOUND):
+    """
+    Mutates a genome in place. Every point is mutated with the probability supplied, a mutated point either moves by up
+    to movement_bound pixels or shifts its color by up to color_bound, with equal chance.
+    Returns the indices of the mutated points. A whole population can be mutated at once by passing a (P * N, 5) view of
+    its (P, N, 5) array.
+
+    genome: an (N, 5) genome
+    prob: optional, the probability that a point is mutated
+    rng: optional, a NumPy Generator
+    movement_bound, color_bound: optional, the largest change of the location and of the color
+    """
+    rng = rng or generator
+    mutated = np.nonzero(rng.random(len(genome)) < prob)[0]
+    if len(mutated):
+        move = rng.random(len(mutated)) < 0.5
+        moved, recolored = mutated[move], mutated[~move]
+        genome[moved, X:R] += rng.integers(-movement_bound, movement_bound, (len(moved), 2), endpoint=True, dtype=DTYPE)
+        shifted = genome[recolored, R:] + rng.integers(-color_bound, color_bound, (len(recolored), 3), endpoint=True)
+        genome[recolored, R:] = np.clip(shifted, 0, 255)
+    return mutated
+
+
+def crossoverPopulation(genomes, pairs, probs, rng=None):
+    """
+    Creates two children for every pair of parents at once. Every point of the first parent of a pair is swapped with the
+    point of the second parent with the probability of that pair, using one boolean mask for all the children.
+    Returns a (2 * K, N, 5) array with the two children of each pair next to each other.
+
+    genomes: a (P, N, 5) array with the genomes of the population
+    pairs: a (K, 2) array of indices into genomes, the parents of each pair
+    probs: K probabilities, one for each pair
+    rng: optional, a NumPy Generator
+    """
+    rng = rng or generator
+    first, second = genomes[pairs[:, 0]], genomes[pairs[:, 1]]
+    swap = (rng.random(first.shape[:2]) < np.asarray(probs)[:, None])[..., None]
+    children = np.empty((2 * len(pairs),) + genomes.shape[1:], dtype=genomes.dtype)
+    children[0::2] = np.where(swap, second, first)
+    children[1::2] = np.where(swap, first, second)
+    return children
+
+
+def doubleGenome(genome, rng=None):
+    """
+    Returns a genome with every point twice, in a random order so that mutations spread over both copies.
+
+    genome: an (N, 5) genome
+    rng: optional, a NumPy Generator
+    """
+    rng = rng or generator
+    return rng.permutation(np.concatenate([genome, genome]))
+
+
+def removeFromGenome(genome, num_removed, rng=None):
+    """
+    Returns a genome with num_removed randomly chosen points removed, keeping the order of the rest.
+
+    genome: an (N, 5) genome
+    num_removed: the number of points to remove
+    rng: optional, a NumPy Generator
+    """
+    rng = rng or generator
+    keep = np.ones(len(genome), dtype=bool)
+    keep[rng.choice(len(genome), num_removed, replace=False)] = False
+    return genome[keep]
+
+
+def scaleGenome(genome, old_size, new_size):
+    """
+    Returns a copy of a genome with the locations scaled from a painting of old_size to a painting of new_size, so the
+    Voronoi diagram keeps its shape. The colors are not changed. Raises a ValueError if a location does not fit in the
+    integer type of the genome.
+
+    genome: an (N, 5) genome
+    old_size: the (width, height) of the painting the genome belongs to
+    new_size: the (width, height) of the new painting
+    """
+    scaled = genome.copy()
+    for column, old, new in ((X, old_size[0], new_size[0]), (Y, old_size[1], new_size[1])):
+        values = np.rint(genome[:, column] * (new / old))
+        # a location that does not fit in the genome would wrap around instead of failing
+        if np.issubdtype(genome.dtype, np.integer) and len(values) and values.max() > np.iinfo(genome.dtype).max:
+            raise ValueError(f'a painting of {new_size[0]}x{new_size[1]} pixels is too large for {genome.dtype} '
+                             f'locations, the largest side is {np.iinfo(genome.dtype).max + 1} pixels')
+        scaled[:, column] = values
+    return scaled
+
+
+def genomeToString(genome, img_size=None):
+    """
+    Returns the 'x,y,r,g,b;' string representation used by the checkpoint and output files. If the size of the painting
+    is given it is stored in front as 'widthxheight:', so the string can be rendered without the target image.
+
+    genome: an (N, 5) genome
+    img_size: optional, the (width, height) of the painting
+    """
+    prefix = f'{img_size[0]}x{img_size[1]}:' if img_size is not None else ''
+    return prefix + ''.join(f'{x},{y},{r},{g},{b};' for x, y, r, g, b in genome.tolist())
+
+
+def genomeFromString(string):
+    # parses the 'x,y,r,g,b;' string representation of a genome, the size in front of it is skipped, see sizeFromString
+    rows = [row.split(',') for row in string.strip().rpartition(':')[2].split(';') if row]
+    return np.array(rows, dtype=np.int64).astype(DTYPE).reshape(-1, 5)
+
+
+def sizeFromString(string):
+    # returns the (width, height) stored in front of a genome string by genomeToString, or None if there is none
+    size, colon, _ = string.strip().partition(':')
+    if not colon:
+        return None
+    width, height = size.split('x')
+    return int(width), int(height)
@@ -0,0 +1,130 @@
+"""
+This file contains the initializers of the first population of the Darwin class. An initializer is a function that
+takes the target image, the population size, the number of points and a NumPy Generator (the rng keyword) and returns
+the genomes of the first population.
+
+randomGenomes places the points uniformly at random with random colours, which is what Darwin does when no initializer
+is given. targetGenomes starts from the target instead:
+    - The points are drawn from an importance map of the target: edge_weight of the probability follows the gradient
+      magnitude of the target, so edges and detail get more points, and the rest is spread evenly over the image so
+      flat areas are still covered.
+    - Every painting of the population gets its own points, all drawn in one call.
+    - lloyd_iterations rounds of Lloyd relaxation can move every point to the centroid of its cell, weighted by the
+      importance map, which spreads the points out evenly along the edges (a centroidal Voronoi tessellation).
+    - Every point takes the colour of the target around it.
+The map and the colours are worked out on a copy of the target with at most MAP_PIXELS pixels, so large targets cost no
+more than small ones. This is done once per run.
+
+The first generation then starts close to the target, instead of spending thousands of generations on getting the basic
+colours right.
+"""
+
+from genome import DTYPE, randomGenome
+from renderer import getRenderer
+from scipy import ndimage
+import numpy as np
+import math
+
+INITIALIZERS = ('random', 'target')
+# the importance map is made from a copy of the target with at most this many pixels
+MAP_PIXELS = 1 << 20
+# pillow's weights for converting rgb to greyscale
+GREY_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+def randomGenomes(target_image, population_size, num_points, rng=None):
+    """
+    Returns a list of genomes with points at random locations with random colours.
+
+    target_image: the PIL image being replicated, only its size is used
+    population_size: the number of genomes
+    num_points: the number of points of every genome
+    rng: optional, a NumPy Generator
+    """
+    width, height = target_image.size
+    return [randomGenome(num_points, width, height, rng) for _ in range(population_size)]
+
+
+def importanceMap(target_image, edge_weight=0.8):
+    """
+    Returns the importance map of the target as an (h, w) array that sums to 1, the colours of the target as an
+    (h, w, 3) array smoothed over 3 by 3 pixels, and the factor the target was shrunk by to get to at most MAP_PIXELS
+    pixels.
+
+    target_image: the PIL image being replicated
+    edge_weight: optional, the part of the importance that follows the gradient of the target, the rest is even
+    """
+    width, height = target_image.size
+    factor = max(1, math.ceil(math.sqrt(width * height / MAP_PIXELS)))
+    image = target_image.convert('RGB')
+    if factor > 1:
+        image = image.reduce(factor)
+    colors = ndimage.uniform_filter(np.asarray(image, dtype=np.float64), size=(3, 3, 1), mode='nearest')
+    grey = colors @ GREY_WEIGHTS
+    gradient = np.hypot(ndimage.sobel(grey, axis=0), ndimage.sobel(grey, axis=1))
+    even = np.full(grey.shape, 1 / grey.size)
+    if gradient.sum() <= 0:
+        return even, colors, factor
+    return edge_weight * gradient / gradient.sum() + (1 - edge_weight) * even, colors, factor
+
+
+def lloydRelax(seeds, density, iterations):
+    """
+    Moves the points to the centroids of their cells, weighted by the density, a number of times. Returns the new
+    (N, 2) array of x, y locations.
+
+    seeds: an (N, 2) integer array of x, y locations on the density map
+    density: the (h, w) importance map
+    iterations: the number of rounds
+    """
+    height, width = density.shape
+    renderer = getRenderer(width, height)
+    ys, xs = np.divmod(np.arange(density.size), width)
+    weights = density.ravel()
+    for _ in range(iterations):
+        labels = renderer.labels(seeds).ravel()
+        mass = np.bincount(labels, weights, len(seeds))
+        # points whose cell has no weight stay where they are
+        moved = mass > 0
+        centroid_x = np.bincount(labels, weights * xs, len(seeds))[moved] / mass[moved]
+        centroid_y = np.bincount(labels, weights * ys, len(seeds))[moved] / mass[moved]
+        seeds = seeds.copy()
+        seeds[moved] = np.column_stack([np.rint(centroid_x), np.rint(centroid_y)])
+    return seeds
+
+
+def targetGenomes(target_image, population_size, num_points, edge_weight=0.8, lloyd_iterations=0, rng=None):
+    """
+    Returns a list of genomes with points drawn from the importance map of the target and coloured like the target.
+
+    target_image: the PIL image being replicated
+    population_size: the number of genomes
+    num_points: the number of points of every genome
+    edge_weight: optional, the part of the importance that follows the gradient of the target, see importanceMap
+    lloyd_iterations: optional, the number of rounds of Lloyd relaxation of every genome
+    rng: optional, a NumPy Generator
+    """
+    from genome import generator
+    rng = rng or generator
+    width, height = target_image.size
+    density, colors, factor = importanceMap(target_image, edge_weight)
+    map_width = density.shape[1]
+    # the points of the whole population are drawn at once
+    drawn = rng.choice(density.size, (population_size, num_points), p=density.ravel())
+    map_y, map_x = np.divmod(drawn, map_width)
+    if factor > 1:
+        # a point can be anywhere in the block of the full target that a pixel of the map stands for
+        offsets = rng.integers(0, factor, (2, population_size, num_points))
+    genomes = []
+    for p in range(population_size):
+        seeds = np.column_stack([map_x[p], map_y[p]])
+        if lloyd_iterations > 0:
+            seeds = lloydRelax(seeds, density, lloyd_iterations)
+        genome = np.empty((num_points, 5), dtype=DTYPE)
+        genome[:, 2:] = np.rint(colors[seeds[:, 1], seeds[:, 0]])
+        if factor > 1:
+            seeds = seeds * factor + offsets[:, p].T
+        genome[:, 0] = np.minimum(seeds[:, 0], width - 1)
+        genome[:, 1] = np.minimum(seeds[:, 1], height - 1)
+        genomes.append(genome)
+    return genomes
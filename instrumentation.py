@@ -0,0 +1,99 @@
+"""
+This file contains the Instrumentation class. It keeps timers and counters for every phase of a generation of the Darwin
+class and writes one record per generation to a stats file in the run directory, either as JSON lines or as CSV.
+
+Timers are only two perf_counter calls around each phase and counters are plain additions, so it is cheap enough to
+leave on for whole runs. A record holds the generation, the total time of the generation, the time spent in each phase
+of PHASES and the value of each counter of COUNTERS for that generation.
+
+The constructor takes in 2 optional parameters: filename which is the path of the stats file (no file is written if it is
+None) and file_format which is 'jsonl' or 'csv'.
+"""
+
+from contextlib import contextmanager
+from time import perf_counter
+import json
+import csv
+import os
+
+FORMATS = ('jsonl', 'csv')
+PHASES = ('render', 'fitness', 'selection', 'crossover', 'mutation', 'checkpoint', 'output')
+COUNTERS = ('pixels_rendered', 'full_renders', 'cache_hits', 'points_mutated', 'bytes_written')
+
+
+class Instrumentation:
+    def __init__(self, filename=None, file_format='jsonl'):
+        if file_format not in FORMATS:
+            raise ValueError(f'unknown stats format {file_format}, expected one of {FORMATS}')
+        self.filename = filename
+        self.file_format = file_format
+        self.reset()
+
+    def reset(self):
+        # starts the timers and counters of a new generation
+        self.timers = dict.fromkeys(PHASES, 0.0)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.start = perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the time spent inside the with block to the timer of a phase.
+
+        name: the name of the phase, one of PHASES
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] += perf_counter() - start
+
+    def timed(self, name, function):
+        """
+        Returns a function that calls function and adds the time it took to the timer of a phase.
+        Used for functions that are called from deep inside other phases, like the error function.
+
+        name: the name of the phase, one of PHASES
+        function: the function to time
+        """
+        def timedFunction(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.timers[name] += perf_counter() - start
+        return timedFunction
+
+    def count(self, name, amount=1):
+        # adds to a counter, one of COUNTERS. amount may be a NumPy integer, the record has to hold plain ints for json
+        self.counters[name] += int(amount)
+
+    def endGeneration(self, generation):
+        """
+        Writes the record of a generation to the stats file and starts the next generation. Returns the record.
+
+        generation: the generation that just finished
+        """
+        record = {'generation': generation, 'total': perf_counter() - self.start, **self.timers, **self.counters}
+        self.write(record)
+        self.reset()
+        return record
+
+    def write(self, record):
+        """
+        Appends a record to the stats file, if there is one. Used directly for records made by another Instrumentation,
+        like the ones the islands of an island run send to the coordinator (see islands.py).
+
+        record: a dictionary like the ones returned by endGeneration
+        """
+        if self.filename is None:
+            return
+        new_file = not os.path.exists(self.filename)
+        with open(self.filename, 'a', newline='') as file:
+            if self.file_format == 'jsonl':
+                file.write(json.dumps(record) + '\n')
+            else:
+                writer = csv.DictWriter(file, fieldnames=list(record))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(record)
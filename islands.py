@@ -0,0 +1,312 @@
+"""
+This file contains the Archipelago class, which runs the genetic algorithm as an island model: num_islands populations
+evolve side by side, each one a Darwin object in its own process, and every migration_interval generations the best
+migration_size paintings of every island migrate to other islands, where they replace the worst paintings.
+
+The islands only talk to the coordinator (the Archipelago in the main process) once per migration, through
+multiprocessing queues carrying compact genome arrays, so the cores are kept busy without the per generation
+synchronization of scoring one population in parallel. Keeping the populations apart for a while also keeps them
+diverse, which helps long runs that would otherwise converge early.
+
+The topology decides where migrants go:
+    - 'ring': every island sends its migrants to the next island
+    - 'all': every island sends its migrants to every other island, which keeps the best migration_size of them
+    - 'random': every island sends its migrants to a randomly chosen other island
+Migrants always travel at the full size of the target, so islands at different resolution levels can trade paintings.
+
+The coordinator writes one run log and one checkpoint for the whole run, and refines the best painting of all the
+islands at the end when refine_rounds is above 0. The run log gets the fitness of every painting of every island, the
+best painting of all the islands and the average diversity of the islands. The checkpoint holds the
+populations and random states of every island and the migrants that have not arrived yet, and is written after every
+migration, so an island run continues exactly where it stopped.
+
+The islands time their generations like a single Darwin object does (see instrumentation.py) and send the records to the
+coordinator, which writes them to one GAStats file in the run directory with an 'island' column, unless stats_format is
+None. Setting profile_generations profiles the first that many generations inside every island process and saves them to
+profile.prof in the directory of the island, since the coordinator itself only waits for the islands.
+
+The constructor takes the same parameters as the Darwin class plus num_islands, and attributes which is a dictionary of
+Darwin attributes (like 'mutation_prob' or 'numGenerations') that are set on every island. Every island makes its own
+first population with the initializer and its own seed.
+"""
+
+from darwin import Darwin, CHECKPOINT_FILE, LOG_NAME, REFINED_FILE
+from checkpoint import saveCheckpoint, loadCheckpoint
+from fitness import FitnessEngine
+from genome import scaleGenome
+from instrumentation import Instrumentation
+from painting import Painting
+from refine import refinePainting, savePainting
+from runlog import RunLog, fitnessStats
+from multiprocessing import Process, Queue
+import numpy as np
+import cProfile
+import queue
+import os
+
+TOPOLOGIES = ('ring', 'all', 'random')
+
+
+def runIsland(index, target_image, population_size, num_points, seed, initializer, attributes, migration_size, run_dir, inbox,
+              outbox):
+    """
+    Runs one island, this is the main function of the island processes. The island waits for a 'start' message with
+    the generation to start at and the population to restore (if any), and then for a 'run' message for every migration
+    with the generation to run to and the migrants to take in. After every run it sends back its records for the run
+    log, its emigrants, its population and state for the checkpoint, and whether its scheduler wants to stop. A 'stop'
+    message ends the island.
+
+    index: the number of the island
+    target_image, population_size, num_points, seed, initializer: the parameters of the Darwin object of this island
+    attributes: a dictionary of Darwin attributes to set
+    migration_size: the number of paintings that leave the island at every migration
+    run_dir: the run directory of the island
+    inbox, outbox: the queues from and to the coordinator
+    """
+    darwin = Darwin(target_image, population_size, num_points, run_dir=run_dir, seed=seed, initializer=initializer)
+    for key, value in attributes.items():
+        setattr(darwin, key, value)
+    full_size = target_image.size
+    _, generation, genomes, state = inbox.get()
+    if genomes is not None:
+        darwin.restorePopulation(genomes, state)
+    darwin.startLevel(generation)
+    profiler = None
+    if darwin.profile_generations > 0:
+        os.makedirs(run_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = generation
+
+    while True:
+        message = inbox.get()
+        if message[0] == 'stop':
+            break
+        _, until, migrants = message
+        receiveMigrants(darwin, migrants, full_size)
+        # the time spent waiting for the coordinator is not part of the first generation
+        darwin.instrumentation.reset()
+        records = []
+        for generation in range(generation + 1, until + 1):
+            sorted_population, sorted_fitness = darwin.runGeneration(generation)
+            best = sorted_population[-1]
+            records.append((generation, sorted_fitness,
+                            scaleGenome(best.genome, (best.img_width, best.img_height), full_size),
+                            darwin.diversity(sorted_population), darwin.instrumentation.endGeneration(generation)))
+            if profiler is not None and generation - start >= darwin.profile_generations:
+                darwin.saveProfile(profiler)
+                profiler = None
+        emigrants = [(fitness, scaleGenome(painting.genome, (painting.img_width, painting.img_height), full_size))
+                     for fitness, painting in zip(sorted_fitness[::-1], sorted_population[::-1])]
+        outbox.put((index, records, emigrants[:migration_size],
+                    [painting.genome for painting in darwin.population], darwin.getState(), darwin.stopped))
+    if profiler is not None:
+        darwin.saveProfile(profiler)
+    darwin.close()
+
+
+def receiveMigrants(darwin, migrants, full_size):
+    """
+    Replaces the worst paintings of the population of a Darwin object with migrants.
+
+    darwin: the Darwin object of an island
+    migrants: a list of genomes at the full size of the target
+    full_size: the (width, height) of the target
+    """
+    size = (darwin.img_width, darwin.img_height)
+    num_points = len(darwin.population[0].genome)
+    # migrants can only cross over with paintings that have as many points as they do
+    migrants = [migrant for migrant in migrants if len(migrant) == num_points][:len(darwin.population) - 1]
+    if not migrants:
+        return
+    sorted_population, _ = darwin.sortByFitness()
+    newcomers = [Painting(scaleGenome(migrant, full_size, size), *size) for migrant in migrants]
+    darwin.population = sorted_population[len(newcomers):] + newcomers
+
+
+class Archipelago:
+    def __init__(self, target_image, num_islands, population_size, num_points, run_dir='.', seed=None, attributes=None,
+                 initializer=None):
+        # the image is read now, a lazily loaded image would share its open file with the island processes
+        target_image.load()
+        self.target_image = target_image
+        self.num_islands = num_islands
+        self.population_size = population_size
+        self.num_points = num_points
+        self.run_dir = run_dir
+        self.initializer = initializer
+        self.attributes = dict(attributes or {})
+        self.numGenerations = self.attributes.pop('numGenerations', 12000)
+        # the best painting of all the islands is refined at the end of the run, see refine.py
+        self.refine_rounds = self.attributes.pop('refine_rounds', 0)
+        # the islands send their stats records to the coordinator, which writes them to one file, see writeOutputFile
+        self.stats_format = self.attributes.pop('stats_format', 'jsonl')
+        self.instrumentation = Instrumentation()
+        # every migration_interval generations the best migration_size paintings of each island migrate
+        self.migration_interval = 50
+        self.migration_size = 2
+        self.topology = 'ring'
+        # every island gets its own seed, and the coordinator gets one for the random topology
+        seeds = np.random.SeedSequence(seed).spawn(num_islands + 1)
+        self.seeds = [int(s.generate_state(1)[0]) for s in seeds[:num_islands]]
+        self.rng = np.random.default_rng(seeds[-1])
+        self.checkpoint_file = os.path.join(run_dir, CHECKPOINT_FILE)
+        self.run_log = RunLog(os.path.join(run_dir, LOG_NAME))
+        self.processes = []
+
+    def evolve(self):
+        # runs the islands until numGenerations, continuing from the checkpoint in run_dir if there is one
+        if self.topology not in TOPOLOGIES:
+            raise ValueError(f'unknown topology {self.topology}, expected one of {TOPOLOGIES}')
+        os.makedirs(self.run_dir, exist_ok=True)
+        generation = 0
+        populations, states = [None] * self.num_islands, [None] * self.num_islands
+        migrants = [[] for _ in range(self.num_islands)]
+        if os.path.exists(self.checkpoint_file):
+            generation, populations, states, migrants = self.loadPopulation()
+        self.run_log.open(self.target_image.size, generation)
+        if self.stats_format is not None:
+            self.instrumentation.filename = os.path.join(self.run_dir, f'GAStats.{self.stats_format}')
+            self.instrumentation.file_format = self.stats_format
+
+        outbox = Queue()
+        inboxes = [Queue() for _ in range(self.num_islands)]
+        self.processes = [Process(target=runIsland, daemon=True,
+                                  args=(i, self.target_image, self.population_size, self.num_points, self.seeds[i],
+                                        self.initializer, self.attributes, self.migration_size, os.path.join(self.run_dir, f'island_{i}'), inboxes[i], outbox))
+                          for i in range(self.num_islands)]
+        for process in self.processes:
+            process.start()
+        try:
+            for inbox, population, state in zip(inboxes, populations, states):
+                inbox.put(('start', generation, population, state))
+            while generation < self.numGenerations:
+                until = min(generation + self.migration_interval, self.numGenerations)
+                for inbox, incoming in zip(inboxes, migrants):
+                    inbox.put(('run', until, incoming))
+                records, emigrants, populations, states, stopped = zip(*self.receive(outbox))
+                self.writeOutputFile(records)
+                migrants = self.migrate(emigrants)
+                generation = until
+                self.savePopulation(generation, populations, states, migrants)
+                print(generation)
+                if all(stopped):
+                    # the schedulers of all the islands stopped, see scheduler.py
+                    print(f'stopped at generation {generation}')
+                    break
+        finally:
+            self.close(inboxes)
+        if self.refine_rounds > 0 and generation > 0:
+            self.refineBest(generation)
+
+    def refineBest(self, generation):
+        """
+        Refines the best painting of a generation, as stored in the run log, and saves it to refined.png and refined.txt
+        in the run directory. Returns the refined painting.
+
+        generation: the generation
+        """
+        fitness_engine = FitnessEngine(self.target_image, **self.attributes.get('fitness_options', {}))
+        painting = Painting(self.run_log.genome(generation), *self.target_image.size)
+        refined = refinePainting(painting, fitness_engine, self.refine_rounds)
+        before = fitness_engine.to_percent(painting.getError(fitness_engine.window_error))
+        after = fitness_engine.to_percent(refined.getError(fitness_engine.window_error))
+        print(f'refined the best painting from {before} to {after}')
+        savePainting(refined, os.path.join(self.run_dir, REFINED_FILE))
+        return refined
+
+    def receive(self, outbox):
+        # waits for a report from every island, and stops if an island process died
+        reports = [None] * self.num_islands
+        while any(report is None for report in reports):
+            try:
+                index, *report = outbox.get(timeout=1)
+            except queue.Empty:
+                for i, process in enumerate(self.processes):
+                    if process.exitcode not in (None, 0):
+                        raise RuntimeError(f'island {i} stopped with exit code {process.exitcode}')
+                continue
+            reports[index] = report
+        return reports
+
+    def close(self, inboxes):
+        # stops the island processes
+        for inbox in inboxes:
+            inbox.put(('stop',))
+        for process in self.processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+
+    def migrate(self, emigrants):
+        """
+        Returns the list of migrants each island takes in, following the topology.
+
+        emigrants: for every island a list of (fitness, genome) of its best paintings, best first
+        """
+        incoming = [[] for _ in range(self.num_islands)]
+        for i, leaving in enumerate(emigrants):
+            others = [j for j in range(self.num_islands) if j != i]
+            if not others:
+                break
+            if self.topology == 'ring':
+                destinations = [(i + 1) % self.num_islands]
+            elif self.topology == 'all':
+                destinations = others
+            else:
+                destinations = [others[self.rng.integers(len(others))]]
+            for j in destinations:
+                incoming[j].extend(leaving)
+        # an island takes in the best migration_size of the paintings sent to it
+        return [[genome for _, genome in sorted(arriving, key=lambda x: -x[0])[:self.migration_size]]
+                for arriving in incoming]
+
+    def writeOutputFile(self, island_records):
+        """
+        Adds the generations of a migration interval to the run log, combining the records of all the islands, and
+        writes the stats record of every island to the stats file.
+
+        island_records: for every island the list of records of its generations, see runIsland
+        """
+        for records in zip(*island_records):
+            generation = records[0][0]
+            best = max(range(len(records)), key=lambda i: (records[i][1][-1], -i))
+            fitness_values = np.concatenate([sorted_fitness for _, sorted_fitness, _, _, _ in records])
+            diversity = float(np.mean([island_diversity for _, _, _, island_diversity, _ in records]))
+            self.run_log.append(generation, fitnessStats(fitness_values, diversity), records[best][2])
+            for island, (_, _, _, _, stats) in enumerate(records):
+                self.instrumentation.write({'island': island, **stats})
+
+    def savePopulation(self, generation, populations, states, migrants):
+        """
+        Saves the populations and states of every island and the migrants waiting to arrive to one checkpoint.
+
+        generation: the last finished generation
+        populations: for every island the list of genomes of its population
+        states: for every island the state returned by Darwin.getState
+        migrants: for every island the list of genomes that arrive at the next migration
+        """
+        state = {
+            'islands': states,
+            'population_sizes': [len(population) for population in populations],
+            'migrant_counts': [len(incoming) for incoming in migrants],
+            'rng': self.rng.bit_generator.state,
+        }
+        genomes = [genome for population in populations for genome in population]
+        genomes += [genome for incoming in migrants for genome in incoming]
+        saveCheckpoint(self.checkpoint_file, genomes, generation, self.target_image.size, state)
+
+    def loadPopulation(self):
+        # reads the checkpoint written by savePopulation, returns the generation, populations, states and migrants
+        checkpoint = loadCheckpoint(self.checkpoint_file)
+        state = checkpoint['state']
+        if state is None or 'islands' not in state:
+            raise ValueError(f'{self.checkpoint_file} was not written by an island run')
+        if len(state['islands']) != self.num_islands:
+            raise ValueError(f'{self.checkpoint_file} has {len(state["islands"])} islands, not {self.num_islands}')
+        genomes = iter(checkpoint['genomes'])
+        populations = [[next(genomes) for _ in range(size)] for size in state['population_sizes']]
+        migrants = [[next(genomes) for _ in range(count)] for count in state['migrant_counts']]
+        self.rng.bit_generator.state = state['rng']
+        return checkpoint['generation'], populations, state['islands'], migrants
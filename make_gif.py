@@ -1,44 +1,239 @@
 """
-This file contains code to read the GAOutput.txt file and create a gif of the evolution process.
+This file contains code to read the run log (GALog, see runlog.py) or an old GAOutput.txt file and create a gif (or a
+video) of the evolution process.
 The gif shows the progress of the evolution by combining images of the best painting every 10 generations.
 The gif also shows the generation in the top left corner and updates every 500 generations.
 Ex: 0, 500, 1000, ...
+
+Frames are rendered lazily, a few at a time, and appended to the output file as soon as they are ready, so the memory
+used does not grow with the length of the run. GIFs are written frame by frame with pillow. Files ending in .mp4, .webm,
+.mkv or .mov are encoded by piping the frames to ffmpeg, which has to be installed (or available through the
+imageio-ffmpeg package).
+
+Example command line:
+    python3 make_gif.py --input GALog --output output/output.mp4 --stride 20 --scale 0.5 --workers 4
 """
 
-import csv
-import imageio
-from PIL import Image, ImageDraw, ImageFont
-from painting import Painting
+from multiprocessing import Pool
+from PIL import Image, ImageDraw, ImageFont, GifImagePlugin
+from genome import genomeFromString
+from render_paintings import renderSequence
+from runlog import RunLog
+import numpy as np
+import subprocess
+import itertools
+import argparse
+import shutil
+import os
+
+VIDEO_FORMATS = ('.mp4', '.webm', '.mkv', '.mov')
+# fonts tried in order for the generation label, pillow's own font is used if none of them is installed
+FONTS = ('arial.ttf', 'DejaVuSans.ttf', 'LiberationSans-Regular.ttf')
+# the number of frames rendered at a time by each worker, this bounds the memory used
+FRAMES_PER_WORKER = 4
+
+
+def loadFont(size):
+    """
+    Returns the first font of FONTS that is installed, or pillow's default font if none of them are.
 
-def add_text_to_image(img, text):
+    size: the size of the font in pixels
+    """
+    for name in FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # pillow older than 10.1 only has a small bitmap font
+        return ImageFont.load_default()
+
+
+def add_text_to_image(img, text, font=None, position=(10, 10)):
     # create a drawing object
     draw = ImageDraw.Draw(img)
 
     # choose a font, size, color, and location
-    font = ImageFont.load_default()
-    font = ImageFont.truetype("arial.ttf", 100)
-    position = (10, 10)
+    font = font or loadFont(100)
     text_color = (255, 255, 255)
 
     # add text to the image
     draw.text(position, text, font=font, fill=text_color)
     return img
 
-dimensions = Image.open('Testing Images/original_image.png').size
-images = []
-epoch = '1'
-with open('GAoutput.txt', 'r') as datafile:
-    plotting = csv.reader(datafile, delimiter=' ')
-    for row in plotting:
-        # use this to change the number of generations per image
-        if int(row[0]) % 10 == 0:
-            if int(row[0]) % 500 == 0:
-                epoch = row[0]
-            img = Painting(row[3], *dimensions).getImage()
-            img = add_text_to_image(img, epoch)
-            images.append(img)
-
-gif_path = "output/output.gif"
-
-# save the images as a GIF
-imageio.mimsave(gif_path, images, fps=25)
+
+def readOutputFile(filename, stride=10):
+    """
+    Yields the generation and the best genome of every generation of a run log or an old output file that is a multiple
+    of stride, one generation at a time.
+
+    filename: the name of a run log (with or without the .stats extension) or the path of an old GAOutput.txt file
+    stride: optional, the number of generations between frames
+    """
+    if filename.endswith('.txt'):
+        with open(filename, 'r') as datafile:
+            for line in datafile:
+                row = line.split(' ')
+                if len(row) >= 4 and int(row[0]) % stride == 0:
+                    yield int(row[0]), genomeFromString(row[3])
+        return
+    yield from RunLog(filename.removesuffix('.stats')).genomes(stride=stride)
+
+
+def renderFrame(task):
+    """
+    Renders one frame and returns it as an RGB uint8 array. Run in the worker processes.
+
+    task: a tuple of the generation, the genome, the (width, height) of the target, the scale of the output and the
+          number of generations between updates of the label (0 for no label)
+    """
+    generation, genome, dimensions, scale, label_every = task
+    # the painting is rendered at the output size instead of being rendered at full size and shrunk
+    img = Image.fromarray(next(renderSequence([genome], dimensions, scale)))
+    if label_every:
+        epoch = str(generation - generation % label_every) if generation >= label_every else '1'
+        img = add_text_to_image(img, epoch, loadFont(max(1, round(100 * scale))),
+                                (round(10 * scale), round(10 * scale)))
+    return np.asarray(img)
+
+
+class GifWriter:
+    def __init__(self, filename, fps):
+        """
+        Writes a looping gif one frame at a time, every frame gets its own palette.
+
+        filename: the path of the gif
+        fps: the number of frames per second
+        """
+        self.file = open(filename, 'wb')
+        self.duration = 1000 / fps
+        self.frames = 0
+
+    def append(self, frame):
+        # adds an RGB uint8 array to the gif
+        image = Image.fromarray(frame).quantize(256, method=Image.Quantize.FASTOCTREE)
+        if self.frames == 0:
+            header, _ = GifImagePlugin.getheader(image, info={'loop': 0, 'duration': self.duration})
+            self.file.write(b''.join(header))
+        for data in GifImagePlugin.getdata(image, duration=self.duration, include_color_table=True):
+            self.file.write(data)
+        self.frames += 1
+
+    def close(self):
+        self.file.write(b';')
+        self.file.close()
+
+
+class VideoWriter:
+    def __init__(self, filename, fps):
+        """
+        Encodes a video by piping raw frames to ffmpeg, which picks the codec from the extension of the file.
+
+        filename: the path of the video
+        fps: the number of frames per second
+        """
+        self.ffmpeg = findFfmpeg()
+        if self.ffmpeg is None:
+            raise RuntimeError(f'ffmpeg is needed to write {filename}, install it or write a .gif instead')
+        self.filename = filename
+        self.fps = fps
+        self.process = None
+        self.frames = 0
+
+    def append(self, frame):
+        # adds an RGB uint8 array to the video, ffmpeg is started when the size of the frames is known
+        if self.process is None:
+            height, width = frame.shape[:2]
+            command = [self.ffmpeg, '-y', '-loglevel', 'error',
+                       '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r', str(self.fps), '-i', '-',
+                       # most players need yuv420p, which needs an even width and height
+                       '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', self.filename]
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+        self.frames += 1
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed to write {self.filename}')
+
+
+def findFfmpeg():
+    # returns the path of ffmpeg, or None if it is not installed
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        try:
+            import imageio_ffmpeg
+            ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError):
+            pass
+    return ffmpeg
+
+
+def makeAnimation(input_file, output_file, dimensions, stride=10, scale=1.0, fps=25, label_every=500, workers=1):
+    """
+    Renders the best painting of every stride generations of an output file and writes them to a gif or a video.
+    Returns the number of frames written.
+
+    input_file: the name of a run log or the path of an old GAOutput.txt file
+    output_file: the path of the gif or video, the format is picked from the extension
+    dimensions: the (width, height) of the target image
+    stride: optional, the number of generations between frames, should be a multiple of 10
+    scale: optional, the size of the frames relative to the target image
+    fps: optional, the number of frames per second
+    label_every: optional, the number of generations between updates of the generation label, 0 for no label
+    workers: optional, the number of processes rendering frames
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    is_video = os.path.splitext(output_file)[1].lower() in VIDEO_FORMATS
+    writer = VideoWriter(output_file, fps) if is_video else GifWriter(output_file, fps)
+    tasks = ((generation, genome, dimensions, scale, label_every)
+             for generation, genome in readOutputFile(input_file, stride))
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        # only a batch of frames is held in memory at a time
+        batch_size = workers * FRAMES_PER_WORKER
+        while True:
+            batch = list(itertools.islice(tasks, batch_size))
+            if not batch:
+                break
+            for frame in (pool.map(renderFrame, batch) if pool else map(renderFrame, batch)):
+                writer.append(frame)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+    return writer.frames
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Make a gif or a video of the best painting of a run.')
+    parser.add_argument('--input', default='GALog', help='the run log of the run, or an old GAOutput.txt file')
+    parser.add_argument('--output', default='output/output.gif', help='a .gif, .mp4, .webm, .mkv or .mov file')
+    parser.add_argument('--target', default='Testing Images/original_image.png',
+                        help='the target image of an old GAOutput.txt file, run logs store the size of the paintings')
+    parser.add_argument('--stride', type=int, default=10, help='the number of generations between frames')
+    parser.add_argument('--scale', type=float, default=1.0, help='the size of the frames relative to the target')
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--label-every', type=int, default=500,
+                        help='the number of generations between updates of the label, 0 for no label')
+    parser.add_argument('--workers', type=int, default=1, help='the number of processes rendering frames')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    if args.input.endswith('.txt'):
+        dimensions = Image.open(args.target).size
+    else:
+        dimensions = RunLog(args.input.removesuffix('.stats')).imgSize()
+    makeAnimation(args.input, args.output, dimensions, args.stride, args.scale, args.fps, args.label_every, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,42 @@
 """
 
 This file contains the Painting class. This class represents an image/Voronoi diagram. A Painting object will be used as an
-individual of the population in the Darwin class. Each painting contains a background color, height, width, and an array of
-point objects. 
+individual of the population in the Darwin class. Each painting contains a background color, height, width, and a genome:
+an (N, 5) int16 array with the x, y, r, g, b of every point (see genome.py). The points attribute still gives a list of
+Point objects, which are views of the rows of the genome.
 
 The constructor takes in 3 required parameters: num_points which can either be an int that specifies the number of points it 
-should randomly generate, or a string representing a specific painting. It also take in img_width and img_height which will
-be the height and width of the painting. 
+should randomly generate, a string representing a specific painting, or a genome array. It also take in img_width and
+img_height which will be the height and width of the painting. 
 The constructor takes in one optional parameter: background_color which is the background color of the painting.
+
+A painting keeps the label map of its last render (the index of the nearest point for every pixel) along with the points it
+was rendered from. When only a few points have changed since then, because of a mutation or because a child inherited the
+cache of a parent in crossover, only the windows around those points are re-rendered and the cached error is updated for
+those windows only. A colour-only change never relabels anything, it just rescores the cell of that point.
+
+Paintings too large for a label map (see renderer.TILED_PIXELS) keep the error of every tile instead. A change only
+rescores the tiles that overlap the old and new cells of the changed points, one tile at a time, and getImage puts the
+whole image together tile by tile only when it is asked for.
+
+spatialIndex returns a SpatialIndex of the points (see spatial.py) for operators that work on the neighbourhood of a
+point, like recolor which moves the colour of a point toward the colour of the target under its cell. The index is kept
+between calls and only the points that moved since are moved in it.
 """
 
-from scipy.spatial import Voronoi
-from PIL import Image, ImageDraw
-import random
+from renderer import getRenderer, growWindow, mergeWindows, unionWindows, overlapsWindows
+from genome import DTYPE, MOVEMENT_BOUND, COLOR_BOUND, randomGenome, mutateGenome, doubleGenome, removeFromGenome, genomeToString, genomeFromString
+from spatial import SpatialIndex
+from scipy.spatial import cKDTree
+import numpy as np
 from point import Point
 
+# if more than this fraction of the points or of the image changed, re-render the whole painting instead
+FULL_RENDER_FRACTION = 0.25
+# the windows rescored around changed cells are grown by this many pixels, so a metric that compares neighbouring pixels
+# (see the structure option of fitness.py) sees every pair of pixels that changed inside one window
+WINDOW_MARGIN = 1
+
 
 class Painting:
     def __init__(self, num_points, img_width, img_height, background_color=(0, 0, 0)):
@@ -24,102 +46,329 @@ class Painting:
         """
         self.img_width, self.img_height = img_width, img_height # get the width and height
         # this allows num_points to either represent a number of randomly generated points
-        # or it can be a string representing the specific points
+        # or it can be a string or a genome representing the specific points
         if type(num_points) == int:
-            self.points = [Point(self.img_width, self.img_height) for _ in range(num_points)] # create random list of points
+            self.genome = randomGenome(num_points, self.img_width, self.img_height) # create random points
+        elif isinstance(num_points, np.ndarray):
+            self.genome = num_points.astype(DTYPE).reshape(-1, 5)
         else:
-            self.points = self.createFromString(num_points)
+            self.genome = self.createFromString(num_points)
         self.background_color = (*background_color, 255) # unpack color tuple and add alpha value
+        # cache of the last render, see update
+        self.labels = None
+        self.label_windows = None
+        self.rendered = None
+        self.error = None
+        self.error_function = None
+        # the error of every tile of a tiled painting, see updateTiles
+        self.tile_errors = None
+        # the index of the points, see spatialIndex
+        self.spatial_index = None
+        # counters read by the instrumentation of Darwin
+        self.rendered_pixels = 0
+        self.full_renders = 0
+
+    @property
+    def points(self):
+        # the points of the painting as Point objects that read and write the genome
+        return [Point(self.img_width, self.img_height, genome=self.genome, index=i) for i in range(len(self.genome))]
+
+    @points.setter
+    def points(self, points):
+        self.genome = np.array([point.genome[point.index] for point in points], dtype=DTYPE).reshape(-1, 5)
 
     def getImage(self):
         """
-        This function returns the image representation of the Painting class. Is used to compare to the 
-        target image as well as to view an image using pillow.
+        This function returns the image representation of the Painting class as an (img_height, img_width, 4) RGBA
+        uint8 array. Every pixel is coloured by its nearest point. Is used to view an image using pillow (Image.fromarray).
+        """
+        if len(self.genome) == 0:
+            return np.full((self.img_height, self.img_width, 4), self.background_color, dtype=np.uint8)
+        renderer = getRenderer(self.img_width, self.img_height)
+        if renderer.tile_size is not None:
+            return renderer.render(self.genome[:, :2], self.genome[:, 2:])
+        self.update()
+        return renderer.colorize(self.labels, self.rendered[:, 2:])
+
+    def getError(self, window_error):
+        """
+        Returns the error of the painting, updating it incrementally when the cache allows it.
+
+        window_error: a function taking (labels, colors, window) that returns the error of a (y0, y1, x0, x1) window
+        """
+        self.update(window_error)
+        return self.error
+
+    def inherit(self, parent):
+        """
+        Takes over the render cache and the spatial index of a parent so a child that only differs by a few points is
+        re-rendered and indexed incrementally. The arrays are shared, update copies them before changing anything.
+
+        parent: a Painting object of the same size
+        """
+        self.labels = parent.labels
+        self.label_windows = parent.label_windows
+        self.rendered = parent.rendered
+        self.error = parent.error
+        self.error_function = parent.error_function
+        self.tile_errors = parent.tile_errors
+        # the index is moved in place by spatialIndex, so it is copied instead of shared
+        self.spatial_index = parent.spatial_index.copy() if parent.spatial_index is not None else None
+
+    def update(self, window_error=None):
+        """
+        Brings the label map up to date with the points. Only the windows around points that moved or changed colour
+        since the last render are re-rendered. If window_error is given the cached error is kept up to date as well.
+
+        window_error: optional, a function taking (labels, colors, window) that returns the error of a (y0, y1, x0, x1) window
+        """
+        genome = self.toArray()
+        if len(genome) == 0:
+            return
+        renderer = getRenderer(self.img_width, self.img_height)
+        if renderer.tile_size is not None:
+            self.updateTiles(renderer, genome, window_error)
+            return
+        # the cached error can only be updated if it was computed with the same error function
+        keep_error = window_error is not None and self.error is not None and window_error == self.error_function
+        if self.labels is None or self.rendered.shape != genome.shape:
+            self.render(genome)
+            keep_error = False
+        else:
+            changed = genome != self.rendered
+            if not changed.any() and (keep_error or window_error is None):
+                return
+            moved = changed[:, :2].any(axis=1)
+            recolored = changed[:, 2:].any(axis=1) & ~moved
+            if moved.sum() + recolored.sum() > len(genome) * FULL_RENDER_FRACTION or \
+                    not self.updateWindows(genome, np.nonzero(moved)[0], np.nonzero(recolored)[0],
+                                           window_error if keep_error else None):
+                self.render(genome)
+                keep_error = False
+
+        if not keep_error:
+            self.error = None
+            if window_error is not None:
+                self.error = window_error(self.labels, genome[:, 2:], (0, self.img_height, 0, self.img_width))
+            self.error_function = window_error
+
+    def adoptRender(self, error, error_function, labels=None, label_windows=None, tile_errors=None):
+        """
+        Takes over a render of the current points that was made somewhere else, like in a worker process of Darwin (see
+        evaluation.py), as the render cache, so the painting and its children can be updated incrementally.
+
+        error: the error of the painting
+        error_function: the error function the error was computed with, see update
+        labels, label_windows: the label map and the window of every label, see Renderer.labelMap
+        tile_errors: the error of every tile instead of the label map for a tiled painting, see updateTiles
         """
-        vor = Voronoi([(point.x, point.y) for point in self.points])
+        self.labels, self.label_windows, self.tile_errors = labels, label_windows, tile_errors
+        self.rendered = self.toArray().copy()
+        self.error = error
+        self.error_function = error_function
 
-        # create a blank image with the background color 
-        image = Image.new('RGBA', (self.img_width, self.img_height), self.background_color)
-        draw = ImageDraw.Draw(image)
+    def pendingChanges(self):
+        # returns how many points changed since the cached render, or None if there is no cache to update
+        if self.rendered is None:
+            return None
+        genome = self.toArray()
+        if genome.shape != self.rendered.shape:
+            return None
+        return int((genome != self.rendered).any(axis=1).sum())
 
-        # plot diagram on the image
-        for point, region in zip(self.points, vor.regions):
-            if -1 not in region and len(region) > 0:
-                # use the color associated with the point to draw the polygon representation of the region onto the blank image
-                fill_color = point.color
-                polygon = [vor.vertices[i] for i in region]
-                flat_polygon = [coord for sublist in polygon for coord in sublist]
-                draw.polygon(flat_polygon, fill=fill_color)
+    def render(self, genome):
+        # renders the whole label map from scratch
+        renderer = getRenderer(self.img_width, self.img_height)
+        dtype = np.uint16 if len(genome) <= 65536 else np.int32
+        self.labels, self.label_windows = renderer.labelMap(genome[:, :2], dtype)
+        self.rendered = genome.copy()
+        self.rendered_pixels += self.img_width * self.img_height
+        self.full_renders += 1
 
-        return image
+    def updateWindows(self, genome, moved, recolored, window_error):
+        """
+        Re-renders only the windows touched by the moved and recoloured points. Returns False if those windows cover
+        too much of the image, in which case nothing is changed and a full render should be done instead.
+
+        genome: the (N, 5) array of the current points
+        moved: indices of the points whose location changed
+        recolored: indices of the points whose colour changed but location did not
+        window_error: optional, the error function used to update the cached error
+        """
+        renderer = getRenderer(self.img_width, self.img_height)
+        seeds = genome[:, :2]
+        tree = cKDTree(seeds) if len(moved) else None
+        # a moved point affects its old cell and its new cell, a recoloured point only its own cell
+        windows = [unionWindows(old, new) for old, new in zip(self.label_windows[moved],
+                                                              renderer.cellWindows(tree, seeds, moved))]
+        windows += [self.label_windows[i] for i in recolored]
+        windows = mergeWindows([growWindow(w, WINDOW_MARGIN, self.img_width, self.img_height) for w in windows])
+        if sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in windows) > \
+                self.img_width * self.img_height * FULL_RENDER_FRACTION:
+            return False
+
+        labels = self.labels.copy() if len(moved) else self.labels
+        label_windows = self.label_windows.copy()
+        label_windows[moved] = (self.img_height, 0, self.img_width, 0)
+        for window in windows:
+            y0, y1, x0, x1 = window
+            if window_error is not None:
+                self.error -= window_error(labels[y0:y1, x0:x1], self.rendered[:, 2:], window)
+            if len(moved):
+                labels[y0:y1, x0:x1] = renderer.labels(seeds, tree, window)
+                self.rendered_pixels += (y1 - y0) * (x1 - x0)
+                # windows only grow here, a window that is too large is still correct
+                found = renderer.labelWindows(labels[y0:y1, x0:x1], len(genome), window)
+                label_windows[:, [0, 2]] = np.minimum(label_windows[:, [0, 2]], found[:, [0, 2]])
+                label_windows[:, [1, 3]] = np.maximum(label_windows[:, [1, 3]], found[:, [1, 3]])
+            if window_error is not None:
+                self.error += window_error(labels[y0:y1, x0:x1], genome[:, 2:], window)
+
+        self.labels = labels
+        self.label_windows = label_windows
+        self.rendered = genome.copy()
+        return True
+
+    def updateTiles(self, renderer, genome, window_error):
+        """
+        Brings the cached error of a tiled painting up to date. Only the tiles that overlap the old or new cell of a
+        moved point, or the cell of a recoloured point, are scored again. There is no label map to keep up to date, so
+        nothing is done without an error function.
+
+        renderer: the tiled Renderer of the painting
+        genome: the (N, 5) array of the current points
+        window_error: optional, a function taking (labels, colors, window) that returns the error of a (y0, y1, x0, x1) window
+        """
+        if window_error is None:
+            return
+        tiles = renderer.tiles()
+        seeds = genome[:, :2]
+        tree = cKDTree(seeds)
+        dirty = None
+        if self.tile_errors is not None and window_error == self.error_function and self.rendered.shape == genome.shape:
+            changed = genome != self.rendered
+            if not changed.any():
+                return
+            moved = changed[:, :2].any(axis=1)
+            recolored = np.nonzero(changed[:, 2:].any(axis=1) & ~moved)[0]
+            moved = np.nonzero(moved)[0]
+            if len(moved) + len(recolored) <= len(genome) * FULL_RENDER_FRACTION:
+                old_seeds = self.rendered[:, :2]
+                old_tree = cKDTree(old_seeds) if len(moved) else None
+                windows = [unionWindows(old, new) for old, new in zip(renderer.cellWindows(old_tree, old_seeds, moved),
+                                                                      renderer.cellWindows(tree, seeds, moved))]
+                windows += list(renderer.cellWindows(tree, seeds, recolored))
+                # a tile is also scored against the row and column after it, see Renderer.tileErrors
+                dirty = overlapsWindows(tiles, [growWindow(w, WINDOW_MARGIN, self.img_width, self.img_height)
+                                                for w in windows])
+                if dirty.sum() > len(tiles) * FULL_RENDER_FRACTION:
+                    dirty = None
+
+        if dirty is None:
+            tile_errors = np.zeros(len(tiles), dtype=np.int64)
+            dirty = np.ones(len(tiles), dtype=bool)
+            self.full_renders += 1
+        else:
+            # the array may be shared with a parent, see inherit
+            tile_errors = self.tile_errors.copy()
+        tile_errors[dirty] = renderer.tileErrors(seeds, genome[:, 2:], window_error, tiles[dirty], tree)
+        self.rendered_pixels += int(((tiles[dirty, 1] - tiles[dirty, 0]) * (tiles[dirty, 3] - tiles[dirty, 2])).sum())
+        self.tile_errors = tile_errors
+        self.error = int(tile_errors.sum())
+        self.rendered = genome.copy()
+        self.error_function = window_error
+
+    def spatialIndex(self):
+        """
+        Returns a SpatialIndex of the points. It is built the first time and after big changes, otherwise only the points
+        that moved since the last call are moved in it.
+        """
+        seeds = self.genome[:, :2]
+        index = self.spatial_index
+        if index is None or index.seeds.shape != seeds.shape or \
+                (index.seeds != seeds).any(axis=1).sum() > len(seeds) * FULL_RENDER_FRACTION:
+            self.spatial_index = SpatialIndex(seeds, self.img_width, self.img_height)
+        else:
+            index.sync(seeds)
+        return self.spatial_index
+
+    def recolor(self, target, indices, strength=1.0):
+        """
+        Moves the colour of some points toward the average colour of the target over their cells. Only the window of
+        each cell is labelled, so this costs about as much as the cells it recolours.
+        Returns the number of points that were recoloured.
+
+        target: the (img_height, img_width, 3) array of the target
+        indices: the indices of the points to recolour
+        strength: optional, how far to move the colour, 1 sets it to the average colour of the cell
+        """
+        index = self.spatialIndex()
+        renderer = getRenderer(self.img_width, self.img_height)
+        seeds = self.genome[:, :2].astype(np.int64)
+        tree = cKDTree(seeds)
+        recolored = 0
+        for i in indices:
+            y0, y1, x0, x1 = window = index.cellWindow(i)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            cell = renderer.labels(seeds, tree, window) == i
+            if not cell.any():
+                continue
+            color = self.genome[i, 2:].astype(np.float64)
+            average = target[y0:y1, x0:x1][cell].mean(axis=0)
+            self.genome[i, 2:] = np.clip(np.rint(color + strength * (average - color)), 0, 255)
+            recolored += 1
+        return recolored
+
+    def toArray(self):
+        # returns the genome, an (N, 5) array of x, y, r, g, b (not a copy)
+        return self.genome
     
-    def removePoints(self, num_removed):
+    def removePoints(self, num_removed, rng=None):
         """
         This function takes in an int representing the number of points to remove.
         It then randomly removes that many points from the painting.
         This is used in the Darwin function if you want to add steps where points are removed.
 
         num_removed: this should be an integer representing the number of points to remove.
+        rng: optional, a NumPy Generator
         """
-        if num_removed > len(self.points):
+        if num_removed > len(self.genome):
             return
-        # choose random indices where points will be removed
-        indices = random.sample(range(0, len(self.points)), num_removed)
-        new_points = []
-        # remove each of these indices from the points
-        for i in range(len(self.points)):
-            if i not in indices:
-                new_points.append(self.points[i])
-        self.points = new_points
+        self.genome = removeFromGenome(self.genome, num_removed, rng)
         pass
 
-    
-    def doublePoints(self):
+    def doublePoints(self, rng=None):
         """
         This function doubles the number of points in the image.
         This is used in the darwin class if you want to start with fewer points
-        and double them later on.
-        """
-        new_points = []
-        for point in self.points:
-            new_points.append(point.copy())
-        for point in self.points:
-            new_points.append(point.copy())
-        # shuffle the order of the points so that we maximize the effect of mutations
-        random.shuffle(new_points)
-        self.points = new_points
+        and double them later on. The points are shuffled so that we maximize the effect of mutations.
+
+        rng: optional, a NumPy Generator
+        """
+        self.genome = doubleGenome(self.genome, rng)
         pass
     
-    def mutate(self, prob=0.005):
+    def mutate(self, prob=0.005, movement_bound=MOVEMENT_BOUND, color_bound=COLOR_BOUND):
         """
-        This function mutates the image. It goes through each point and with the probability supplied, mutates the point.
+        This function mutates the image. Each point is mutated with the probability supplied, all at once on the genome.
         If you want to define your own probability it should generally be a very small number.
+        Returns the number of points that were mutated.
 
         prob: optional paramter, should be a float between 0 and 1.
+        movement_bound, color_bound: optional, the largest change of the location and of the color of a point
         """
-        for i in range(len(self.points)):
-            if random.random() < prob:
-                self.points[i].mutate()
-        pass
+        return len(mutateGenome(self.genome, prob, movement_bound=movement_bound, color_bound=color_bound))
 
     def toString(self):
-        # generates a string representation of the Painting
-        result = ''
-        for point in self.points:
-            result += point.toString()
-        return result
+        # generates a string representation of the Painting, with its size in front
+        return genomeToString(self.genome, (self.img_width, self.img_height))
     
     def createFromString(self, string):
         """
-        This function takes in a string representation of the Painting and sets all of the variables equal to the
-        ones from the string.
+        This function takes in a string representation of the Painting and returns the genome it describes.
         """
-        point_strings = string.split(';')
-        points = []
-        for i in range(len(point_strings) - 1):
-            point = Point(self.img_height, self.img_width, point_strings[i])
-            points.append(point)
-        return points
+        return genomeFromString(string)
         
 
 if __name__ == '__main__':
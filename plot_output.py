@@ -1,22 +1,59 @@
 """
-This file contains code to read the GAOutput.txt file and create a graph of the progress.
+This file contains code to read the run log (GALog, see runlog.py) or an old GAOutput.txt file and create a graph of the
+progress. The run log is read straight from its fixed width stats table, without touching the genomes, and also has the
+median and the standard deviation of the fitness of every generation.
+
+Example command line:
+    python3 plot_output.py --input runs/original_image/GALog
 """
 
 import matplotlib.pyplot as plt
+from runlog import RunLog
+import numpy as np
+import argparse
 import csv
-epoch = []
-average = []
-best = []
-with open('GAoutput.txt', 'r') as datafile:
-   plotting = csv.reader(datafile, delimiter=' ')
-   for row in plotting:
-       epoch.append(float(row[0]))
-       average.append(float(row[1]))
-       best.append(float(row[2]))
-   plt.plot(epoch, average, label="average fitness")
-   plt.plot(epoch, best, label="best fitness")
-   plt.legend()
-   plt.title('Robot Performance over Time')
-   plt.xlabel('Epoch')
-   plt.ylabel('Fitness')
-   plt.show()
+
+
+def readStats(filename):
+    """
+    Returns a dictionary of arrays with the generation, average and best fitness of every logged generation, and the
+    median and std for run logs.
+
+    filename: the name of a run log (with or without the .stats extension) or the path of an old GAOutput.txt file
+    """
+    if not filename.endswith('.txt'):
+        stats = RunLog(filename.removesuffix('.stats')).stats()
+        return {key: np.array(stats[key]) for key in ('generation', 'average', 'best', 'median', 'std')}
+    epoch = []
+    average = []
+    best = []
+    with open(filename, 'r') as datafile:
+        plotting = csv.reader(datafile, delimiter=' ')
+        for row in plotting:
+            epoch.append(float(row[0]))
+            average.append(float(row[1]))
+            best.append(float(row[2]))
+    return {'generation': np.array(epoch), 'average': np.array(average), 'best': np.array(best)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Plot the fitness of a run.')
+    parser.add_argument('--input', default='GALog', help='the run log of the run, or an old GAOutput.txt file')
+    args = parser.parse_args(argv)
+
+    stats = readStats(args.input)
+    epoch = stats['generation']
+    plt.plot(epoch, stats['average'], label="average fitness")
+    if 'std' in stats:
+        plt.fill_between(epoch, stats['average'] - stats['std'], stats['average'] + stats['std'], alpha=0.2)
+        plt.plot(epoch, stats['median'], label="median fitness")
+    plt.plot(epoch, stats['best'], label="best fitness")
+    plt.legend()
+    plt.title('Robot Performance over Time')
+    plt.xlabel('Epoch')
+    plt.ylabel('Fitness')
+    plt.show()
+
+
+if __name__ == '__main__':
+    main()
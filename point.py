@@ -1,25 +1,36 @@
 """
 This file contains the Point class. A point is used in the Voronoi diagram to define the diagram.
 Each point has a location (an x and a y coordinate) as well as a color which is the color of the region
-surrounding the point. 
+surrounding the point.
+
+Paintings store their points as one genome array (see genome.py), and a Point is a thin view of one row of that
+array: reading or changing x, y or color reads or changes the genome of the painting. A Point that is created on its
+own owns a genome with a single row.
 
 The constructor takes in 2 required parameters: img_width and img_height which define the bounds for the location.
 The constructor also takes in 1 optional parameter: string which allows the point to be defined by a string rather
-than being randomly generated. 
+than being randomly generated. The optional genome and index parameters make the point a view of a row of a genome.
 
 This Point class will be used by the Painting class in order to define the Voronoi diagram.
 """
 
+from genome import DTYPE, MOVEMENT_BOUND, COLOR_BOUND
+import numpy as np
 import random
 
 class Point:
-    def __init__(self, img_width, img_height, string=None):
+    def __init__(self, img_width, img_height, string=None, genome=None, index=0):
         """
         THIS CONSTRUCTOR IS VERY SIMILAR TO THE CONSTRUCTOR FROM THE POST
         https://blog.4dcu.be/programming/2020/02/10/Genetic-Art-Algorithm-2.html
         """
         self.img_width = img_width
         self.img_height = img_height
+        # if a genome is passed in this point is a view of one of its rows
+        if genome is not None:
+            self.genome, self.index = genome, index
+            return
+        self.genome, self.index = np.zeros((1, 5), dtype=DTYPE), 0
         # if the optional string argument is included create the point from the string
         # otherwise create the point randomly
         if string:
@@ -27,29 +38,56 @@ class Point:
         else:
             self.x = random.randint(0, int(img_width)) # random x
             self.y = random.randint(0, int(img_height)) #random y
-            self.color = (random.randint(0, 256), random.randint(0, 256), random.randint(0, 256), 255) # random rgba value
+            self.color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), 255) # random rgba value
+
+    @property
+    def x(self):
+        return int(self.genome[self.index, 0])
+
+    @x.setter
+    def x(self, value):
+        self.genome[self.index, 0] = value
+
+    @property
+    def y(self):
+        return int(self.genome[self.index, 1])
+
+    @y.setter
+    def y(self, value):
+        self.genome[self.index, 1] = value
+
+    @property
+    def color(self):
+        # the rgba color, alpha is always 255
+        r, g, b = self.genome[self.index, 2:].tolist()
+        return (r, g, b, 255)
 
-    def mutate(self):
+    @color.setter
+    def color(self, value):
+        self.genome[self.index, 2:] = value[:3]
+
+    def mutate(self, movement_bound=MOVEMENT_BOUND, color_bound=COLOR_BOUND):
         """
         THE MUTATE FUNCTION IS NEARLY IDENTICAL TO THE CODE FROM THE POST
         https://blog.4dcu.be/programming/2020/02/10/Genetic-Art-Algorithm-2.html
 
         This function mutates the point. It either shifts the location of the point or the color.
-        For more agressive mutations, increase the movement bound and/or the color_bound variables.
-        For less agressive mutations, decrease the movement bound and/or the color_bound variables.
+        For more agressive mutations, increase movement_bound and/or color_bound (MOVEMENT_BOUND and COLOR_BOUND in
+        genome.py by default). For less agressive mutations, decrease movement_bound and/or color_bound.
+        Painting.mutate mutates all of its points at once with genome.mutateGenome instead.
+
+        movement_bound, color_bound: optional, the largest change of the location and of the color
         """
         # two types of mutation: change color or change location
         if random.random() < 0.5:
-            movement_bound = 10
             # this is the move mutation
             self.x = self.x + random.randint(-movement_bound, movement_bound)
             self.y = self.y + random.randint(-movement_bound, movement_bound)
 
         else: # this is the color mutation
-            color_bound = 25
-            self.color = (self.color[0] + random.randint(-color_bound, color_bound), 
-                          self.color[1] + random.randint(-color_bound, color_bound), 
-                          self.color[2] + random.randint(-color_bound, color_bound), 
+            self.color = (self.color[0] + random.randint(-color_bound, color_bound),
+                          self.color[1] + random.randint(-color_bound, color_bound),
+                          self.color[2] + random.randint(-color_bound, color_bound),
                           255)
             # now we need to verify that the color still falls in the range
             self.color = tuple(
@@ -59,19 +97,14 @@ class Point:
 
     def copy(self):
         # this method allows a copy to be made of a point object
-        # creates a new point object and then changes all of its properties to its own properties
-        new_point = Point(self.img_width, self.img_height)
-        new_point.x = self.x
-        new_point.y = self.y
-        new_point.color = self.color
-        # returns the copy
-        return new_point
-    
+        # the copy owns its own row, so changing it does not change this point
+        return Point(self.img_width, self.img_height, genome=self.genome[self.index:self.index + 1].copy())
+
     def toString(self):
         # string representation of a point object
         result = f'{str(self.x)},{str(self.y)},{str(self.color[0])},{str(self.color[1])},{str(self.color[2])};'
         return result
-    
+
     def createFromString(self, string):
         """
         Take in a string representation of a point and return the parameters from the string.
@@ -81,5 +114,3 @@ class Point:
         y = int(items[1])
         color = (int(items[2]), int(items[3]), int(items[4]), 255)
         return x, y, color
-
-        
@@ -0,0 +1,217 @@
+"""
+This file contains the refinement stage, which polishes a finished painting directly instead of waiting for random
+mutations to do it. Late in a run almost every mutation is rejected, so refining the best painting for a few seconds
+gains more than hours of extra generations.
+
+Every round of refinePainting does two things:
+    - fitColors gives every point the best single colour for the pixels of its cell, with the cells fixed. For the 'sad'
+      metric this is the median of every channel over the cell, for 'sse' it is the mean. All the cells are done at
+      once from one labelling of the image (one tile at a time for tiled paintings). For 'lab', weights and the
+      structural term the median is only close to the best colour, so the colours are kept only if they lower the error.
+    - refineMoves tries to move every point by step pixels up, down, left and right, and keeps the best move that
+      lowers the error. Every move is scored incrementally with Painting.getError, so it only costs the cells it touches.
+The step starts at max_step and is halved whenever a round finds no move, and the refinement stops when a round at a
+step of 1 does not improve the painting, or after max_rounds rounds.
+
+Darwin and Archipelago refine their best painting at the end of evolve when refine_rounds is above 0. This file can
+also be run on its own to refine the last painting of a run log, or a checkpoint, and save it as an image.
+
+Example command line:
+    python3 refine.py --target 'Testing Images/original_image.png' --input GALog --output refined.png
+"""
+
+from checkpoint import loadCheckpoint
+from fitness import FitnessEngine, METRICS
+from genome import scaleGenome
+from painting import Painting
+from renderer import getRenderer
+from runlog import RunLog
+from scipy.spatial import cKDTree
+from PIL import Image
+import numpy as np
+import argparse
+import time
+import os
+
+# the moves tried by refineMoves, in units of the step
+DIRECTIONS = np.array([(1, 0), (-1, 0), (0, 1), (0, -1)])
+
+
+def cellHistograms(painting, target):
+    """
+    Returns an (N, 3, 256) array with the histogram of the target colours over the cell of every point, built from one
+    labelling of the image, or one tile at a time for tiled paintings.
+
+    painting: a Painting object
+    target: the (img_height, img_width, 3) array of the target
+    """
+    renderer = getRenderer(painting.img_width, painting.img_height)
+    seeds = painting.genome[:, :2]
+    n = len(seeds)
+    if renderer.tile_size is not None:
+        windows = renderer.tiles()
+    else:
+        windows = [(0, painting.img_height, 0, painting.img_width)]
+    tree = cKDTree(seeds) if n > 1 else None
+    histograms = np.zeros((n, 3, 256), dtype=np.int64)
+    for y0, y1, x0, x1 in windows:
+        labels = renderer.labels(seeds, tree, (y0, y1, x0, x1)).ravel().astype(np.int64) * 256
+        pixels = target[y0:y1, x0:x1].reshape(-1, 3)
+        for channel in range(3):
+            histograms[:, channel] += np.bincount(labels + pixels[:, channel], minlength=n * 256).reshape(n, 256)
+    return histograms
+
+
+def fitColors(painting, fitness_engine):
+    """
+    Sets the colour of every point to the best colour for its cell under the metric of the fitness engine, the mean of
+    every channel for 'sse' and the median otherwise. Points without pixels keep their colour.
+    Returns the number of points whose colour changed.
+
+    painting: a Painting object of the size of the target
+    fitness_engine: the FitnessEngine scoring the painting
+    """
+    histograms = cellHistograms(painting, fitness_engine.target)
+    counts = histograms[:, 0].sum(axis=1)
+    filled = counts > 0
+    if fitness_engine.metric != 'sse':
+        # the first value at which the cumulative count reaches half of the cell
+        cumulative = np.cumsum(histograms[filled], axis=2)
+        colors = np.argmax(cumulative * 2 >= counts[filled, None, None], axis=2)
+    else:
+        colors = np.rint(histograms[filled] @ np.arange(256) / counts[filled, None])
+    old = painting.genome[filled, 2:].copy()
+    painting.genome[filled, 2:] = colors
+    return int((painting.genome[filled, 2:] != old).any(axis=1).sum())
+
+
+def refineMoves(painting, window_error, step):
+    """
+    Tries to move every point by step pixels in each of DIRECTIONS and keeps the move that lowers the error the most,
+    if any. Returns the number of points that moved.
+
+    painting: a Painting object
+    window_error: the error function used to score the painting, see Painting.getError
+    step: the number of pixels to move by
+    """
+    error = painting.getError(window_error)
+    limits = np.array([painting.img_width, painting.img_height])
+    moved = 0
+    for i in range(len(painting.genome)):
+        start = painting.genome[i, :2].copy()
+        # a copy holding the render cache of the current points, so a rejected move is undone without rescoring
+        saved = Painting(painting.genome.copy(), painting.img_width, painting.img_height)
+        saved.inherit(painting)
+        best, best_error = None, error
+        for direction in DIRECTIONS:
+            location = np.clip(start + direction * step, 0, limits)
+            if (location == start).all():
+                continue
+            painting.genome[i, :2] = location
+            candidate = painting.getError(window_error)
+            if candidate < best_error:
+                best, best_error = location, candidate
+            painting.genome[i, :2] = start
+            painting.inherit(saved)
+        if best is not None:
+            painting.genome[i, :2] = best
+            error = painting.getError(window_error)
+            moved += 1
+    return moved
+
+
+def refinePainting(painting, fitness_engine, max_rounds=20, max_step=8, window_error=None, verbose=False):
+    """
+    Refines a copy of a painting with fitColors and refineMoves until it stops improving. Returns the refined painting.
+
+    painting: a Painting object of the size of the target
+    fitness_engine: the FitnessEngine of the target
+    max_rounds: optional, the largest number of rounds
+    max_step: optional, the first step of refineMoves in pixels
+    window_error: optional, the error function to use, the window_error of the fitness engine by default
+    verbose: optional, print the fitness after every round
+    """
+    window_error = window_error or fitness_engine.window_error
+    refined = Painting(painting.genome.copy(), painting.img_width, painting.img_height)
+    error = refined.getError(window_error)
+    step = max_step
+    for round_number in range(max_rounds):
+        colors = refined.genome[:, 2:].copy()
+        fitColors(refined, fitness_engine)
+        if refined.getError(window_error) > error:
+            # the colours are only the best up to rounding, or close to the best for the other metrics and options
+            refined.genome[:, 2:] = colors
+        moved = refineMoves(refined, window_error, step)
+        new_error = refined.getError(window_error)
+        if verbose:
+            fitness = fitness_engine.to_percent(new_error)
+            print(f'round {round_number + 1}: step {step}, {moved} points moved, fitness {fitness}')
+        if moved == 0:
+            if step == 1 and new_error >= error:
+                break
+            step = max(1, step // 2)
+        error = new_error
+    return refined
+
+
+def savePainting(painting, filename):
+    """
+    Saves the image of a painting, and its size and points (see Painting.toString) to a .txt file next to it.
+
+    painting: a Painting object
+    filename: the path of the image
+    """
+    Image.fromarray(painting.getImage()).save(filename)
+    with open(os.path.splitext(filename)[0] + '.txt', 'w') as file:
+        file.write(painting.toString())
+
+
+def loadGenomes(filename, generation=None):
+    """
+    Returns a list of genomes and the (width, height) of the paintings they belong to from a run log or a checkpoint.
+    For a run log this is the best painting of the generation (the last one by default), for a checkpoint every painting
+    of the population.
+
+    filename: a run log name (like 'GALog') or a .npz checkpoint
+    generation: optional, the generation of a run log
+    """
+    if filename.endswith('.npz'):
+        checkpoint = loadCheckpoint(filename)
+        return checkpoint['genomes'], checkpoint['img_size']
+    log = RunLog(filename.removesuffix('.stats'))
+    if generation is None:
+        generation = int(log.stats()['generation'][-1])
+    return [log.genome(generation)], log.imgSize()
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Refine the best painting of a run directly against the target.')
+    parser.add_argument('--target', default='Testing Images/original_image.png', help='the target image of the run')
+    parser.add_argument('--input', default='GALog', help='the run log of the run, or a checkpoint.npz')
+    parser.add_argument('--generation', type=int, help='the generation of the run log to refine, the last by default')
+    parser.add_argument('--output', default='refined.png', help='the refined image, the points are saved next to it')
+    parser.add_argument('--rounds', type=int, default=20, help='the largest number of rounds')
+    parser.add_argument('--max-step', type=int, default=8, help='the first distance the points are moved by')
+    parser.add_argument('--metric', choices=list(METRICS), default='sad')
+    parser.add_argument('--weights', help='edges, or a greyscale mask image of the pixels that count more')
+    parser.add_argument('--structure', type=float, default=0, help='the weight of the structural term of the metric')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    target_image = Image.open(args.target)
+    genomes, size = loadGenomes(args.input, args.generation)
+    # the paintings may have been saved at a lower resolution level
+    paintings = [Painting(scaleGenome(genome, size, target_image.size), *target_image.size) for genome in genomes]
+    fitness_engine = FitnessEngine(target_image, args.metric, weights=args.weights, structure=args.structure)
+    painting = min(paintings, key=lambda painting: painting.getError(fitness_engine.window_error))
+    print(f'fitness {fitness_engine.to_percent(painting.getError(fitness_engine.window_error))}')
+    start = time.perf_counter()
+    refined = refinePainting(painting, fitness_engine, args.rounds, args.max_step, verbose=True)
+    print(f'refined in {time.perf_counter() - start:.1f}s')
+    savePainting(refined, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+This file contains the batch renderer, which turns stored paintings into images without rebuilding them one at a time.
+Paintings can be read from a run log (the best painting of every generation), a checkpoint (every painting of the
+population) or a text file with one painting per line in the 'x,y,r,g,b;' format (like refined.txt, an old
+GAOutput.txt file or an old checkpoint.txt).
+
+Every painting is read together with the size of the target it was evolved for: run logs and checkpoints store it, and
+Painting.toString puts it in front of the points as 'widthxheight:'. Only strings without a size need img_size.
+
+The paintings are rendered by a pool of worker processes, a run of consecutive paintings per task, and every worker keeps
+the render cache of the painting it rendered last. The best painting of a run changes by a few points from one
+generation to the next, so most frames of a run log only re-render the cells that changed. Paintings can be rendered
+at any scale: the points are scaled and the Voronoi diagram is rendered at the output size, so enlarged images stay sharp.
+The images are written to files by the workers (any format pillow can write, like png or webp), or returned as one
+(K, height, width, 3) array.
+
+Example command line:
+    python3 render_paintings.py --input GALog --output-dir frames --stride 10 --scale 2 --workers 4
+"""
+
+from checkpoint import loadCheckpoint
+from genome import DTYPE, genomeFromString, sizeFromString, scaleGenome
+from painting import Painting
+from runlog import RunLog
+from multiprocessing import Pool
+from PIL import Image
+import numpy as np
+import itertools
+import argparse
+import os
+
+# the number of consecutive paintings in a task of a worker, a worker only re-renders what changed within a task
+PAINTINGS_PER_TASK = 16
+
+
+def readPaintings(filename, start=None, stop=None, stride=1, img_size=None):
+    """
+    Yields the name, genome and (width, height) of every painting stored in a file, one painting at a time.
+
+    filename: a run log name (like 'GALog'), a .npz checkpoint, or a .txt file with one painting per line
+    start, stop, stride: optional, for run logs the range of generations to read, see RunLog.genomes, for the other
+                         files the range of paintings
+    img_size: optional, the (width, height) of strings that do not store their size
+    """
+    if filename.endswith('.npz'):
+        checkpoint = loadCheckpoint(filename)
+        paintings = ((f'painting_{i:04d}', genome, checkpoint['img_size'])
+                     for i, genome in enumerate(checkpoint['genomes']))
+        yield from itertools.islice(paintings, start, stop, stride)
+    elif filename.endswith('.txt'):
+        yield from itertools.islice(readTextFile(filename, img_size), start, stop, stride)
+    else:
+        log = RunLog(filename.removesuffix('.stats'))
+        size = log.imgSize()
+        for generation, genome in log.genomes(start, stop, stride):
+            yield f'generation_{generation:06d}', genome, size
+
+
+def readTextFile(filename, img_size=None):
+    """
+    Yields the name, genome and (width, height) of every painting of a text file with one painting per line. The lines
+    of an old GAOutput.txt file ('generation average best points') and old checkpoint.txt files are read as well.
+
+    filename: the path of the file
+    img_size: optional, the (width, height) of strings that do not store their size
+    """
+    count = 0
+    with open(filename, 'r') as file:
+        for number, line in enumerate(file):
+            row = line.split()
+            # the 'Generation: N' line of an old checkpoint.txt is not a painting
+            if not row or row[0] == 'Generation:':
+                continue
+            name = f'painting_{count:04d}'
+            count += 1
+            if len(row) >= 4:
+                name, row = f'generation_{int(row[0]):06d}', row[3:]
+            size = sizeFromString(row[0]) or img_size
+            if size is None:
+                raise ValueError(f'line {number + 1} of {filename} does not store the size of its painting, '
+                                 'give img_size (--size)')
+            yield name, genomeFromString(row[0]), tuple(size)
+
+
+def batched(iterable, size):
+    # yields lists of up to size consecutive items of an iterable
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def renderSequence(genomes, img_size, scale=1.0):
+    """
+    Yields the RGB uint8 image of every genome in turn. The render cache of each painting is kept for the next one, so
+    a genome that differs from the one before by a few points only re-renders their cells.
+
+    genomes: an iterable of (N, 5) genomes
+    img_size: the (width, height) the genomes belong to
+    scale: optional, the size of the images relative to img_size
+    """
+    size = (max(1, round(img_size[0] * scale)), max(1, round(img_size[1] * scale)))
+    painting = None
+    for genome in genomes:
+        genome = scaleGenome(np.asarray(genome, dtype=DTYPE), img_size, size)
+        if painting is None or painting.genome.shape != genome.shape:
+            painting = Painting(genome, *size)
+        else:
+            painting.genome = genome
+        yield painting.getImage()[..., :3]
+
+
+def renderTask(task):
+    """
+    Renders a run of paintings, this is the function run by the workers. Returns the paths of the files written, or the
+    images if output_dir is None.
+
+    task: a tuple of the list of (name, genome, img_size), the scale, the output directory and the image format
+    """
+    paintings, scale, output_dir, image_format = task
+    results = []
+    # consecutive paintings of the same size share a render cache
+    for size, group in itertools.groupby(paintings, key=lambda painting: painting[2]):
+        names, genomes, _ = zip(*group)
+        for name, image in zip(names, renderSequence(genomes, size, scale)):
+            if output_dir is None:
+                results.append(image)
+                continue
+            path = os.path.join(output_dir, f'{name}.{image_format}')
+            Image.fromarray(image).save(path)
+            results.append(path)
+    return results
+
+
+def renderPaintings(paintings, scale=1.0, workers=1, output_dir=None, image_format='png'):
+    """
+    Renders many paintings across a pool of workers. Returns the list of files written, or a (K, height, width, 3)
+    uint8 array of the images if output_dir is None (the paintings then need to have the same size).
+
+    paintings: an iterable of (name, genome, img_size), like the one returned by readPaintings
+    scale: optional, the size of the images relative to the size of each painting
+    workers: optional, the number of processes rendering paintings
+    output_dir: optional, the directory to write an image file for every painting to
+    image_format: optional, the extension of the image files, like 'png' or 'webp'
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    tasks = ((run, scale, output_dir, image_format) for run in batched(paintings, PAINTINGS_PER_TASK))
+    if workers > 1:
+        with Pool(workers) as pool:
+            # the tasks only carry genomes, the images are written by the workers
+            results = [result for batch in pool.imap(renderTask, tasks) for result in batch]
+    else:
+        results = [result for batch in map(renderTask, tasks) for result in batch]
+    if output_dir is None:
+        return np.stack(results) if results else np.zeros((0, 0, 0, 3), dtype=np.uint8)
+    return results
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='Render stored paintings to image files.')
+    parser.add_argument('--input', default='GALog',
+                        help='a run log, a checkpoint.npz, or a .txt file with one painting per line')
+    parser.add_argument('--output-dir', default='renders', help='the directory the images are written to')
+    parser.add_argument('--format', default='png', help='the image format, like png or webp')
+    parser.add_argument('--start', type=int, help='the first generation of a run log, or the first painting of a file')
+    parser.add_argument('--stop', type=int, help='the generation or painting to stop before')
+    parser.add_argument('--stride', type=int, default=1, help='only render every stride-th generation or painting')
+    parser.add_argument('--scale', type=float, default=1.0, help='the size of the images relative to the target')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'),
+                        help='the size of paintings stored without one, like the lines of an old GAOutput.txt')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='the number of processes rendering')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    paintings = readPaintings(args.input, args.start, args.stop, args.stride, args.size)
+    files = renderPaintings(paintings, args.scale, args.workers, args.output_dir, args.format)
+    print(f'wrote {len(files)} images to {args.output_dir}')
+
+
+if __name__ == '__main__':
+    main()
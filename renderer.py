@@ -0,0 +1,606 @@
+"""
+This file contains the Renderer class. A Renderer turns the points of a Painting into an image by labelling every pixel
+with the index of its nearest point and then colouring the whole image with a single palette lookup. Because every pixel
+belongs to some point there are no unbounded edge cells and no background showing through.
+
+The whole image is labelled one row of every cell at a time (scanLabels). The Delaunay triangulation of the points gives
+the neighbours of every cell, and the bisectors to those neighbours bound each row of the cell to a single run of pixels,
+so the label map is filled with one np.repeat of the runs.
+
+Windows are labelled in square blocks of pixels. A KD-tree over the points is queried once per block to find every point
+that could be the nearest point of some pixel in that block. Blocks with a single candidate are filled directly and the rest
+are solved by comparing squared distances to their few candidates. When two points are the same distance from a pixel the
+point with the lower index wins, both when scanning and in blocks, so the label of a pixel only depends on the points and
+never on how the image was labelled.
+
+The Renderer also supports re-rendering only part of an image. cellWindow finds a rectangle that is guaranteed to contain
+the cell of a point by clipping the image with the bisectors of its neighbours (cellWindows does the same for many points at
+once from the corners of their cells), and labelWindows finds the rectangle of every cell in a label array. Relabelling the
+union of the old and new rectangles of the moved points is exactly the same as labelling the whole image again.
+
+Very large images are split into square tiles of tile_size pixels. The points whose cells reach into a tile are found
+through the same KD-tree as the blocks, so a tile is labelled, coloured or scored on its own and the memory used only
+depends on the size of a tile. getRenderer tiles every image with more than TILED_PIXELS pixels.
+
+The constructor takes in 2 required parameters: img_width and img_height which are the size of the image being rendered.
+The constructor also takes in 2 optional parameters: block_size which is the side length of the blocks in pixels, and
+tile_size which is the side length of the tiles in pixels (None to never tile).
+"""
+
+from functools import lru_cache
+from scipy.spatial import cKDTree, Delaunay, QhullError
+from scipy import ndimage
+import numpy as np
+
+BLOCK_SIZE = 16
+# images with more pixels than this are rendered and scored one tile of TILE_SIZE by TILE_SIZE pixels at a time
+TILED_PIXELS = 2048 * 2048
+TILE_SIZE = 256
+# scanLabels gives up when more than 1 / SCAN_BAD_ROWS of the rows have to be labelled again with blockLabels
+SCAN_BAD_ROWS = 16
+# scanLabels leaves images whose cells have fewer pixels than this on average to blockLabels
+SCAN_CELL_PIXELS = 256
+# cellWindows triangulates all the seeds instead of clipping polygons when asked for more than 1 / CELL_WINDOW_SEEDS of them
+CELL_WINDOW_SEEDS = 100
+
+
+class Renderer:
+    def __init__(self, img_width, img_height, block_size=BLOCK_SIZE, tile_size=None):
+        self.img_width, self.img_height = img_width, img_height
+        self.block_size = block_size
+        self.tile_size = tile_size
+        # the furthest any pixel of a block can be from the centre of the block
+        self.block_radius = (block_size - 1) / np.sqrt(2)
+        self.offsets = np.arange(block_size, dtype=np.int64)
+
+    def render(self, seeds, colors):
+        """
+        Returns the (img_height, img_width, 4) RGBA uint8 array of the Voronoi diagram defined by the seeds.
+
+        seeds: an (N, 2) integer array of x, y locations
+        colors: an (N, 3) array of r, g, b values
+        """
+        if self.tile_size is None:
+            return self.colorize(self.labels(seeds), colors)
+        # only the output is full size, the labels are made one tile at a time
+        seeds = np.asarray(seeds, dtype=np.int64)
+        tree = cKDTree(seeds)
+        image = np.empty((self.img_height, self.img_width, 4), dtype=np.uint8)
+        for y0, y1, x0, x1 in self.tiles():
+            image[y0:y1, x0:x1] = self.colorize(self.labels(seeds, tree, (y0, y1, x0, x1)), colors)
+        return image
+
+    def colorize(self, labels, colors):
+        """
+        Colours an array of labels with a single palette lookup.
+
+        labels: an integer array of point indices
+        colors: an (N, 3) array of r, g, b values
+        """
+        palette = np.full((len(colors), 4), 255, dtype=np.uint8)
+        palette[:, :3] = np.clip(colors, 0, 255)
+        # every pixel is gathered as one 32 bit word instead of four bytes, np.take is faster than indexing for this
+        pixels = np.take(palette.view(np.uint32)[:, 0], labels)
+        return pixels.view(np.uint8).reshape(*labels.shape, 4)
+
+    def labels(self, seeds, tree=None, window=None):
+        """
+        Returns an int32 array holding the index of the nearest seed for every pixel. The whole image is labelled row by
+        row from the Delaunay triangulation of the seeds (see scanLabels), windows are labelled block by block.
+
+        seeds: an (N, 2) integer array of x, y locations
+        tree: optional, a cKDTree built over the seeds so it can be shared between calls
+        window: optional, a (y0, y1, x0, x1) tuple to only label part of the image
+        """
+        if window is None or tuple(window) == (0, self.img_height, 0, self.img_width):
+            scanned = self.scanLabels(seeds)
+            if scanned is not None:
+                return scanned[0]
+        return self.blockLabels(seeds, tree, window)
+
+    def labelMap(self, seeds, dtype=np.int32):
+        """
+        Returns the labels of the whole image and an (N, 4) array with the (y0, y1, x0, x1) window of every label, see
+        labels and labelWindows. scanLabels finds the windows along with the labels.
+
+        seeds: an (N, 2) integer array of x, y locations
+        dtype: optional, the integer type of the labels
+        """
+        scanned = self.scanLabels(seeds, dtype)
+        if scanned is not None:
+            return scanned
+        labels = self.blockLabels(seeds)
+        return labels.astype(dtype, copy=False), self.labelWindows(labels, len(seeds))
+
+    def scanLabels(self, seeds, dtype=np.int32):
+        """
+        Labels the whole image one row of every cell at a time. Returns an (img_height, img_width) array and the
+        window of every label like labelWindows, or None if blockLabels should be used instead.
+
+        The pixels of a row that belong to a cell form one run, bounded by the bisectors between its seed and its
+        Delaunay neighbours. Four seeds far outside the image close every cell of the image, and each bound is worked
+        out exactly from integers (a tie goes to the lower index), so the runs are the same pixels blockLabels finds.
+        When more than three seeds lie on one circle the triangulation can leave out a neighbour and two runs overlap at
+        a tie. Rows with an overlap are labelled again with blockLabels, and if more than 1 / SCAN_BAD_ROWS of the rows
+        have one (seeds packed much closer than a pixel apart) None is returned.
+
+        seeds: an (N, 2) integer array of x, y locations
+        dtype: optional, the integer type of the labels
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        width, height = self.img_width, self.img_height
+        if len(seeds) * SCAN_CELL_PIXELS > width * height:
+            return None
+        triangulated = self.triangulate(seeds)
+        if triangulated is None:
+            return None
+        first, points, triangulation = triangulated
+        n = len(first)
+        windows = np.tile([height, 0, width, 0], (len(seeds), 1))
+        if n == 1:
+            windows[first[0]] = (0, height, 0, width)
+            return np.full((height, width), first[0], dtype=dtype), windows
+        # every edge of the triangulation in both directions, sorted by the cell it bounds
+        simplices = triangulation.simplices
+        edges = np.concatenate([simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [2, 0]]])
+        edges, inverse = np.unique(np.concatenate([edges, edges[:, ::-1]]) @ np.array([n + 4, 1]), return_inverse=True)
+        # the bisector of an edge only bounds the cell between the corners of the two triangles on either side of it
+        centres = self.circumcentres(points, triangulation)
+        span_low = np.full(len(edges), float(height))
+        span_high = np.full(len(edges), -1.0)
+        np.minimum.at(span_low, inverse, np.tile(centres[1], 6))
+        np.maximum.at(span_high, inverse, np.tile(centres[1], 6))
+        inner = edges < n * (n + 4)
+        cell, neighbours = np.divmod(edges[inner], n + 4)
+
+        # a pixel (x, y) of cell i is no further from seed i than from neighbour j when ax * x + ay * y <= c
+        ax = 2 * (points[neighbours, 0] - points[cell, 0])
+        ay = 2 * (points[neighbours, 1] - points[cell, 1])
+        c = (points[neighbours] ** 2).sum(axis=1) - (points[cell] ** 2).sum(axis=1)
+        index = np.concatenate([first, np.full(4, len(seeds))])
+        c -= index[cell] > index[neighbours]
+        # the rows of every cell, from the corners of the cell (the circumcentres of its triangles) and the neighbours
+        # straight above and below it
+        y0, y1, _, _ = self.cellExtents(centres, triangulation, n)
+        above, below = (ax == 0) & (ay < 0), (ax == 0) & (ay > 0)
+        np.maximum.at(y0, cell[above], -(c[above] // -ay[above]))
+        np.minimum.at(y1, cell[below], c[below] // ay[below])
+
+        # every row of every cell, and the rows of every cell each bisector could bound with one row of margin for the
+        # rounding of the corners. A row that misses the bisector that bounds it is found as an overlap below
+        heights = np.maximum(y1 - y0 + 1, 0)
+        row_start = np.cumsum(heights) - heights
+        row_cell = np.repeat(np.arange(n), heights)
+        row_y = np.arange(len(row_cell)) - np.repeat(row_start - y0, heights)
+        edge_low = np.maximum(np.floor(span_low[inner]).astype(np.int64) - 1, y0[cell])
+        edge_high = np.minimum(np.ceil(span_high[inner]).astype(np.int64) + 1, y1[cell])
+        edge_row = row_start[cell] + edge_low - y0[cell]
+        # the bisectors to the right of a cell bound its runs from the right, those to the left from the left
+        right = self.runBounds(ax > 0, ax, ay, c, edge_low, edge_high, edge_row, len(row_cell), np.minimum)
+        left = self.runBounds(ax < 0, ax, ay, c, edge_low, edge_high, edge_row, len(row_cell), np.maximum)
+        ends = np.minimum(np.floor(right), width - 1).astype(np.int64) + 1
+        starts = np.maximum(np.ceil(left), 0).astype(np.int64)
+        found = starts < ends
+        row_y, starts, ends, row_cell = row_y[found], starts[found], ends[found], row_cell[found]
+        # the runs are still in order of cell and row. A tie that is labelled again below can only make a cell smaller,
+        # and a window that is too large is still correct
+        cells, cell_start = np.unique(row_cell, return_index=True)
+        cell_end = np.append(cell_start[1:], len(row_cell)) - 1
+        windows[first[cells]] = np.column_stack([row_y[cell_start], row_y[cell_end] + 1,
+                                                 np.minimum.reduceat(starts, cell_start),
+                                                 np.maximum.reduceat(ends, cell_start)])
+        lengths = ends - starts
+        # sorted by row and then by start, as 16 bit integers the stable sorts are radix sorts
+        key = np.uint16 if max(width, height) <= 1 << 16 else np.int64
+        order = np.argsort(starts.astype(key), kind='stable')
+        order = order[np.argsort(row_y[order].astype(key), kind='stable')]
+        row_y, starts, lengths, row_cell = row_y[order], starts[order], lengths[order], row_cell[order]
+
+        overlap = (row_y[1:] == row_y[:-1]) & (starts[1:] < starts[:-1] + lengths[:-1])
+        if not overlap.any():
+            if lengths.sum() != width * height:
+                return None
+            return np.repeat(first[row_cell].astype(dtype), lengths).reshape(height, width), windows
+        bad_rows = np.unique(row_y[1:][overlap])
+        good = ~np.isin(row_y, bad_rows)
+        if len(bad_rows) * SCAN_BAD_ROWS > height or lengths[good].sum() != width * (height - len(bad_rows)):
+            return None
+        labels = np.empty((height, width), dtype=dtype)
+        good_rows = np.ones(height, dtype=bool)
+        good_rows[bad_rows] = False
+        labels[good_rows] = np.repeat(first[row_cell[good]].astype(dtype), lengths[good]).reshape(-1, width)
+        if len(bad_rows):
+            tree = cKDTree(seeds)
+            # consecutive rows are labelled together
+            for rows in np.split(bad_rows, np.nonzero(np.diff(bad_rows) > 1)[0] + 1):
+                window = (int(rows[0]), int(rows[-1]) + 1, 0, width)
+                labels[window[0]:window[1]] = self.blockLabels(seeds, tree, window)
+        return labels, windows
+
+    def triangulate(self, seeds):
+        """
+        Returns the index of the first seed at every distinct location, those seeds followed by four seeds far outside
+        the image, and the Delaunay triangulation of them, or None if it cannot be built. Only the lowest index of seeds
+        at the same location gets pixels, and the seeds outside the image close every cell of the image.
+
+        seeds: an (N, 2) integer array of x, y locations
+        """
+        far = 4 * (self.img_width + self.img_height)
+        _, first = np.unique(seeds[:, 0] * (2 * far + 1) + seeds[:, 1], return_index=True)
+        sentinels = np.array([(-far, -far), (self.img_width + far, -far), (-far, self.img_height + far),
+                              (self.img_width + far, self.img_height + far)])
+        points = np.concatenate([seeds[first], sentinels])
+        try:
+            return first, points, Delaunay(points)
+        except QhullError:
+            return None
+
+    def circumcentres(self, points, triangulation):
+        """
+        Returns the x and the y of the circumcentre of every triangle, clipped to one pixel outside the image. These are
+        the corners of the cells.
+
+        points: the (n + 4, 2) array of the seeds and the four seeds outside the image
+        triangulation: the Delaunay triangulation of the points
+        """
+        a, b, c = (points[triangulation.simplices[:, k]].astype(np.float64) for k in range(3))
+        determinant = 2 * (a[:, 0] * (b[:, 1] - c[:, 1]) + b[:, 0] * (c[:, 1] - a[:, 1]) + c[:, 0] * (a[:, 1] - b[:, 1]))
+        squares = [(p * p).sum(axis=1) for p in (a, b, c)]
+        centres = []
+        for axis, size in ((0, self.img_width), (1, self.img_height)):
+            # the centre along one axis takes the differences along the other
+            p, q, r = (v[:, 1 - axis] for v in (a, b, c))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                centre = (squares[0] * (q - r) + squares[1] * (r - p) + squares[2] * (p - q)) / determinant
+            # a flat triangle has its centre at infinity, the cell is not bounded by it
+            centre = centre if axis == 0 else -centre
+            centres.append(np.clip(np.nan_to_num(centre, nan=0.0, posinf=size, neginf=-1.0), -1, size))
+        return centres
+
+    def cellExtents(self, centres, triangulation, n):
+        """
+        Returns the first and last row and the first and last column of the image every cell could reach, from the
+        corners of its triangles, so the cell lies between them.
+
+        centres: the x and y of the circumcentre of every triangle, see circumcentres
+        triangulation: the Delaunay triangulation of the seeds and the four seeds outside the image
+        n: the number of seeds
+        """
+        corners = triangulation.simplices.ravel()
+        extents = []
+        for centre, size in ((centres[1], self.img_height), (centres[0], self.img_width)):
+            low = np.full(n + 4, float(size))
+            high = np.full(n + 4, -1.0)
+            np.minimum.at(low, corners, np.repeat(centre, 3))
+            np.maximum.at(high, corners, np.repeat(centre, 3))
+            # one pixel of margin on both sides for the rounding of the centres
+            extents += [np.maximum(np.floor(low[:n]).astype(np.int64) - 1, 0),
+                        np.minimum(np.ceil(high[:n]).astype(np.int64) + 1, size - 1)]
+        return extents
+
+    def cellWindows(self, tree, seeds, indices):
+        """
+        Returns an (len(indices), 4) array with a (y0, y1, x0, x1) window for each of the seeds that contains every pixel
+        whose nearest seed is that seed, like cellWindow. For more than a few seeds this is done for all of them at once
+        from the corners of the cells in the Delaunay triangulation, which is much cheaper than clipping every polygon.
+
+        tree: a cKDTree built over the seeds
+        seeds: an (N, 2) integer array of x, y locations
+        indices: the indices of the seeds
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        triangulated = None
+        if len(indices) * CELL_WINDOW_SEEDS > len(seeds):
+            triangulated = self.triangulate(seeds)
+        if triangulated is None:
+            return np.array([self.cellWindow(tree, seeds, i) for i in indices], dtype=np.int64).reshape(-1, 4)
+        first, points, triangulation = triangulated
+        y0, y1, x0, x1 = self.cellExtents(self.circumcentres(points, triangulation), triangulation, len(first))
+        windows = np.tile([self.img_height, 0, self.img_width, 0], (len(seeds), 1))
+        windows[first] = np.column_stack([y0, y1 + 1, x0, x1 + 1])
+        return windows[indices]
+
+    def runBounds(self, side, ax, ay, c, edge_low, edge_high, edge_row, rows, reduce):
+        """
+        Returns the tightest bound on x of every row of every cell from the bisectors on one side of it, as floats. A row
+        without a bisector is not bounded. A quotient of integers of this size is only rounded when it is not a whole
+        number, and never across one, so its floor or ceiling is exact.
+
+        side: a boolean array selecting the bisectors on one side
+        ax, ay, c: the bisectors, see scanLabels
+        edge_low, edge_high: the first and last row each bisector bounds
+        edge_row: the index of the first row each bisector bounds among the rows of every cell
+        rows: the number of rows of every cell
+        reduce: np.minimum for the right side, np.maximum for the left side
+        """
+        ax, ay, c = ax[side].astype(np.float64), ay[side].astype(np.float64), c[side].astype(np.float64)
+        edge_low, edge_row = edge_low[side], edge_row[side]
+        counts = np.maximum(edge_high[side] - edge_low + 1, 0)
+        # every row of every bisector
+        edge = np.repeat(np.arange(len(counts)), counts)
+        step = np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+        bounds = np.full(rows, np.inf if reduce is np.minimum else -np.inf)
+        reduce.at(bounds, edge_row[edge] + step, (c[edge] - ay[edge] * (edge_low[edge] + step)) / ax[edge])
+        return bounds
+
+    def blockLabels(self, seeds, tree=None, window=None):
+        """
+        Returns an int32 array holding the index of the nearest seed for every pixel of a window, one block at a time.
+
+        seeds: an (N, 2) integer array of x, y locations
+        tree: optional, a cKDTree built over the seeds so it can be shared between calls
+        window: optional, a (y0, y1, x0, x1) tuple to only label part of the image
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        y0, y1, x0, x1 = window if window is not None else (0, self.img_height, 0, self.img_width)
+        bs = self.block_size
+        # the top left pixel of every block covering the window
+        block_y, block_x = np.mgrid[y0:y1:bs, x0:x1:bs]
+        rows, cols = block_y.shape
+        block_x, block_y = block_x.ravel(), block_y.ravel()
+        blocks = np.zeros((len(block_x), bs, bs), dtype=np.int32)
+
+        if len(seeds) > 1:
+            if tree is None:
+                tree = cKDTree(seeds)
+            centres = np.column_stack([block_x + (bs - 1) / 2, block_y + (bs - 1) / 2])
+            candidates, counts = self.candidates(tree, centres)
+            # blocks are grouped by how many candidates they have so each group is one vectorized comparison
+            for count in np.unique(counts):
+                group = np.nonzero(counts == count)[0]
+                if count == 1:
+                    blocks[group] = candidates[group, :1, None]
+                else:
+                    blocks[group] = self.nearest(seeds, candidates[group, :count], block_x[group], block_y[group])
+
+        labels = blocks.reshape(rows, cols, bs, bs).transpose(0, 2, 1, 3).reshape(rows * bs, cols * bs)
+        return labels[:y1 - y0, :x1 - x0]
+
+    def tiles(self):
+        # returns a (T, 4) array with the (y0, y1, x0, x1) window of every tile, row by row
+        size = self.tile_size or max(self.img_width, self.img_height)
+        y0, x0 = np.meshgrid(np.arange(0, self.img_height, size), np.arange(0, self.img_width, size), indexing='ij')
+        y0, x0 = y0.ravel(), x0.ravel()
+        return np.column_stack([y0, np.minimum(y0 + size, self.img_height), x0, np.minimum(x0 + size, self.img_width)])
+
+    def tileErrors(self, seeds, colors, window_error, tiles, tree=None):
+        """
+        Returns the error of every tile, labelling one tile at a time so the label map of the whole image is never made.
+
+        seeds: an (N, 2) integer array of x, y locations
+        colors: an (N, 3) array of r, g, b values
+        window_error: a function taking (labels, colors, window) that returns the error of a (y0, y1, x0, x1) window
+        tiles: a (T, 4) array of the windows of the tiles to score, see tiles
+        tree: optional, a cKDTree built over the seeds
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        if tree is None:
+            tree = cKDTree(seeds)
+        errors = np.zeros(len(tiles), dtype=np.int64)
+        for t, tile in enumerate(tiles):
+            y0, y1, x0, x1 = (int(v) for v in tile)
+            # a pixel can be compared to its right and lower neighbour, which may be in the next tile. The tile is
+            # labelled with one more row and column and their own error is taken away again, so a pair of pixels across
+            # a seam is counted once, by the tile on its left or above, and the tiles add up to the whole image
+            y2, x2 = min(y1 + 1, self.img_height), min(x1 + 1, self.img_width)
+            labels = self.labels(seeds, tree, (y0, y2, x0, x2))
+            error = window_error(labels, colors, (y0, y2, x0, x2))
+            if x2 > x1:
+                error -= window_error(labels[:, -1:], colors, (y0, y2, x1, x2))
+            if y2 > y1:
+                error -= window_error(labels[-1:], colors, (y1, y2, x0, x2))
+            if x2 > x1 and y2 > y1:
+                error += window_error(labels[-1:, -1:], colors, (y1, y2, x1, x2))
+            errors[t] = error
+        return errors
+
+    def candidates(self, tree, centres, k=8):
+        """
+        Finds every seed that could be the nearest seed of a pixel in each block. For a pixel q in a block with centre c
+        and nearest seed n, its own nearest seed s satisfies |c - s| <= |c - q| + |q - s| <= 2 * block_radius + |c - n|.
+
+        Returns an (M, K) array of candidate indices sorted in ascending order (padded with N) and the number of
+        candidates of every block.
+
+        tree: a cKDTree built over the seeds
+        centres: an (M, 2) array of block centres
+        k: the number of seeds to query per block before widening the search
+        """
+        n = tree.n
+        k = min(k, n)
+        distances, indices = tree.query(centres, k=k)
+        valid = distances <= distances[:, :1] + 2 * self.block_radius + 1e-6
+        candidates = np.where(valid, indices, n)
+        candidates.sort(axis=1)
+        counts = valid.sum(axis=1)
+
+        # blocks where all k seeds are candidates might have more, so search again with a larger k
+        unsure = np.nonzero((counts == k) & (k < n))[0]
+        if len(unsure):
+            wider, wider_counts = self.candidates(tree, centres[unsure], k * 2)
+            padded = np.full((len(centres), wider.shape[1]), n, dtype=candidates.dtype)
+            padded[:, :k] = candidates
+            padded[unsure] = wider
+            candidates = padded
+            counts[unsure] = wider_counts
+        return candidates, counts
+
+    def nearest(self, seeds, candidates, block_x, block_y):
+        """
+        Labels every pixel of a group of blocks by comparing squared distances to each block's candidates.
+        The index of a candidate is packed below its squared distance, so a running minimum over the candidates finds
+        the nearest one and breaks ties in favour of the lower index. The distances are separable, so only a row and a
+        column of every candidate are computed and each candidate costs one addition and one minimum per pixel.
+
+        seeds: an (N, 2) integer array of x, y locations
+        candidates: an (M, K) array of candidate indices for each block
+        block_x, block_y: arrays of length M with the top left pixel of each block
+        """
+        seed_x = seeds[candidates, 0]
+        seed_y = seeds[candidates, 1]
+        dx = block_x[:, None, None] + self.offsets - seed_x[:, :, None]
+        dy = block_y[:, None, None] + self.offsets - seed_y[:, :, None]
+        bits = len(seeds).bit_length()
+        rows = ((dy * dy) << bits) + candidates[:, :, None]
+        cols = (dx * dx) << bits
+        best = rows[:, 0, :, None] + cols[:, 0, None, :]
+        keys = np.empty_like(best)
+        for k in range(1, candidates.shape[1]):
+            np.add(rows[:, k, :, None], cols[:, k, None, :], out=keys)
+            np.minimum(best, keys, out=best)
+        return best & ((1 << bits) - 1)
+
+    def cellWindow(self, tree, seeds, i):
+        """
+        Returns a (y0, y1, x0, x1) window that contains every pixel whose nearest seed is seed i.
+        The image is clipped by the bisector between seed i and each of its neighbours, nearest first. A seed further than
+        twice the distance to the furthest corner of the clipped polygon cannot cut it any more, so we can stop there.
+
+        tree: a cKDTree built over the seeds
+        seeds: an (N, 2) integer array of x, y locations
+        i: the index of the seed
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        point = seeds[i].astype(float)
+        # the polygon starts as the rectangle through the centres of the corner pixels
+        polygon = [(0.0, 0.0), (self.img_width - 1.0, 0.0),
+                   (self.img_width - 1.0, self.img_height - 1.0), (0.0, self.img_height - 1.0)]
+        n = len(seeds)
+        searched, k = 0, min(8, n)
+        finished = False
+        while polygon and not finished:
+            distances, indices = tree.query(point, k=k)
+            for distance, j in zip(np.atleast_1d(distances)[searched:], np.atleast_1d(indices)[searched:]):
+                radius = max(np.hypot(x - point[0], y - point[1]) for x, y in polygon)
+                if distance > 2 * radius:
+                    finished = True
+                    break
+                normal = seeds[j] - point
+                if j != i and normal.any():
+                    # keep the side of the bisector that is closer to seed i
+                    # a tiny margin keeps pixels that sit exactly on the bisector
+                    polygon = clipPolygon(polygon, normal, (seeds[j] @ seeds[j] - point @ point) / 2 + 1e-6)
+                    if not polygon:
+                        break
+            finished = finished or k == n
+            searched, k = k, min(k * 2, n)
+
+        return polygonWindow(polygon, self.img_width, self.img_height)
+
+    def labelWindows(self, labels, n, window=None):
+        """
+        Returns an (n, 4) array with the (y0, y1, x0, x1) window of every label in a label array.
+        Labels that do not appear get an empty window that is absorbed by unionWindows.
+
+        labels: an integer array of point indices
+        n: the number of points
+        window: optional, the (y0, y1, x0, x1) window of the image that labels covers
+        """
+        y0, _, x0, _ = window if window is not None else (0, self.img_height, 0, self.img_width)
+        windows = np.tile([self.img_height, 0, self.img_width, 0], (n, 1))
+        for i, found in enumerate(ndimage.find_objects(labels.astype(np.int32) + 1, max_label=n)):
+            if found is not None:
+                rows, cols = found
+                windows[i] = (rows.start + y0, rows.stop + y0, cols.start + x0, cols.stop + x0)
+        return windows
+
+
+def clipPolygon(polygon, normal, offset):
+    """
+    Clips a convex polygon to the half-plane normal . p <= offset (Sutherland-Hodgman with a single edge).
+
+    polygon: a list of (x, y) vertices
+    normal: the normal of the half-plane
+    offset: the offset of the half-plane
+    """
+    clipped = []
+    for k in range(len(polygon)):
+        current, following = polygon[k], polygon[(k + 1) % len(polygon)]
+        current_side = normal[0] * current[0] + normal[1] * current[1] - offset
+        following_side = normal[0] * following[0] + normal[1] * following[1] - offset
+        if current_side <= 0:
+            clipped.append(current)
+        if (current_side < 0 < following_side) or (following_side < 0 < current_side):
+            t = current_side / (current_side - following_side)
+            clipped.append((current[0] + t * (following[0] - current[0]), current[1] + t * (following[1] - current[1])))
+    return clipped
+
+
+def polygonWindow(polygon, img_width, img_height):
+    """
+    Returns the (y0, y1, x0, x1) window of the pixels covered by a polygon, or an empty window if there is no polygon.
+
+    polygon: a list of (x, y) vertices
+    img_width, img_height: the size of the image the window is clipped to
+    """
+    if not polygon:
+        return (0, 0, 0, 0)
+    xs = [x for x, _ in polygon]
+    ys = [y for _, y in polygon]
+    return (max(int(np.floor(min(ys) - 1e-6)), 0), min(int(np.ceil(max(ys) + 1e-6)) + 1, img_height),
+            max(int(np.floor(min(xs) - 1e-6)), 0), min(int(np.ceil(max(xs) + 1e-6)) + 1, img_width))
+
+
+def unionWindows(a, b):
+    # the smallest window containing both windows, empty windows are ignored
+    if a[0] >= a[1] or a[2] >= a[3]:
+        return tuple(b)
+    if b[0] >= b[1] or b[2] >= b[3]:
+        return tuple(a)
+    return (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+
+
+def growWindow(window, margin, img_width, img_height):
+    """
+    Returns a (y0, y1, x0, x1) window grown by margin pixels on every side and clipped to the image. Empty windows stay
+    empty.
+    """
+    y0, y1, x0, x1 = window
+    if y0 >= y1 or x0 >= x1:
+        return window
+    return (max(0, y0 - margin), min(img_height, y1 + margin), max(0, x0 - margin), min(img_width, x1 + margin))
+
+
+def overlapsWindows(tiles, windows):
+    """
+    Returns a boolean array that is True for every tile that overlaps at least one of the windows.
+
+    tiles: a (T, 4) array of (y0, y1, x0, x1) windows
+    windows: a list of (y0, y1, x0, x1) windows, empty windows overlap nothing
+    """
+    if len(windows) == 0:
+        return np.zeros(len(tiles), dtype=bool)
+    w = np.asarray(windows)[None]
+    t = np.asarray(tiles)[:, None]
+    overlap = (t[..., 0] < w[..., 1]) & (w[..., 0] < t[..., 1]) & (t[..., 2] < w[..., 3]) & (w[..., 2] < t[..., 3])
+    return overlap.any(axis=1)
+
+
+def mergeWindows(windows):
+    """
+    Merges a list of (y0, y1, x0, x1) windows until none of them overlap, so no pixel is counted twice.
+    Empty windows are dropped.
+    """
+    merged = [tuple(w) for w in windows if w[0] < w[1] and w[2] < w[3]]
+    overlapping = True
+    while overlapping:
+        overlapping = False
+        for a in range(len(merged)):
+            for b in range(a + 1, len(merged)):
+                first, second = merged[a], merged[b]
+                if first[0] < second[1] and second[0] < first[1] and first[2] < second[3] and second[2] < first[3]:
+                    merged[a] = unionWindows(first, second)
+                    del merged[b]
+                    overlapping = True
+                    break
+            if overlapping:
+                break
+    return merged
+
+
+@lru_cache(maxsize=None)
+def getRenderer(img_width, img_height):
+    # renderers are shared between every painting with the same size
+    tile_size = TILE_SIZE if img_width * img_height > TILED_PIXELS else None
+    return Renderer(img_width, img_height, tile_size=tile_size)
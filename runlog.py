@@ -0,0 +1,232 @@
+"""
+This file contains the RunLog class. A run log records the progress of a run of the Darwin class in two files that
+replace the old GAOutput.txt text file:
+    - <name>.stats: a small header followed by one fixed width record of STATS_DTYPE per generation with the average,
+      best, median and standard deviation of the fitness, the diversity of the population, and where the best painting
+      of the generation is stored in the genomes file. The records double as the index of the log: they are sorted by
+      generation, so the record of a generation is found with a binary search over a memory map of the file.
+    - <name>.genomes: a small header followed by the best genome of every generation. Most entries are deltas that hold
+      only the points that changed since the previous entry. Every KEYFRAME_INTERVAL entries (and whenever too many
+      points changed or the number of points changed) a keyframe holding the whole genome is written, so any generation
+      can be rebuilt by reading at most KEYFRAME_INTERVAL entries.
+
+Genomes are always stored at the full size of the target, so runs with a coarse to fine schedule can be replayed at one
+size. Both files are only ever appended to. Opening a log to continue a run drops any records after the generation of the
+checkpoint, and any half written entry at the end of the files.
+
+The constructor takes in 1 required parameter: name which is the path of the log without the extensions.
+"""
+
+import numpy as np
+import struct
+import os
+
+VERSION = 1
+STATS_MAGIC = b'GALOGSTATS'
+GENOMES_MAGIC = b'GALOGGENOMES'
+# the header of the stats file: magic, version, image width and image height
+STATS_HEADER = struct.Struct('<10sHII')
+# the header of the genomes file: magic and version
+GENOMES_HEADER = struct.Struct('<12sH')
+STATS_DTYPE = np.dtype([
+    ('generation', '<i8'),
+    ('average', '<f8'),
+    ('best', '<f8'),
+    ('median', '<f8'),
+    ('std', '<f8'),
+    ('diversity', '<f8'),
+    # the offset of the entry of the best genome in the genomes file and of the keyframe it builds on
+    ('offset', '<i8'),
+    ('keyframe', '<i8'),
+])
+# the header of an entry of the genomes file: generation, kind and number of rows
+ENTRY_HEADER = struct.Struct('<qBi')
+KEYFRAME, DELTA = 0, 1
+KEYFRAME_INTERVAL = 50
+# a keyframe is written instead of a delta if more than this fraction of the points changed
+KEYFRAME_FRACTION = 0.25
+GENOME_DTYPE = np.dtype('<i2')
+INDEX_DTYPE = np.dtype('<u4')
+
+
+def fitnessStats(fitness_values, diversity):
+    """
+    Returns the stats of a generation that are stored in the log.
+
+    fitness_values: the fitness of every painting of the generation
+    diversity: the diversity of the population, see Darwin.diversity
+    """
+    fitness_values = np.asarray(fitness_values, dtype=np.float64)
+    return {
+        'average': fitness_values.mean(),
+        'best': fitness_values.max(),
+        'median': np.median(fitness_values),
+        'std': fitness_values.std(),
+        'diversity': diversity,
+    }
+
+
+class RunLog:
+    def __init__(self, name):
+        self.name = name
+        self.stats_file = name + '.stats'
+        self.genomes_file = name + '.genomes'
+        # the state of the writer, see open
+        self.previous = None
+        self.keyframe = None
+        self.since_keyframe = 0
+
+    def exists(self):
+        return os.path.exists(self.stats_file) and os.path.exists(self.genomes_file)
+
+    def open(self, img_size, generation=0):
+        """
+        Gets the log ready to append generations after generation. A new log is created if there is none, otherwise the
+        records after generation are dropped so a run that continues from a checkpoint does not log generations twice.
+
+        img_size: the (width, height) of the target image
+        generation: optional, the last generation that is kept
+        """
+        if not self.exists():
+            with open(self.stats_file, 'wb') as file:
+                file.write(STATS_HEADER.pack(STATS_MAGIC, VERSION, *img_size))
+            with open(self.genomes_file, 'wb') as file:
+                file.write(GENOMES_HEADER.pack(GENOMES_MAGIC, VERSION))
+            self.previous, self.keyframe, self.since_keyframe = None, None, 0
+            return
+        if self.imgSize() != tuple(img_size):
+            raise ValueError(f'{self.stats_file} is a log of a {self.imgSize()} image, not {tuple(img_size)}')
+        stats = self.stats()
+        keep = int(np.searchsorted(stats['generation'], generation, side='right'))
+        if keep:
+            last = stats[keep - 1]
+            end = self.entryEnd(int(last['offset']))
+            self.keyframe = int(last['keyframe'])
+            self.since_keyframe = int(np.count_nonzero(stats['keyframe'][:keep] == self.keyframe)) - 1
+            self.previous = self.genome(int(last['generation']))
+        else:
+            end = GENOMES_HEADER.size
+            self.previous, self.keyframe, self.since_keyframe = None, None, 0
+        del stats
+        os.truncate(self.stats_file, STATS_HEADER.size + keep * STATS_DTYPE.itemsize)
+        os.truncate(self.genomes_file, end)
+
+    def append(self, generation, stats, genome):
+        """
+        Appends a generation to the log and returns the number of bytes written.
+
+        generation: the generation
+        stats: a dictionary with the average, best, median, std and diversity of the generation
+        genome: the (N, 5) best genome of the generation, at the full size of the target
+        """
+        genome = np.asarray(genome, dtype=GENOME_DTYPE)
+        changed = None
+        if self.previous is not None and self.previous.shape == genome.shape \
+                and self.since_keyframe + 1 < KEYFRAME_INTERVAL:
+            changed = np.nonzero((self.previous != genome).any(axis=1))[0]
+            if len(changed) > len(genome) * KEYFRAME_FRACTION:
+                changed = None
+        if changed is None:
+            entry = ENTRY_HEADER.pack(generation, KEYFRAME, len(genome)) + genome.tobytes()
+        else:
+            entry = ENTRY_HEADER.pack(generation, DELTA, len(changed)) + changed.astype(INDEX_DTYPE).tobytes() \
+                    + genome[changed].tobytes()
+
+        with open(self.genomes_file, 'ab') as file:
+            offset = file.tell()
+            file.write(entry)
+        if changed is None:
+            self.keyframe, self.since_keyframe = offset, 0
+        else:
+            self.since_keyframe += 1
+        record = np.zeros(1, dtype=STATS_DTYPE)
+        record['generation'] = generation
+        for key in ('average', 'best', 'median', 'std', 'diversity'):
+            record[key] = stats[key]
+        record['offset'] = offset
+        record['keyframe'] = self.keyframe
+        with open(self.stats_file, 'ab') as file:
+            file.write(record.tobytes())
+        self.previous = genome.copy()
+        return len(entry) + STATS_DTYPE.itemsize
+
+    def imgSize(self):
+        # the (width, height) of the target image of the run
+        with open(self.stats_file, 'rb') as file:
+            magic, version, width, height = STATS_HEADER.unpack(file.read(STATS_HEADER.size))
+        if magic != STATS_MAGIC:
+            raise ValueError(f'{self.stats_file} is not a run log')
+        if version > VERSION:
+            raise ValueError(f'{self.stats_file} is a version {version} log, this version can read up to {VERSION}')
+        return width, height
+
+    def stats(self):
+        """
+        Returns the records of every logged generation as a structured array with the fields of STATS_DTYPE, mapped from
+        the file so only the parts that are used are read. A half written record at the end is ignored.
+        """
+        self.imgSize()
+        count = (os.path.getsize(self.stats_file) - STATS_HEADER.size) // STATS_DTYPE.itemsize
+        if count <= 0:
+            return np.zeros(0, dtype=STATS_DTYPE)
+        return np.memmap(self.stats_file, STATS_DTYPE, 'r', STATS_HEADER.size, (count,))
+
+    def find(self, generation):
+        """
+        Returns the index of the record of a generation, or of the first logged generation after it.
+
+        generation: the generation to look for
+        """
+        return int(np.searchsorted(self.stats()['generation'], generation))
+
+    def entryEnd(self, offset):
+        # returns the offset right after the entry at offset in the genomes file
+        with open(self.genomes_file, 'rb') as file:
+            file.seek(offset)
+            _, kind, count = ENTRY_HEADER.unpack(file.read(ENTRY_HEADER.size))
+        row_size = 5 * GENOME_DTYPE.itemsize + (INDEX_DTYPE.itemsize if kind == DELTA else 0)
+        return offset + ENTRY_HEADER.size + count * row_size
+
+    def genome(self, generation):
+        """
+        Returns the best genome of a logged generation.
+
+        generation: the generation, it has to be in the log
+        """
+        stats = self.stats()
+        index = self.find(generation)
+        if index >= len(stats) or stats['generation'][index] != generation:
+            raise KeyError(f'generation {generation} is not in {self.stats_file}')
+        for _, genome in self.genomes(generation, generation + 1):
+            return genome
+
+    def genomes(self, start=None, stop=None, stride=1):
+        """
+        Yields the generation and the best genome of every logged generation from start up to but not including stop
+        whose generation is a multiple of stride. Starts reading at the keyframe before start and reads the rest of the
+        range in one pass, so a range costs about as much as reading its part of the file.
+
+        start: optional, the first generation
+        stop: optional, the generation to stop at
+        stride: optional, only generations that are a multiple of stride are returned
+        """
+        stats = self.stats()
+        first = self.find(start) if start is not None else 0
+        last = self.find(stop) if stop is not None else len(stats)
+        if first >= last:
+            return
+        end = self.entryEnd(int(stats['offset'][last - 1]))
+        genome = None
+        with open(self.genomes_file, 'rb') as file:
+            file.seek(int(stats['keyframe'][first]))
+            while file.tell() < end:
+                generation, kind, count = ENTRY_HEADER.unpack(file.read(ENTRY_HEADER.size))
+                if kind == KEYFRAME:
+                    genome = np.frombuffer(file.read(count * 5 * GENOME_DTYPE.itemsize), GENOME_DTYPE)
+                    genome = genome.reshape(count, 5).copy()
+                else:
+                    changed = np.frombuffer(file.read(count * INDEX_DTYPE.itemsize), INDEX_DTYPE)
+                    rows = np.frombuffer(file.read(count * 5 * GENOME_DTYPE.itemsize), GENOME_DTYPE)
+                    genome[changed] = rows.reshape(count, 5)
+                if (start is None or generation >= start) and generation % stride == 0:
+                    yield generation, genome.copy()
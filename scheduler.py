@@ -0,0 +1,163 @@
+"""
+This file contains the schedulers of the Darwin class. A scheduler is asked for the mutation settings of every
+generation, and is shown the fitness of every generation so it can decide to double or remove points or to stop the run.
+
+Scheduler is the fixed schedule Darwin always had: mutation_prob until late_mutation_generation and late_mutation_prob
+after it, with the full MOVEMENT_BOUND and COLOR_BOUND, doubling at double_generation and removing at remove_generation.
+
+AdaptiveScheduler follows the fitness instead:
+    - The mutation rate and the step sizes are scaled up while the best fitness keeps improving and down while it does
+      not, using the 1/5 success rule: the scale grows when more than SUCCESS_RATE of the generations set a new best.
+    - When the best fitness has not improved by min_improvement for patience generations, the next action of
+      plateau_actions ('double' or 'remove') is done and the mutation scale starts over.
+    - Once no plateau actions are left, the run stops when the best fitness improved by less than min_rate percent per
+      minute over the last window generations. Darwin saves a checkpoint when it stops, so the run can be continued.
+
+Darwin calls reset when it changes the population in a way that lowers its fitness: a move to the next resolution level
+and doubling or removing points. AdaptiveScheduler then starts over from the fitness of the changed population, so the
+best fitness of before does not count against it.
+
+Other schedulers can be plugged in by subclassing Scheduler and setting the scheduler attribute of a Darwin object.
+"""
+
+from genome import MOVEMENT_BOUND, COLOR_BOUND
+from collections import deque
+import math
+import time
+
+# the actions returned by Scheduler.update
+DOUBLE, REMOVE, STOP = 'double', 'remove', 'stop'
+# the 1/5 success rule of AdaptiveScheduler: the fraction of generations that should set a new best, and how fast the
+# scale follows it
+SUCCESS_RATE = 0.2
+ADAPT_RATE = 0.05
+MIN_SCALE, MAX_SCALE = 0.1, 2.0
+
+
+class Scheduler:
+    def mutation(self, darwin, generation):
+        """
+        Returns the mutation probability, the movement bound and the color bound of the mutations of a generation.
+
+        darwin: the Darwin object
+        generation: the generation
+        """
+        if darwin.late_mutation_generation is not None and generation >= darwin.late_mutation_generation:
+            return darwin.late_mutation_prob, MOVEMENT_BOUND, COLOR_BOUND
+        return darwin.mutation_prob, MOVEMENT_BOUND, COLOR_BOUND
+
+    def update(self, darwin, generation, sorted_fitness):
+        """
+        Looks at the fitness of a generation and returns a set of the actions Darwin should take after it: DOUBLE,
+        REMOVE and STOP.
+
+        darwin: the Darwin object
+        generation: the generation
+        sorted_fitness: the fitness values of the generation in ascending order
+        """
+        actions = set()
+        if generation == darwin.double_generation:
+            actions.add(DOUBLE)
+        if generation == darwin.remove_generation:
+            actions.add(REMOVE)
+        return actions
+
+    def reset(self, darwin, generation, best_fitness):
+        """
+        Called after the population changed in a way that lowers its fitness, like a new resolution level or doubling or
+        removing points.
+
+        darwin: the Darwin object
+        generation: the generation the change happened after
+        best_fitness: the best fitness of the changed population
+        """
+        pass
+
+    def getState(self):
+        # the state needed to continue a run exactly, stored in checkpoints
+        return {}
+
+    def setState(self, state):
+        # restores the state saved by getState
+        pass
+
+
+class AdaptiveScheduler(Scheduler):
+    def __init__(self, patience=500, min_improvement=0.01, plateau_actions=(DOUBLE,), min_rate=0.01, window=200):
+        """
+        patience: the number of generations without an improvement of min_improvement that make a plateau
+        min_improvement: the smallest improvement of the best fitness that counts
+        plateau_actions: the actions done at the first plateaus, in order, DOUBLE or REMOVE
+        min_rate: the run stops when the best fitness improves by less than this many percent per minute, None to never
+                  stop early
+        window: the number of generations the rate of improvement is measured over
+        """
+        self.patience = patience
+        self.min_improvement = min_improvement
+        self.plateau_actions = list(plateau_actions)
+        self.min_rate = min_rate
+        self.window = window
+        self.scale = 1.0
+        self.best = None
+        self.plateau_fitness = None
+        self.plateau_generation = 0
+        self.actions_taken = 0
+        # the time and the best fitness of the last window generations, this is not saved in checkpoints
+        self.history = deque(maxlen=window)
+
+    def mutation(self, darwin, generation):
+        prob, movement_bound, color_bound = super().mutation(darwin, generation)
+        return prob * self.scale, max(1, round(movement_bound * self.scale)), max(1, round(color_bound * self.scale))
+
+    def update(self, darwin, generation, sorted_fitness):
+        actions = super().update(darwin, generation, sorted_fitness)
+        best = sorted_fitness[-1]
+        # the 1/5 success rule
+        success = self.best is None or best > self.best
+        self.scale *= math.exp(ADAPT_RATE * (success - SUCCESS_RATE))
+        self.scale = min(max(self.scale, MIN_SCALE), MAX_SCALE)
+        self.best = best if self.best is None else max(self.best, best)
+
+        if self.plateau_fitness is None or best >= self.plateau_fitness + self.min_improvement:
+            self.plateau_fitness, self.plateau_generation = best, generation
+        elif generation - self.plateau_generation >= self.patience and self.actions_taken < len(self.plateau_actions):
+            actions.add(self.plateau_actions[self.actions_taken])
+            self.actions_taken += 1
+            # the population changes shape, so the search starts over
+            self.scale = 1.0
+            self.plateau_fitness, self.plateau_generation = None, generation
+            self.history.clear()
+
+        now = time.perf_counter()
+        self.history.append((now, self.best))
+        if self.min_rate is not None and self.actions_taken >= len(self.plateau_actions) and \
+                len(self.history) == self.window:
+            start, start_best = self.history[0]
+            rate = (self.best - start_best) / max(now - start, 1e-9) * 60
+            if rate < self.min_rate:
+                actions.add(STOP)
+        return actions
+
+    def reset(self, darwin, generation, best_fitness):
+        # the fitness dropped, so the search starts over from the new best instead of waiting to beat the old one
+        self.scale = 1.0
+        self.best = best_fitness
+        self.plateau_fitness, self.plateau_generation = best_fitness, generation
+        self.history.clear()
+
+    def getState(self):
+        return {
+            'scale': self.scale,
+            'best': self.best,
+            'plateau_fitness': self.plateau_fitness,
+            'plateau_generation': self.plateau_generation,
+            'actions_taken': self.actions_taken,
+        }
+
+    def setState(self, state):
+        self.scale = state.get('scale', 1.0)
+        self.best = state.get('best')
+        self.plateau_fitness = state.get('plateau_fitness')
+        self.plateau_generation = state.get('plateau_generation', 0)
+        self.actions_taken = state.get('actions_taken', 0)
+        self.history.clear()
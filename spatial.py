@@ -0,0 +1,250 @@
+"""
+This file contains the SpatialIndex class, an index over the points of a Painting that answers local questions without
+rendering anything: which point is nearest to a location, which points are within a distance of it, what the cell of a
+point looks like and which cells border it.
+
+The points are kept in a uniform grid of square buckets, about one point per bucket, so moving a point only takes it out
+of one bucket and puts it in another. The cell of a point is found the same way the Renderer finds the window of a cell:
+the painting is clipped by the bisector between the point and each of its neighbours, nearest first, until no other point
+can cut it any more. The points whose bisectors make up an edge of the clipped cell are its neighbours, which are the
+edges of the Delaunay triangulation whose shared Voronoi edge is inside the painting.
+
+Cells are worked out when they are asked for and remembered along with their reach, the distance past which no other
+point can change them: twice the distance to the furthest corner of the cell, or the distance to the furthest point
+that clipped it away for an empty cell. Moving a point only forgets the cells that reach its old or its new location, so
+the rest of the index stays valid without being built again. Points at the same location count as neighbours of each
+other: only the lowest index of them has a cell, and the next one takes it over when that point moves away.
+
+The constructor takes in 3 required parameters: seeds which is an (N, 2) array of the x, y locations of the points, and
+img_width and img_height which are the size of the painting.
+"""
+
+from renderer import clipPolygon, polygonWindow
+import numpy as np
+import math
+
+# the relative distance under which a corner of a cell counts as lying on the bisector of two points
+TOLERANCE = 1e-7
+
+
+class SpatialIndex:
+    def __init__(self, seeds, img_width, img_height):
+        self.img_width, self.img_height = img_width, img_height
+        self.seeds = np.array(seeds, dtype=np.int64).reshape(-1, 2)
+        # buckets are about the size of an average cell
+        self.bucket_size = max(1.0, math.sqrt(img_width * img_height / max(len(self.seeds), 1)))
+        self.buckets = {}
+        for i, (x, y) in enumerate(self.seeds.tolist()):
+            self.buckets.setdefault(self.bucket(x, y), []).append(i)
+        # the polygon, the neighbours and the reach of every cell that was asked for, see cell and forget
+        self.cells = {}
+        # the largest reach of the remembered cells, it is only lowered when they are all forgotten
+        self.reach = 0.0
+
+    def __len__(self):
+        return len(self.seeds)
+
+    def copy(self):
+        # a copy that can be moved without changing this index, the remembered cells are never changed so they are shared
+        index = SpatialIndex.__new__(SpatialIndex)
+        index.img_width, index.img_height, index.bucket_size = self.img_width, self.img_height, self.bucket_size
+        index.seeds = self.seeds.copy()
+        index.buckets = {key: list(bucket) for key, bucket in self.buckets.items()}
+        index.cells = dict(self.cells)
+        index.reach = self.reach
+        return index
+
+    def bucket(self, x, y):
+        # the key of the bucket holding a location
+        return math.floor(x / self.bucket_size), math.floor(y / self.bucket_size)
+
+    def move(self, i, x, y):
+        """
+        Moves point i to (x, y) and forgets the cells that the move can change.
+
+        i: the index of the point
+        x, y: the new location
+        """
+        old_x, old_y = self.seeds[i].tolist()
+        key = self.bucket(old_x, old_y)
+        bucket = self.buckets[key]
+        bucket.remove(i)
+        if not bucket:
+            del self.buckets[key]
+        self.seeds[i] = (x, y)
+        self.buckets.setdefault(self.bucket(x, y), []).append(i)
+        self.cells.pop(i, None)
+        if self.cells:
+            self.forget(old_x, old_y)
+            self.forget(x, y)
+
+    def forget(self, x, y):
+        """
+        Forgets the remembered cells that a point at (x, y) can change, the ones whose reach covers that location. This
+        includes the cells of points at the same location, whose reach is never below 0.
+
+        x, y: the location
+        """
+        found = self.within(x, y, self.reach + 1)
+        found = [j for j in found.tolist() if j in self.cells]
+        if not found:
+            return
+        distances = np.sqrt(((self.seeds[found] - (x, y)) ** 2).sum(axis=1))
+        for j, distance in zip(found, distances.tolist()):
+            # a pixel of slack for the rounding of the corners
+            if distance <= self.cells[j][2] + 1:
+                del self.cells[j]
+
+    def sync(self, seeds):
+        """
+        Moves every point whose location is different in seeds. Returns the number of points moved, or None if the
+        number of points changed, in which case the index has to be built again.
+
+        seeds: an (N, 2) array of the current x, y locations of the points
+        """
+        seeds = np.asarray(seeds, dtype=np.int64)
+        if seeds.shape != self.seeds.shape:
+            return None
+        moved = np.nonzero((seeds != self.seeds).any(axis=1))[0]
+        if 2 * len(moved) > len(self.cells):
+            # every move forgets a few cells around its two locations, past this it is cheaper to forget them all
+            self.cells = {}
+            self.reach = 0.0
+        for i in moved:
+            self.move(i, *seeds[i].tolist())
+        return len(moved)
+
+    def within(self, x, y, radius):
+        """
+        Returns the indices of the points at most radius away from (x, y).
+
+        x, y: the location
+        radius: the distance
+        """
+        bx0, by0 = self.bucket(x - radius, y - radius)
+        bx1, by1 = self.bucket(x + radius, y + radius)
+        if (bx1 - bx0 + 1) * (by1 - by0 + 1) > len(self.buckets):
+            # a large radius covers more buckets than there are points, so go through the points instead
+            keys = [key for key in self.buckets if bx0 <= key[0] <= bx1 and by0 <= key[1] <= by1]
+        else:
+            keys = [(bx, by) for bx in range(bx0, bx1 + 1) for by in range(by0, by1 + 1) if (bx, by) in self.buckets]
+        indices = np.array([i for key in keys for i in self.buckets[key]], dtype=np.int64)
+        if len(indices) == 0:
+            return indices
+        distances = ((self.seeds[indices] - (x, y)) ** 2).sum(axis=1)
+        return indices[distances <= radius * radius]
+
+    def nearest(self, x, y):
+        """
+        Returns the index of the point nearest to (x, y), the lower index if two are the same distance away like the
+        Renderer, or None if there are no points.
+
+        x, y: the location
+        """
+        if len(self.seeds) == 0:
+            return None
+        radius = self.bucket_size
+        while True:
+            found = self.within(x, y, radius)
+            if len(found):
+                distances = ((self.seeds[found] - (x, y)) ** 2).sum(axis=1)
+                return int(found[np.lexsort((found, distances))[0]])
+            radius *= 2
+
+    def cell(self, i):
+        """
+        Returns the cell of point i as a list of (x, y) corners (empty if no pixel is nearest to it) and the set of
+        indices of its neighbours.
+
+        i: the index of the point
+        """
+        if i not in self.cells:
+            self.cells[i] = self.clipCell(self.seeds[i], i)
+            self.reach = max(self.reach, self.cells[i][2])
+        return self.cells[i][:2]
+
+    def neighbours(self, i):
+        # the indices of the points whose cells share an edge with the cell of point i inside the painting
+        return self.cell(i)[1]
+
+    def cellWindow(self, i):
+        # the (y0, y1, x0, x1) window holding every pixel of the cell of point i, like Renderer.cellWindow
+        return polygonWindow(self.cell(i)[0], self.img_width, self.img_height)
+
+    def affected(self, i, x, y):
+        """
+        Returns the indices of the points whose cells change if point i moves to (x, y): the point itself and the points
+        that border it before or after the move. The index is not changed.
+
+        i: the index of the point
+        x, y: the new location
+        """
+        _, new_neighbours, _ = self.clipCell(np.array((x, y)), i)
+        return {i} | self.neighbours(i) | new_neighbours
+
+    def clipCell(self, point, i):
+        """
+        Clips the painting by the bisectors between a location and the points around it, nearest first, and returns
+        the clipped polygon, the indices of the points whose bisectors make up its edges or that are at the same
+        location, and the reach of the cell (see forget).
+
+        point: the (x, y) location of the cell
+        i: the index of the point at that location, it is left out of the clipping and wins ties by index like the
+           Renderer does
+        """
+        point = np.asarray(point, dtype=np.float64)
+        # the polygon starts as the rectangle through the centres of the corner pixels
+        polygon = [(0.0, 0.0), (self.img_width - 1.0, 0.0),
+                   (self.img_width - 1.0, self.img_height - 1.0), (0.0, self.img_height - 1.0)]
+        bisectors = {}
+        twins = set()
+        clipped = set()
+        searched = {i}
+        radius = self.bucket_size
+        # a point further than twice the distance to the furthest corner cannot cut the polygon
+        reach = math.inf
+        while polygon:
+            found = np.array([j for j in self.within(point[0], point[1], radius).tolist() if j not in searched],
+                             dtype=np.int64)
+            distances = np.sqrt(((self.seeds[found] - point) ** 2).sum(axis=1))
+            for distance, j in sorted(zip(distances.tolist(), found.tolist())):
+                if distance > reach:
+                    break
+                searched.add(j)
+                normal = self.seeds[j] - point
+                if not normal.any():
+                    twins.add(j)
+                    # a point at the same location with a lower index takes every pixel
+                    if j < i:
+                        polygon = []
+                        break
+                    continue
+                location = tuple(self.seeds[j].tolist())
+                if location in clipped:
+                    # points at the same location come by index, only the first one has a cell to border
+                    continue
+                clipped.add(location)
+                offset = (self.seeds[j] @ self.seeds[j] - point @ point) / 2
+                polygon = clipPolygon(polygon, normal, offset)
+                bisectors[j] = (normal, offset)
+                if not polygon:
+                    break
+                reach = 2 * max(math.hypot(x - point[0], y - point[1]) for x, y in polygon)
+            if not polygon or reach <= radius or len(searched) >= len(self.seeds):
+                break
+            radius *= 2
+
+        if polygon:
+            reach = 2 * max(math.hypot(x - point[0], y - point[1]) for x, y in polygon)
+        else:
+            # an empty cell only comes back if one of the points that clipped it away moves
+            reach = max([math.hypot(*normal) for normal, _ in bisectors.values()], default=0.0)
+        neighbours = twins
+        scale = TOLERANCE * (self.img_width + self.img_height)
+        for j, (normal, offset) in bisectors.items():
+            length = math.hypot(*normal)
+            corners = [(x, y) for x, y in polygon if abs(normal[0] * x + normal[1] * y - offset) <= scale * length]
+            # a bisector that only touches a corner of the cell is not an edge
+            if len(corners) >= 2 and max(math.hypot(x - corners[0][0], y - corners[0][1]) for x, y in corners) > scale:
+                neighbours.add(j)
+        return polygon, neighbours, reach
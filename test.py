@@ -4,6 +4,7 @@ It contains functions to view a painting and add text to the top left corner of
 """
 
 from PIL import Image, ImageDraw, ImageFont
+from genome import sizeFromString
 from painting import Painting
 
 
@@ -11,13 +12,15 @@ from painting import Painting
 def viewPainting(string):
     """
     This function uses a string representation of a painting to make the image associated.
+    Strings without their size in front are assumed to belong to 'Testing Images/original_image.png'.
 
     string: A string representation of a painting
     """
-    original = Image.open('Testing Images/original_image.png')
-    width, height = original.size
-    painting = Painting(string, width, height)
-    return painting.getImage()
+    size = sizeFromString(string)
+    if size is None:
+        size = Image.open('Testing Images/original_image.png').size
+    painting = Painting(string, *size)
+    return Image.fromarray(painting.getImage())
 
 def add_text_to_image(img, text):
     """
@@ -0,0 +1,14 @@
+"""
+Tests of the benchmarks (see benchmark.py). Run them with 'python3 -m pytest'.
+"""
+
+from benchmark import main
+import os
+
+
+def test_run_passes_against_its_own_results(tmp_path):
+    # the same code benchmarked twice is not a regression, the second run exits with an error if it finds one
+    baseline = os.path.join(tmp_path, 'baseline.json')
+    arguments = ['--sizes', 'small', '--points', '100', '--repeat', '3']
+    main(arguments + ['--output', baseline])
+    main(arguments + ['--output', os.path.join(tmp_path, 'results.json'), '--baseline', baseline])
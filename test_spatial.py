@@ -0,0 +1,35 @@
+"""
+Tests of the SpatialIndex class (see spatial.py). Run them with 'python3 -m pytest'.
+"""
+
+from spatial import SpatialIndex
+import numpy as np
+
+
+def randomSeeds(rng, num_points, width, height):
+    # locations in and around the painting, points outside it have cells that are empty or only touch its border
+    return np.stack([rng.integers(-20, width + 20, num_points), rng.integers(-20, height + 20, num_points)], axis=1)
+
+
+def test_sync_matches_rebuilt_index():
+    # an index moved by sync has to agree with an index built from scratch, for every remembered cell
+    rng = np.random.default_rng(0)
+    width, height = 120, 90
+    for trial in range(40):
+        num_points = int(rng.integers(5, 60))
+        seeds = randomSeeds(rng, num_points, width, height)
+        if trial % 3 == 0:
+            # points at the same location
+            seeds[1::4] = seeds[0::4][:len(seeds[1::4])]
+        index = SpatialIndex(seeds, width, height)
+        for i in range(num_points):
+            index.cell(i)
+        for _ in range(5):
+            seeds = seeds.copy()
+            moved = rng.choice(num_points, int(rng.integers(1, 4)), replace=False)
+            seeds[moved] = randomSeeds(rng, len(moved), width, height)
+            index.sync(seeds)
+            rebuilt = SpatialIndex(seeds, width, height)
+            for i in range(num_points):
+                assert index.neighbours(i) == rebuilt.neighbours(i)
+                assert index.cellWindow(i) == rebuilt.cellWindow(i)